@@ -2,8 +2,11 @@ import ctypes
 import numpy as np
 from ctypes import c_uint32, c_uint8, POINTER, Structure
 import os
+import struct
 import time
 
+from sm4_numpy import crypt_blocks, crypt_blocks_into
+
 # SM4 S-Box
 SM4_SBOX = [
     0xd6, 0x90, 0xe9, 0xfe, 0xcc, 0xe1, 0x3d, 0xb7, 0x16, 0xb6, 0x14, 0xc2, 0x28, 0xfb, 0x2c, 0x05,
@@ -40,6 +43,22 @@ SM4_CK = [
 ]
 
 
+class RoundKeys(tuple):
+    """轮密钥序列，同时保存预先计算好的解密（逆序）轮密钥，避免每次解密都反转列表"""
+
+    def __new__(cls, rk):
+        obj = super().__new__(cls, rk)
+        obj.dec = tuple(reversed(obj))
+        return obj
+
+
+def _decrypt_round_keys(round_keys):
+    """取解密轮密钥：RoundKeys直接使用预计算结果，普通列表才临时反转"""
+    if isinstance(round_keys, RoundKeys):
+        return round_keys.dec
+    return round_keys[::-1]
+
+
 class SM4_Basic:
     """基础SM4实现"""
 
@@ -93,7 +112,7 @@ class SM4_Basic:
         for i in range(32):
             k[i + 4] = k[i] ^ self._t_prime(k[i + 1] ^ k[i + 2] ^ k[i + 3] ^ SM4_CK[i])
 
-        return k[4:36]
+        return RoundKeys(k[4:36])
 
     def encrypt_block(self, plaintext, round_keys):
         """加密单个块"""
@@ -104,17 +123,13 @@ class SM4_Basic:
             new_val = x[i & 3] ^ self._t(temp)
             x[(i + 4) & 3] = new_val
 
-        # 反序变换R
-        ciphertext = b''
-        for i in range(4):
-            ciphertext += (x[3 - i]).to_bytes(4, 'big')
-
-        return ciphertext
+        # 反序变换R（一次打包，避免逐字拼接产生临时对象）
+        return struct.pack('>4I', x[3], x[2], x[1], x[0])
 
     def decrypt_block(self, ciphertext, round_keys):
         """解密单个块"""
         # SM4的解密使用相同的算法，但轮密钥顺序相反
-        return self.encrypt_block(ciphertext, round_keys[::-1])
+        return self.encrypt_block(ciphertext, _decrypt_round_keys(round_keys))
 
 
 class SM4_Optimized_V2:
@@ -173,7 +188,7 @@ class SM4_Optimized_V2:
             temp = (k[i + 1] ^ k[i + 2] ^ k[i + 3] ^ SM4_CK[i]) & 0xffffffff
             k[i + 4] = (k[i] ^ self._t_prime_fast(temp)) & 0xffffffff
 
-        return k[4:36]
+        return RoundKeys(k[4:36])
 
     def encrypt_block(self, plaintext, round_keys):
         """优化的块加密"""
@@ -200,7 +215,7 @@ class SM4_Optimized_V2:
 
     def decrypt_block(self, ciphertext, round_keys):
         """优化的块解密"""
-        return self.encrypt_block(ciphertext, round_keys[::-1])
+        return self.encrypt_block(ciphertext, _decrypt_round_keys(round_keys))
 
     def _rotl(self, x, n):
         """循环左移，确保结果在32位范围内"""
@@ -265,7 +280,7 @@ class SM4_Optimized_V2:
             temp = (k[i + 1] ^ k[i + 2] ^ k[i + 3] ^ SM4_CK[i]) & 0xffffffff
             k[i + 4] = (k[i] ^ self._t_prime_optimized(temp)) & 0xffffffff
 
-        return k[4:36]
+        return RoundKeys(k[4:36])
 
     def encrypt_block(self, plaintext, round_keys):
         """优化的块加密，确保所有操作在32位范围内"""
@@ -276,17 +291,12 @@ class SM4_Optimized_V2:
             new_val = (x[i & 3] ^ self._t_optimized(temp)) & 0xffffffff
             x[(i + 4) & 3] = new_val
 
-        # 反序变换，确保每个值都是32位
-        ciphertext = b''
-        for i in range(4):
-            val = x[3 - i] & 0xffffffff
-            ciphertext += val.to_bytes(4, 'big')
-
-        return ciphertext
+        # 反序变换（各字已在32位范围内）
+        return struct.pack('>4I', x[3], x[2], x[1], x[0])
 
     def decrypt_block(self, ciphertext, round_keys):
         """优化的块解密"""
-        return self.encrypt_block(ciphertext, round_keys[::-1])
+        return self.encrypt_block(ciphertext, _decrypt_round_keys(round_keys))
 
 
 class SM4_AESNI_Wrapper:
@@ -301,19 +311,15 @@ class SM4_AESNI_Wrapper:
 
     def encrypt_blocks_parallel(self, plaintexts, round_keys):
         """
-        并行加密多个块（模拟AES-NI的并行处理能力）
-        在真实实现中，这会使用SIMD指令同时处理多个块
+        并行加密多个块：所有完整分组载入uint32数组，32轮迭代在全部通道上同时执行
+        （末尾不足16字节的部分被忽略）
         """
-        results = []
-
-        # 模拟并行处理（实际会使用AES-NI指令）
-        for i in range(0, len(plaintexts), 16):
-            block = plaintexts[i:i + 16]
-            if len(block) == 16:
-                encrypted = self.optimized_sm4.encrypt_block(block, round_keys)
-                results.append(encrypted)
+        blocks = len(plaintexts) // 16
+        return crypt_blocks(memoryview(plaintexts)[:blocks * 16], round_keys)
 
-        return b''.join(results)
+    def encrypt_blocks_into(self, src, dst, round_keys):
+        """并行加密src中的全部分组并直接写入dst（长度需为16字节整数倍），返回写入的字节数"""
+        return crypt_blocks_into(src, dst, round_keys)
 
     def key_expansion_accelerated(self, key):
         """硬件加速的密钥扩展"""
@@ -524,6 +530,13 @@ def benchmark_sm4_implementations():
     print(f"优化实现结果: {ciphertext_optimized.hex()}")
     print(f"结果一致: {ciphertext_basic == ciphertext_optimized}")
 
+    # 批量加密测试
+    batch = plaintext * 65536  # 1MB
+    start_time = time.time()
+    ciphertext_batch = sm4_aesni.encrypt_blocks_parallel(batch, round_keys_aesni)
+    batch_time = time.time() - start_time
+    batch_ok = ciphertext_batch[:16] == ciphertext_optimized and ciphertext_batch[-16:] == ciphertext_optimized
+
     # 吞吐量计算
     print(f"\n吞吐量分析:")
     basic_throughput = (iterations * 16) / (1024 * 1024 * basic_enc_time)  # MB/s
@@ -531,63 +544,182 @@ def benchmark_sm4_implementations():
     print(f"基础实现吞吐量: {basic_throughput:.2f} MB/s")
     print(f"优化实现吞吐量: {optimized_throughput:.2f} MB/s")
     print(f"吞吐量提升: {optimized_throughput / basic_throughput:.2f}x")
+    print(f"批量并行加密吞吐量(1MB): {len(batch) / (1024 * 1024 * batch_time):.2f} MB/s "
+          f"({'✓' if batch_ok else '✗'} 结果一致)")
+
+
+# ---- AES-NI / GFNI 路径的仿射变换推导 ----
+# SM4与AES的S盒都是“仿射变换 + GF(2^8)求逆”，只是域多项式不同（0x1F5 / 0x11B）。
+# 两个域同构，同构映射φ是GF(2)上的线性变换，因此：
+#   S_sm4(x) = A·φ^(-1)(inv_aes(φ(A·x ⊕ C))) ⊕ C
+# 其中 inv_aes(z) = A_aes^(-1)·(S_aes(z) ⊕ 0x63)，S_aes 可由 AESENCLAST 计算。
+# 下面的函数推导前后两个仿射变换，sm4_AVX2.c 中的常量由 generate_c_constants() 生成。
+
+SM4_POLY = 0x1F5
+AES_POLY = 0x11B
+SM4_AFFINE_ROW = 0xA7
+SM4_AFFINE_CONST = 0xD3
+AES_AFFINE_CONST = 0x63
+
+# AESENCLAST 先做 SubBytes 再做 ShiftRows，输入先做逆 ShiftRows 抵消字节换位
+AES_INV_SHIFT_ROWS = (0, 13, 10, 7, 4, 1, 14, 11, 8, 5, 2, 15, 12, 9, 6, 3)
+
+
+def _gf_mul(a, b, poly):
+    """GF(2^8)乘法"""
+    r = 0
+    while b:
+        if b & 1:
+            r ^= a
+        b >>= 1
+        a <<= 1
+        if a & 0x100:
+            a ^= poly
+    return r
+
+
+def _gf_inv(x, poly):
+    r = 1
+    for _ in range(254 if x else 0):
+        r = _gf_mul(r, x, poly)
+    return r if x else 0
+
+
+def _matrix_rows(f):
+    """8位线性映射f的矩阵：rows[i] 的第j位表示输出位i依赖输入位j"""
+    columns = [f(1 << j) for j in range(8)]
+    return [sum(((columns[j] >> i) & 1) << j for j in range(8)) for i in range(8)]
+
+
+def _matrix_apply(rows, x):
+    return sum((bin(rows[i] & x).count('1') & 1) << i for i in range(8))
+
+
+def _sm4_affine(x):
+    return _matrix_apply([((SM4_AFFINE_ROW << i) | (SM4_AFFINE_ROW >> (8 - i))) & 0xFF for i in range(8)], x)
+
+
+_AES_AFFINE_ROWS = [0xF1, 0xE3, 0xC7, 0x8F, 0x1F, 0x3E, 0x7C, 0xF8]
+
+
+def aes_sbox():
+    """由定义计算的AES S盒"""
+    return [_matrix_apply(_AES_AFFINE_ROWS, _gf_inv(x, AES_POLY)) ^ AES_AFFINE_CONST for x in range(256)]
+
+
+def field_isomorphism():
+    """GF(2^8)/0x1F5 -> GF(2^8)/0x11B 的同构：z^i 映射为0x1F5在AES域中一个根的i次幂"""
+    for beta in range(2, 256):
+        acc, p = 0, 1
+        for i in range(9):
+            if SM4_POLY >> i & 1:
+                acc ^= p
+            p = _gf_mul(p, beta, AES_POLY)
+        if acc == 0:
+            break
+    powers = [1]
+    for _ in range(7):
+        powers.append(_gf_mul(powers[-1], beta, AES_POLY))
+    forward = [0] * 256
+    for x in range(256):
+        for i in range(8):
+            if x >> i & 1:
+                forward[x] ^= powers[i]
+    backward = [0] * 256
+    for x in range(256):
+        backward[forward[x]] = x
+    return forward, backward
+
+
+def aesni_affine_maps():
+    """返回三组 (矩阵行, 常量)：
+
+    pre       : z = φ(A·x ⊕ C)，送入AES S盒 / GFNI求逆之前
+    post_aesni: y = A·φ^(-1)·A_aes^(-1)·(s ⊕ 0x63) ⊕ C，s为AESENCLAST的输出
+    post_gfni : y = A·φ^(-1)·v ⊕ C，v为gf2p8affineinv中求逆的结果
+    """
+    forward, backward = field_isomorphism()
+    aes_affine_inv = [0] * 256
+    for x in range(256):
+        aes_affine_inv[_matrix_apply(_AES_AFFINE_ROWS, x)] = x
+    pre = _matrix_rows(lambda x: forward[_sm4_affine(x)])
+    post_gfni = _matrix_rows(lambda v: _sm4_affine(backward[v]))
+    post_aesni = _matrix_rows(lambda s: _sm4_affine(backward[aes_affine_inv[s]]))
+    return {
+        'pre': (pre, forward[SM4_AFFINE_CONST]),
+        'post_aesni': (post_aesni, _matrix_apply(post_aesni, AES_AFFINE_CONST) ^ SM4_AFFINE_CONST),
+        'post_gfni': (post_gfni, SM4_AFFINE_CONST),
+    }
+
+
+def verify_affine_maps():
+    """用两条路径重新计算SM4 S盒并与标准S盒比对"""
+    maps = aesni_affine_maps()
+    sbox = aes_sbox()
+    pre, pre_c = maps['pre']
+    post, post_c = maps['post_aesni']
+    gfni, gfni_c = maps['post_gfni']
+    via_aesni = [_matrix_apply(post, sbox[_matrix_apply(pre, x) ^ pre_c]) ^ post_c for x in range(256)]
+    via_gfni = [_matrix_apply(gfni, _gf_inv(_matrix_apply(pre, x) ^ pre_c, AES_POLY)) ^ gfni_c for x in range(256)]
+    return via_aesni == SM4_SBOX and via_gfni == SM4_SBOX
+
+
+def nibble_tables(rows, const):
+    """PSHUFB查表形式的仿射变换：y = lo[x & 0xF] ^ hi[x >> 4]（常量并入lo）"""
+    lo = [_matrix_apply(rows, n) ^ const for n in range(16)]
+    hi = [_matrix_apply(rows, n << 4) for n in range(16)]
+    return lo, hi
+
+
+def gfni_matrix(rows):
+    """GF2P8AFFINEQB的64位矩阵操作数：输出位i对应的行放在第(7 - i)个字节"""
+    return sum(rows[i] << (8 * (7 - i)) for i in range(8))
+
+
+def generate_c_constants():
+    """生成 sm4_AVX2.c 中AES-NI/GFNI路径使用的常量定义"""
+    maps = aesni_affine_maps()
+
+    def c_bytes(values):
+        return ', '.join(f'0x{v:02x}' for v in values)
+
+    lines = []
+    for name, key in (('PRE', 'pre'), ('AESNI_POST', 'post_aesni')):
+        lo, hi = nibble_tables(*maps[key])
+        lines.append(f'static const uint8_t SM4_{name}_LO[16] = {{ {c_bytes(lo)} }};')
+        lines.append(f'static const uint8_t SM4_{name}_HI[16] = {{ {c_bytes(hi)} }};')
+    lines.append(f'#define SM4_GFNI_PRE 0x{gfni_matrix(maps["pre"][0]):016x}ULL')
+    lines.append(f'#define SM4_GFNI_PRE_C 0x{maps["pre"][1]:02x}')
+    lines.append(f'#define SM4_GFNI_POST 0x{gfni_matrix(maps["post_gfni"][0]):016x}ULL')
+    lines.append(f'#define SM4_GFNI_POST_C 0x{maps["post_gfni"][1]:02x}')
+    return '\n'.join(lines)
+
+
+def aesni_native_verification():
+    """原生AES-NI/GFNI路径的验证与吞吐量对比"""
+    from sm4_native import NATIVE_IMPLS, SM4_Native
 
-
-# C扩展模板（需要单独编译）
-c_extension_template = '''
-/*
- * SM4 AES-NI优化实现的C扩展模板
- * 需要使用支持AES-NI的编译器编译
- */
-
-#include <Python.h>
-#include <wmmintrin.h>  // AES-NI
-#include <immintrin.h>  // AVX
-
-// 使用AES-NI指令优化的SM4实现
-__m128i sm4_round_aesni(__m128i state, uint32_t round_key) {
-    // 这里会使用AES-NI指令来加速SM4的非线性变换
-    // _mm_aesenc_si128等指令可以用来优化S盒查找
-
-    // 示例：使用AES的SubBytes来近似SM4的S盒变换
-    __m128i sbox_result = _mm_aesenc_si128(state, _mm_set1_epi32(round_key));
-
-    // 后续需要调整为SM4的具体变换
-    return sbox_result;
-}
-
-// Python接口函数
-static PyObject* sm4_encrypt_aesni(PyObject* self, PyObject* args) {
-    // Python C扩展接口实现
-    // ...
-}
-
-static PyMethodDef SM4Methods[] = {
-    {"encrypt_aesni", sm4_encrypt_aesni, METH_VARARGS, "SM4 AES-NI encryption"},
-    {NULL, NULL, 0, NULL}
-};
-
-static struct PyModuleDef sm4module = {
-    PyModuleDef_HEAD_INIT,
-    "sm4_aesni",
-    NULL,
-    -1,
-    SM4Methods
-};
-
-PyMODINIT_FUNC PyInit_sm4_aesni(void) {
-    return PyModule_Create(&sm4module);
-}
-'''
-
-
-def save_c_extension():
-    """保存C扩展模板到文件"""
-    with open('sm4_aesni.c', 'w') as f:
-        f.write(c_extension_template)
-    print("C扩展模板已保存到 sm4_aesni.c")
-    print("编译命令示例:")
-    print("gcc -shared -fPIC -mavx2 -maes -O3 sm4_aesni.c -o sm4_aesni.so -I/usr/include/python3.x")
+    print("\n" + "=" * 60)
+    print("AES-NI / GFNI 原生实现")
+    print("=" * 60)
+    print(f"仿射变换推导与S盒一致: {'✓' if verify_affine_maps() else '✗'}")
+    print(f"可用的原生实现: {', '.join(NATIVE_IMPLS) or '无'}")
+
+    key = bytes.fromhex('0123456789abcdeffedcba9876543210')
+    expected = bytes.fromhex('681edf34d206965e86b3e94f536e4246')
+    payload = os.urandom(16 * 1024 * 1024)
+    reference = None
+    for impl in NATIVE_IMPLS:
+        sm4 = SM4_Native(key, impl=impl)
+        # 33个分组：覆盖16/8/4路并行路径和标量尾部
+        ok = sm4.encrypt(key * 33) == expected * 33 and sm4.decrypt(expected * 33) == key * 33
+        start = time.perf_counter()
+        ct = sm4.encrypt(payload)
+        elapsed = time.perf_counter() - start
+        if reference is None:
+            reference = ct
+        ok = ok and ct == reference
+        print(f"{impl:>12}: {'✓' if ok else '✗'} {len(payload) / (1024 * 1024) / elapsed:.2f} MB/s")
 
 
 if __name__ == "__main__":
@@ -607,10 +739,10 @@ if __name__ == "__main__":
     print("优化总结:")
     print("1. 查表优化：预计算S盒和线性变换的组合")
     print("2. 向量化：使用NumPy进行批量操作")
-    print("3. AES-NI硬件加速：需要C扩展支持")
+    print("3. AES-NI/GFNI硬件加速：经仿射同构复用AES S盒（sm4_AVX2.c）")
     print("4. 并行处理：同时处理多个块")
     print("5. 内存优化：减少临时变量和内存分配")
     print("6. 算法优化：循环展开、分支预测优化")
 
-    # 保存C扩展模板
-    save_c_extension()
\ No newline at end of file
+    # 原生AES-NI/GFNI路径
+    aesni_native_verification()
\ No newline at end of file
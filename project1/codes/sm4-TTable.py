@@ -1,5 +1,18 @@
-import time
+import array
+import mmap
+import os
+import struct
+import sys
 
+from sm4 import key_schedule
+from sm4_metrics import SM4Metrics, register
+
+# 16位合并T表的持久化文件：文件头 + 两张65536项的uint32表（本机字节序）
+_ENV_WIDE_TABLE = 'SM4_TTABLE16_FILE'
+_WIDE_MAGIC = b'SM4T16' + (b'L' if sys.byteorder == 'little' else b'B') + b'\x01'
+_WIDE_ENTRIES = 1 << 16
+
+@register
 class SM4_TTable:
 
     S_BOX = [
@@ -21,92 +34,200 @@ class SM4_TTable:
         0x18, 0xf0, 0x7d, 0xec, 0x3a, 0xdc, 0x4d, 0x20, 0x79, 0xee, 0x5f, 0x3e, 0xd7, 0xcb, 0x39, 0x48
     ]
 
-    FK = [0xa3b1bac6, 0x56aa3350, 0x677d9197, 0xb27022dc]
-
-    CK = [
-        0x00070e15, 0x1c232a31, 0x383f464d, 0x545b6269,
-        0x70777e85, 0x8c939aa1, 0xa8afb6bd, 0xc4cbd2d9,
-        0xe0e7eef5, 0xfc030a11, 0x181f262d, 0x343b4249,
-        0x50575e65, 0x6c737a81, 0x888f969d, 0xa4abb2b9,
-        0xc0c7ced5, 0xdce3eaf1, 0xf8ff060d, 0x141b2229,
-        0x30373e45, 0x4c535a61, 0x686f767d, 0x848b9299,
-        0xa0a7aeb5, 0xbcc3cad1, 0xd8dfe6ed, 0xf4fb0209,
-        0x10171e25, 0x2c333a41, 0x484f565d, 0x646b7279
-    ]
+    # 性能统计接收器，为 None 时加解密不做任何计时
+    metrics = None
+
+    # T表只与S盒有关，所有实例共享，每个进程只构造一次
+    T = None
+    # 16位合并T表 (TH, TL)：T(x) = TH[x >> 16] ^ TL[x & 0xFFFF]，仅在 wide=True 时按需构造
+    T16 = None
 
-    def __init__(self, key):
+    def __init__(self, key, wide=False):
         if len(key) != 16:
             raise ValueError("密钥必须为16字节")
         self._build_tables()
-        self.rk = self._expand_key(key)
+        self.wide = wide
+        if wide:
+            if SM4_TTable.T16 is None:
+                SM4_TTable.load_wide_tables(os.environ.get(_ENV_WIDE_TABLE))
+            self._t = self._t16
+        self.rk, self.rk_dec = key_schedule(bytes(key))
 
-    def _build_tables(self):
-        self.T = [[0] * 256 for _ in range(4)]
+    @classmethod
+    def _build_tables(cls):
+        if cls.T is not None:
+            return
+        T = [[0] * 256 for _ in range(4)]
         for i in range(256):
-            s = self.S_BOX[i]
+            s = cls.S_BOX[i]
             for j in range(4):
                 val = s << (24 - 8 * j)
-                l_val = val ^ self._rotl(val, 2) ^ self._rotl(val, 10) ^ self._rotl(val, 18) ^ self._rotl(val, 24)
-                self.T[j][i] = l_val
+                l_val = val ^ cls._rotl(val, 2) ^ cls._rotl(val, 10) ^ cls._rotl(val, 18) ^ cls._rotl(val, 24)
+                T[j][i] = l_val
+        cls.T = T
+
+    @classmethod
+    def _build_wide_tables(cls):
+        """由8位T表合并出两张65536项的表（T是线性的，高/低16位的贡献可分别预先异或）
+
+        使用紧凑的uint32数组（每张256KB）：Python整数列表中的每个元素都是独立对象，
+        总占用数MB，缓存命中率反而不如8位T表。
+        """
+        cls._build_tables()
+        T0, T1, T2, T3 = cls.T
+        th = array.array('I', [a ^ b for a in T0 for b in T1])
+        tl = array.array('I', [a ^ b for a in T2 for b in T3])
+        return th, tl
+
+    @classmethod
+    def save_wide_tables(cls, path):
+        """把16位合并T表写入文件，供其他进程直接加载或mmap"""
+        th, tl = cls.T16 if cls.T16 is not None else cls._build_wide_tables()
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(_WIDE_MAGIC)
+            f.write(th)
+            f.write(tl)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load_wide_tables(cls, path=None, use_mmap=False):
+        """准备共享的16位合并T表
+
+        path为None时在内存中构造；文件存在时直接加载（use_mmap=True时只读映射，
+        多个进程共享同一份物理内存），格式不符时重新构造并覆盖；文件不存在时构造后写入。
+        """
+        if path is None:
+            cls.T16 = cls._build_wide_tables()
+            return cls.T16
+        tables = None
+        try:
+            tables = _read_wide_tables(path, use_mmap)
+        except (OSError, ValueError):
+            tables = None
+        if tables is None or not cls._check_wide_tables(*tables):
+            cls.T16 = cls._build_wide_tables()
+            try:
+                cls.save_wide_tables(path)
+            except OSError:
+                pass
+            if use_mmap:
+                try:
+                    tables = _read_wide_tables(path, True)
+                except (OSError, ValueError):
+                    return cls.T16
+                cls.T16 = tables
+            return cls.T16
+        cls.T16 = tables
+        return tables
+
+    @classmethod
+    def _check_wide_tables(cls, th, tl):
+        """抽查加载的表与8位T表是否一致（防止文件损坏或来自其他版本）"""
+        # 新进程直接加载表文件时还没有创建过实例，8位T表需要先构造
+        cls._build_tables()
+        T0, T1, T2, T3 = cls.T
+        for i in range(0, 256, 7):
+            for j in (0, i, 255):
+                h = (i << 8) | j
+                if th[h] != T0[i] ^ T1[j] or tl[h] != T2[i] ^ T3[j]:
+                    return False
+        return True
 
     @staticmethod
     def _rotl(x, n):
         return ((x << n) | (x >> (32 - n))) & 0xFFFFFFFF
 
-    def _tau(self, a):
-        return (self.S_BOX[(a >> 24) & 0xFF] << 24 |
-                self.S_BOX[(a >> 16) & 0xFF] << 16 |
-                self.S_BOX[(a >> 8) & 0xFF] << 8 |
-                self.S_BOX[a & 0xFF])
-
     def _t(self, x):
         return (self.T[0][(x >> 24) & 0xFF] ^
                 self.T[1][(x >> 16) & 0xFF] ^
                 self.T[2][(x >> 8) & 0xFF] ^
                 self.T[3][x & 0xFF])
 
-    def _t_prime(self, x):
-        s = self._tau(x)
-        return s ^ self._rotl(s, 13) ^ self._rotl(s, 23)
-
-    def _expand_key(self, key):
-        mk = [int.from_bytes(key[i:i + 4], 'big') for i in range(0, 16, 4)]
-        k = [mk[i] ^ self.FK[i] for i in range(4)]
-        rk = []
-        for i in range(32):
-            tmp = k[i + 1] ^ k[i + 2] ^ k[i + 3] ^ self.CK[i]
-            k.append(k[i] ^ self._t_prime(tmp))
-            rk.append(k[-1])
-        return rk
+    def _t16(self, x):
+        TH, TL = self.T16
+        return TH[x >> 16] ^ TL[x & 0xFFFF]
 
     def _crypt(self, data, decrypt=False):
-        start_time = time.perf_counter()
-
-        x = [int.from_bytes(data[i:i + 4], 'big') for i in range(0, 16, 4)]
-        rk = self.rk[::-1] if decrypt else self.rk
+        x = list(struct.unpack('>4I', data))
+        rk = self.rk_dec if decrypt else self.rk
 
         for i in range(32):
             x.append(self._f(x[i], x[i + 1], x[i + 2], x[i + 3], rk[i]))
 
-        result = b''.join((x[35 - i]).to_bytes(4, 'big') for i in range(4))
+        return struct.pack('>4I', x[35], x[34], x[33], x[32])
 
-        self.last_operation_time = (time.perf_counter() - start_time) * 1000  # 毫秒
-        return result
+    def _crypt_into(self, src, dst, decrypt=False):
+        """把src中的全部分组处理后直接写入dst（可以是同一缓冲区）"""
+        if len(src) % 16:
+            raise ValueError("数据长度必须是16字节的整数倍")
+        if len(dst) < len(src):
+            raise ValueError("输出缓冲区太小")
+        rk = self.rk_dec if decrypt else self.rk
+        if self.wide:
+            TH, TL = self.T16
+            for off in range(0, len(src), 16):
+                x0, x1, x2, x3 = struct.unpack_from('>4I', src, off)
+                for r in rk:
+                    t = x1 ^ x2 ^ x3 ^ r
+                    x0, x1, x2, x3 = x1, x2, x3, x0 ^ TH[t >> 16] ^ TL[t & 0xFFFF]
+                struct.pack_into('>4I', dst, off, x3, x2, x1, x0)
+            return len(src)
+        T0, T1, T2, T3 = self.T
+        for off in range(0, len(src), 16):
+            x0, x1, x2, x3 = struct.unpack_from('>4I', src, off)
+            for r in rk:
+                t = x1 ^ x2 ^ x3 ^ r
+                x0, x1, x2, x3 = x1, x2, x3, (x0 ^ T0[t >> 24] ^ T1[(t >> 16) & 0xFF] ^
+                                              T2[(t >> 8) & 0xFF] ^ T3[t & 0xFF])
+            struct.pack_into('>4I', dst, off, x3, x2, x1, x0)
+        return len(src)
 
     def _f(self, x0, x1, x2, x3, rk):
         return x0 ^ self._t(x1 ^ x2 ^ x3 ^ rk)
 
     def encrypt(self, plaintext):
-        start = time.perf_counter()
-        result = self._crypt(plaintext)
-        self.total_encrypt_time = (time.perf_counter() - start) * 1000
-        return result
+        if self.metrics is None:
+            return self._crypt(plaintext)
+        return self.metrics.measure('encrypt', self._crypt, plaintext, False)
 
     def decrypt(self, ciphertext):
-        start = time.perf_counter()
-        result = self._crypt(ciphertext, True)
-        self.total_decrypt_time = (time.perf_counter() - start) * 1000
-        return result
+        if self.metrics is None:
+            return self._crypt(ciphertext, True)
+        return self.metrics.measure('decrypt', self._crypt, ciphertext, True)
+
+    def encrypt_into(self, src, dst):
+        """ECB加密任意16字节整数倍长度的缓冲区，结果写入dst，返回写入的字节数"""
+        src, dst = memoryview(src).cast('B'), memoryview(dst).cast('B')
+        if self.metrics is None:
+            return self._crypt_into(src, dst, False)
+        return self.metrics.measure('encrypt', self._crypt_into, src, dst, False)
+
+    def decrypt_into(self, src, dst):
+        """ECB解密任意16字节整数倍长度的缓冲区，结果写入dst"""
+        src, dst = memoryview(src).cast('B'), memoryview(dst).cast('B')
+        if self.metrics is None:
+            return self._crypt_into(src, dst, True)
+        return self.metrics.measure('decrypt', self._crypt_into, src, dst, True)
+
+
+def _read_wide_tables(path, use_mmap):
+    """读取16位合并T表文件，返回 (TH, TL)；mmap方式返回两个uint32的memoryview"""
+    size = len(_WIDE_MAGIC) + 2 * _WIDE_ENTRIES * 4
+    with open(path, 'rb') as f:
+        if use_mmap:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if len(mm) != size or mm[:len(_WIDE_MAGIC)] != _WIDE_MAGIC:
+                mm.close()
+                raise ValueError("16位T表文件格式不正确")
+            words = memoryview(mm)[len(_WIDE_MAGIC):].cast('I')
+            return words[:_WIDE_ENTRIES], words[_WIDE_ENTRIES:]
+        data = f.read()
+    if len(data) != size or data[:len(_WIDE_MAGIC)] != _WIDE_MAGIC:
+        raise ValueError("16位T表文件格式不正确")
+    words = array.array('I')
+    words.frombytes(data[len(_WIDE_MAGIC):])
+    return words[:_WIDE_ENTRIES], words[_WIDE_ENTRIES:]
 
 
 def interactive_demo():
@@ -124,6 +245,7 @@ def interactive_demo():
             print(f"无效输入: {e}")
 
     sm4 = SM4_TTable(key)
+    sm4.metrics = SM4Metrics()
 
     while True:
         print("\n请选择操作:")
@@ -152,13 +274,10 @@ def interactive_demo():
         if choice == '1':
             result = sm4.encrypt(data)
             print(f"\n加密结果: {result.hex()}")
-            print(f"内部方法耗时: {sm4.last_operation_time:.6f} 毫秒")
-            print(f"总操作耗时: {sm4.total_encrypt_time:.6f} 毫秒")
         else:
             result = sm4.decrypt(data)
             print(f"\n解密结果: {result.hex()}")
-            print(f"内部方法耗时: {sm4.last_operation_time:.6f} 毫秒")
-            print(f"总操作耗时: {sm4.total_decrypt_time:.6f} 毫秒")
+        print(f"内部方法耗时: {sm4.metrics.last_latency * 1000:.6f} 毫秒")
 
         print("\n详细信息:")
         print(f"密钥: {key.hex()}")
@@ -166,6 +285,76 @@ def interactive_demo():
         print(f"输出: {result.hex()}")
 
 
+def wide_table_benchmark():
+    """8位T表与16位合并T表的对比：表准备耗时、单块与批量吞吐量"""
+    import tempfile
+    import time
+
+    print("SM4 T表模式对比")
+    print("=" * 40)
+    key = bytes.fromhex('0123456789abcdeffedcba9876543210')
+    expected = '681edf34d206965e86b3e94f536e4246'
+    data = os.urandom(64 * 1024)
+
+    start = time.perf_counter()
+    SM4_TTable.load_wide_tables()
+    print(f"16位表构造耗时: {(time.perf_counter() - start) * 1000:.2f} ms")
+    path = os.path.join(tempfile.mkdtemp(), 'sm4_t16.bin')
+    SM4_TTable.save_wide_tables(path)
+    for use_mmap in (False, True):
+        # 模拟新进程：清空已构造的8位表和16位表，未创建任何实例就直接从文件加载
+        SM4_TTable.T = SM4_TTable.T16 = None
+        start = time.perf_counter()
+        SM4_TTable.load_wide_tables(path, use_mmap=use_mmap)
+        elapsed = time.perf_counter() - start
+        loaded = isinstance(SM4_TTable.T16[0], memoryview if use_mmap else array.array)
+        print(f"16位表从文件加载{'(mmap)' if use_mmap else ''}耗时: {elapsed * 1000:.2f} ms "
+              f"{'✓' if loaded else '✗'}")
+
+    variants = [('8位T表 (4×256项)', None, False), ('16位合并表 (2×65536项)', None, True),
+                ('16位合并表 mmap', path, True)]
+    reference = None
+    for name, table_path, wide in variants:
+        if table_path:
+            SM4_TTable.load_wide_tables(table_path, use_mmap=True)
+        elif wide:
+            SM4_TTable.load_wide_tables()
+        sm4 = SM4_TTable(key, wide=wide)
+        ok = sm4.encrypt(key).hex() == expected and sm4.decrypt(bytes.fromhex(expected)) == key
+        out = bytearray(len(data))
+        # 取3次中最快的一次，减小计时抖动
+        bulk = single = 0.0
+        for _ in range(3):
+            start = time.perf_counter()
+            sm4.encrypt_into(data, out)
+            bulk = max(bulk, len(data) / (1024 * 1024) / (time.perf_counter() - start))
+            start = time.perf_counter()
+            for i in range(0, 16 * 1024, 16):
+                sm4.encrypt(data[i:i + 16])
+            single = max(single, 16 / 1024 / (time.perf_counter() - start))
+        if reference is None:
+            reference = bytes(out)
+        ok = ok and out == reference
+        print(f"{name}: {'✓' if ok else '✗'} 批量 {bulk:.2f} MB/s, 单块 {single:.2f} MB/s")
+    print("16位表共 512KB，8位表只有 4KB；L2 缓存较小时16位表可能反而更慢，应按部署环境实测选择")
+
+    # sm4_backend的各个引擎共用同一个已加载的模块，16位表只在第一次构建
+    import sm4_backend
+    times = []
+    for _ in range(3):
+        start = time.perf_counter()
+        sm4_backend.get_engine(os.urandom(16), 'ttable-wide')
+        times.append((time.perf_counter() - start) * 1000)
+    shared = sys.modules['sm4_ttable'].SM4_TTable.T16
+    sm4_backend.get_engine(os.urandom(16), 'ttable-wide')
+    ok = shared is not None and sys.modules['sm4_ttable'].SM4_TTable.T16 is shared
+    print(f"后端 'ttable-wide' 复用16位表: {'✓' if ok else '✗'} 首个引擎 {times[0]:.2f} ms, "
+          f"之后每个密钥 {max(times[1:]):.2f} ms")
+
+
 if __name__ == "__main__":
-    interactive_demo()
+    if '--benchmark' in sys.argv[1:]:
+        wide_table_benchmark()
+    else:
+        interactive_demo()
 
@@ -1,5 +1,13 @@
+import functools
+import struct
 import time
 
+from sm4_metrics import SM4Metrics, register
+
+# 密钥调度缓存容量（按密钥字节缓存加密/解密轮密钥）
+KEY_CACHE_SIZE = 4096
+
+@register
 class SM4:
 
     # S盒
@@ -37,10 +45,14 @@ class SM4:
         0x10171e25, 0x2c333a41, 0x484f565d, 0x646b7279
     ]
 
+    # 性能统计接收器（MetricsSink），可按实例或通过 sm4_metrics.set_global_sink 全局设置；
+    # 为 None 时加解密不做任何计时
+    metrics = None
+
     def __init__(self, key):
         if len(key) != 16:
             raise ValueError("SM4 密钥必须是 16 bytes (128 bits) 长")
-        self.rk = self._expand_key(key)
+        self.rk, self.rk_dec = key_schedule(bytes(key))
 
     @staticmethod
     def _rotl(x, n):
@@ -66,20 +78,23 @@ class SM4:
         """线性变换L"""
         return b ^ self._rotl(b, 2) ^ self._rotl(b, 10) ^ self._rotl(b, 18) ^ self._rotl(b, 24)
 
-    def _l_prime(self, b):
+    @staticmethod
+    def _l_prime(b):
         """线性变换L'"""
-        return b ^ self._rotl(b, 13) ^ self._rotl(b, 23)
+        return b ^ SM4._rotl(b, 13) ^ SM4._rotl(b, 23)
 
     def _t(self, x):
         """合成变换T"""
         return self._l(self._tau(x))
 
-    def _t_prime(self, x):
+    @staticmethod
+    def _t_prime(x):
         """合成变换T'"""
-        return self._l_prime(self._tau(x))
+        return SM4._l_prime(SM4._tau(x))
 
-    def _expand_key(self, key):
-        """密钥扩展算法"""
+    @staticmethod
+    def _expand_key(key):
+        """密钥扩展算法（只与密钥有关，带缓存的入口见模块级的 key_schedule）"""
         # 将密钥转换为4个字
         mk = [0] * 4
         for i in range(4):
@@ -93,7 +108,7 @@ class SM4:
         # 生成轮密钥rk
         rk = [0] * 32
         for i in range(32):
-            k[i + 4] = k[i] ^ self._t_prime(k[i + 1] ^ k[i + 2] ^ k[i + 3] ^ SM4.CK[i])
+            k[i + 4] = k[i] ^ SM4._t_prime(k[i + 1] ^ k[i + 2] ^ k[i + 3] ^ SM4.CK[i])
             rk[i] = k[i + 4]
 
         return rk
@@ -107,18 +122,14 @@ class SM4:
         if len(input_data) != 16:
             raise ValueError("SM4 block size must be 16 bytes (128 bits)")
 
-        start_time = time.perf_counter()  # 开始计时
-
         # 将输入数据转换为4个字
         x = [0] * 36
         for i in range(4):
             x[i] = (input_data[4 * i] << 24) | (input_data[4 * i + 1] << 16) | (input_data[4 * i + 2] << 8) | \
                    input_data[4 * i + 3]
 
-        # 32轮迭代
-        rk = self.rk
-        if decrypt:
-            rk = rk[::-1]  # 解密时使用逆序轮密钥
+        # 32轮迭代（解密时使用预先计算好的逆序轮密钥）
+        rk = self.rk_dec if decrypt else self.rk
 
         for i in range(32):
             x[i + 4] = self._f(x[i], x[i + 1], x[i + 2], x[i + 3], rk[i])
@@ -131,18 +142,81 @@ class SM4:
             output[4 * i + 2] = (x[35 - i] >> 8) & 0xFF
             output[4 * i + 3] = x[35 - i] & 0xFF
 
-        elapsed = (time.perf_counter() - start_time) * 1000  # 毫秒
-        self.last_operation_time = elapsed
-
         return bytes(output)
 
+    def _crypt_into(self, src, dst, decrypt=False):
+        """逐块处理src中的全部分组并直接写入dst，不产生临时bytes对象"""
+        if len(src) % 16:
+            raise ValueError("数据长度必须是16字节的整数倍")
+        if len(dst) < len(src):
+            raise ValueError("输出缓冲区太小")
+        rk = self.rk_dec if decrypt else self.rk
+        f = self._f
+        for off in range(0, len(src), 16):
+            x0, x1, x2, x3 = struct.unpack_from('>4I', src, off)
+            for r in rk:
+                x0, x1, x2, x3 = x1, x2, x3, f(x0, x1, x2, x3, r)
+            struct.pack_into('>4I', dst, off, x3, x2, x1, x0)
+        return len(src)
+
     def encrypt(self, plaintext):
         """加密"""
-        return self._crypt(plaintext, decrypt=False)
+        if self.metrics is None:
+            return self._crypt(plaintext, False)
+        return self.metrics.measure('encrypt', self._crypt, plaintext, False)
 
     def decrypt(self, ciphertext):
         """解密"""
-        return self._crypt(ciphertext, decrypt=True)
+        if self.metrics is None:
+            return self._crypt(ciphertext, True)
+        return self.metrics.measure('decrypt', self._crypt, ciphertext, True)
+
+    def encrypt_into(self, src, dst):
+        """ECB加密src（bytes/bytearray/memoryview/NumPy数组，长度为16字节整数倍），结果写入dst
+
+        dst可以与src是同一个缓冲区（原地加密），返回写入的字节数。
+        """
+        src, dst = memoryview(src).cast('B'), memoryview(dst).cast('B')
+        if self.metrics is None:
+            return self._crypt_into(src, dst, False)
+        return self.metrics.measure('encrypt', self._crypt_into, src, dst, False)
+
+    def decrypt_into(self, src, dst):
+        """ECB解密src，结果写入dst"""
+        src, dst = memoryview(src).cast('B'), memoryview(dst).cast('B')
+        if self.metrics is None:
+            return self._crypt_into(src, dst, True)
+        return self.metrics.measure('decrypt', self._crypt_into, src, dst, True)
+
+
+@functools.lru_cache(maxsize=KEY_CACHE_SIZE)
+def key_schedule(key):
+    """LRU缓存的密钥调度，返回(加密轮密钥, 解密轮密钥)两个元组
+
+    SM4 与 sm4-TTable.py 的 SM4_TTable 共用这一个缓存。
+    """
+    rk = tuple(SM4._expand_key(key))
+    return rk, rk[::-1]
+
+
+def key_cache_info():
+    """密钥调度缓存的命中统计"""
+    return key_schedule.cache_info()
+
+
+def clear_key_cache():
+    """清空密钥调度缓存"""
+    key_schedule.cache_clear()
+
+
+def new(key, mode='ECB', iv=None, backend='auto', decrypt=False, padding=None):
+    """创建任意长度数据的SM4加解密对象
+
+    backend='auto' 时按批量大小自动选择最快的已验证后端（见 sm4_backend.py），
+    也可以指定 'python'、'numpy'、'native-avx2' 等具体后端。
+    """
+    from sm4_backend import new as _new
+    return _new(key, mode, iv, backend=backend, decrypt=decrypt, padding=padding)
 
 
 def interactive_demo():
@@ -161,6 +235,7 @@ def interactive_demo():
             print(f"无效输入: {e}")
 
     sm4 = SM4(key)
+    sm4.metrics = SM4Metrics()
 
     while True:
         print("\n请选择操作:")
@@ -197,7 +272,7 @@ def interactive_demo():
         elapsed = (time.perf_counter() - start_time) * 1000  # 毫秒
 
         print(f"\n{operation}结果: {result.hex()}")
-        print(f"内部方法耗时: {sm4.last_operation_time:.6f} 毫秒")
+        print(f"内部方法耗时: {sm4.metrics.last_latency * 1000:.6f} 毫秒")
         print(f"总操作耗时: {elapsed:.6f} 毫秒")
 
         # 显示详细信息
@@ -1,255 +1,613 @@
-#include <immintrin.h>
-#include <stdint.h>
-#include <stddef.h>
-#include <stdio.h>
-#include <string.h>
-
-// ====================== 常量 ======================
-static const uint32_t SM4_CK[32] = {
-    0x00070e15, 0x1c232a31, 0x383f464d, 0x545b6269,
-    0x70777e85, 0x8c939aa1, 0xa8afb6bd, 0xc4cbd2d9,
-    0xe0e7eef5, 0xfc030a11, 0x181f262d, 0x343b4249,
-    0x50575e65, 0x6c737a81, 0x888f969d, 0xa4abb2b9,
-    0xc0c7ced5, 0xdce3eaf1, 0xf8ff060d, 0x141b2229,
-    0x30373e45, 0x4c535a61, 0x686f767d, 0x848b9299,
-    0xa0a7aeb5, 0xbcc3cad1, 0xd8dfe6ed, 0xf4fb0209,
-    0x10171e25, 0x2c333a41, 0x484f565d, 0x646b7279
-};
-static const uint32_t SM4_FK[4] = { 0xa3b1bac6, 0x56aa3350, 0x677d9197, 0xb27022dc };
-
-static const uint8_t SM4_SBOX[256] = {
-    0xd6,0x90,0xe9,0xfe,0xcc,0xe1,0x3d,0xb7,0x16,0xb6,0x14,0xc2,0x28,0xfb,0x2c,0x05,
-    0x2b,0x67,0x9a,0x76,0x2a,0xbe,0x04,0xc3,0xaa,0x44,0x13,0x26,0x49,0x86,0x06,0x99,
-    0x9c,0x42,0x50,0xf4,0x91,0xef,0x98,0x7a,0x33,0x54,0x0b,0x43,0xed,0xcf,0xac,0x62,
-    0xe4,0xb3,0x1c,0xa9,0xc9,0x08,0xe8,0x95,0x80,0xdf,0x94,0xfa,0x75,0x8f,0x3f,0xa6,
-    0x47,0x07,0xa7,0xfc,0xf3,0x73,0x17,0xba,0x83,0x59,0x3c,0x19,0xe6,0x85,0x4f,0xa8,
-    0x68,0x6b,0x81,0xb2,0x71,0x64,0xda,0x8b,0xf8,0xeb,0x0f,0x4b,0x70,0x56,0x9d,0x35,
-    0x1e,0x24,0x0e,0x5e,0x63,0x58,0xd1,0xa2,0x25,0x22,0x7c,0x3b,0x01,0x21,0x78,0x87,
-    0xd4,0x00,0x46,0x57,0x9f,0xd3,0x27,0x52,0x4c,0x36,0x02,0xe7,0xa0,0xc4,0xc8,0x9e,
-    0xea,0xbf,0x8a,0xd2,0x40,0xc7,0x38,0xb5,0xa3,0xf7,0xf2,0xce,0xf9,0x61,0x15,0xa1,
-    0xe0,0xae,0x5d,0xa4,0x9b,0x34,0x1a,0x55,0xad,0x93,0x32,0x30,0xf5,0x8c,0xb1,0xe3,
-    0x1d,0xf6,0xe2,0x2e,0x82,0x66,0xca,0x60,0xc0,0x29,0x23,0xab,0x0d,0x53,0x4e,0x6f,
-    0xd5,0xdb,0x37,0x45,0xde,0xfd,0x8e,0x2f,0x03,0xff,0x6a,0x72,0x6d,0x6c,0x5b,0x51,
-    0x8d,0x1b,0xaf,0x92,0xbb,0xdd,0xbc,0x7f,0x11,0xd9,0x5c,0x41,0x1f,0x10,0x5a,0xd8,
-    0x0a,0xc1,0x31,0x88,0xa5,0xcd,0x7b,0xbd,0x2d,0x74,0xd0,0x12,0xb8,0xe5,0xb4,0xb0,
-    0x89,0x69,0x97,0x4a,0x0c,0x96,0x77,0x7e,0x65,0xb9,0xf1,0x09,0xc5,0x6e,0xc6,0x84,
-    0x18,0xf0,0x7d,0xec,0x3a,0xdc,0x4d,0x20,0x79,0xee,0x5f,0x3e,0xd7,0xcb,0x39,0x48
-};
-
-// ====================== 工具函数 ======================
-static inline uint32_t rotl32(uint32_t x, int r) {
-    return (x << r) | (x >> (32 - r));
-}
-static inline uint32_t load_be32(const uint8_t* p) {
-    return ((uint32_t)p[0] << 24) | ((uint32_t)p[1] << 16) | ((uint32_t)p[2] << 8) | p[3];
-}
-static inline void store_be32(uint8_t* p, uint32_t v) {
-    p[0] = (uint8_t)(v >> 24);
-    p[1] = (uint8_t)(v >> 16);
-    p[2] = (uint8_t)(v >> 8);
-    p[3] = (uint8_t)(v);
-}
-
-// 标量 S-box 作用于 32 位
-static inline uint32_t sbox_word32(uint32_t x) {
-    uint32_t b0 = SM4_SBOX[(x >> 24) & 0xFF];
-    uint32_t b1 = SM4_SBOX[(x >> 16) & 0xFF];
-    uint32_t b2 = SM4_SBOX[(x >> 8) & 0xFF];
-    uint32_t b3 = SM4_SBOX[x & 0xFF];
-    return (b0 << 24) | (b1 << 16) | (b2 << 8) | b3;
-}
-static inline uint32_t L_scalar(uint32_t b) {
-    return b ^ rotl32(b, 2) ^ rotl32(b, 10) ^ rotl32(b, 18) ^ rotl32(b, 24);
-}
-static inline uint32_t Lp_scalar(uint32_t b) {
-    return b ^ rotl32(b, 13) ^ rotl32(b, 23);
-}
-static inline uint32_t T_scalar(uint32_t x) { return L_scalar(sbox_word32(x)); }
-static inline uint32_t Tp_scalar(uint32_t x) { return Lp_scalar(sbox_word32(x)); }
-
-// ====================== 轮密钥扩展 ======================
-static void sm4_key_expand(const uint8_t key[16], uint32_t rk_enc[32], uint32_t rk_dec[32]) {
-    uint32_t MK[4], K[36];
-    for (int i = 0; i < 4; i++) {
-        MK[i] = load_be32(key + 4 * i);
-    }
-    for (int i = 0; i < 4; i++) {
-        K[i] = MK[i] ^ SM4_FK[i];
-    }
-    for (int i = 0; i < 32; i++) {
-        uint32_t t = K[i + 1] ^ K[i + 2] ^ K[i + 3] ^ SM4_CK[i];
-        K[i + 4] = K[i] ^ Tp_scalar(t);
-        rk_enc[i] = K[i + 4];
-    }
-    // 解密轮密钥是加密轮密钥的逆序
-    for (int i = 0; i < 32; i++) {
-        rk_dec[i] = rk_enc[31 - i];
-    }
-}
-
-// ====================== AVX2 实现（8 块并行） ======================
-static uint32_t SM4_SBOX32[256];
-static int sm4_tables_ready = 0;
-static void sm4_init_tables(void) {
-    if (!sm4_tables_ready) {
-        for (int i = 0; i < 256; i++) SM4_SBOX32[i] = SM4_SBOX[i];
-        sm4_tables_ready = 1;
-    }
-}
-
-static inline __m256i rotl32_avx2(__m256i x, int r) {
-    return _mm256_or_si256(_mm256_slli_epi32(x, r), _mm256_srli_epi32(x, 32 - r));
-}
-
-static inline __m256i sbox_bytes_avx2(__m256i x) {
-    const __m256i mask_ff = _mm256_set1_epi32(0xFF);
-    __m256i i0 = _mm256_and_si256(x, mask_ff);
-    __m256i i1 = _mm256_and_si256(_mm256_srli_epi32(x, 8), mask_ff);
-    __m256i i2 = _mm256_and_si256(_mm256_srli_epi32(x, 16), mask_ff);
-    __m256i i3 = _mm256_and_si256(_mm256_srli_epi32(x, 24), mask_ff);
-
-    __m256i g0 = _mm256_i32gather_epi32((const int*)SM4_SBOX32, i0, 4);
-    __m256i g1 = _mm256_i32gather_epi32((const int*)SM4_SBOX32, i1, 4);
-    __m256i g2 = _mm256_i32gather_epi32((const int*)SM4_SBOX32, i2, 4);
-    __m256i g3 = _mm256_i32gather_epi32((const int*)SM4_SBOX32, i3, 4);
-
-    g1 = _mm256_slli_epi32(g1, 8);
-    g2 = _mm256_slli_epi32(g2, 16);
-    g3 = _mm256_slli_epi32(g3, 24);
-
-    return _mm256_or_si256(_mm256_or_si256(g0, g1), _mm256_or_si256(g2, g3));
-}
-
-static inline __m256i T_avx2(__m256i x) {
-    __m256i b = sbox_bytes_avx2(x);
-    __m256i r2 = rotl32_avx2(b, 2);
-    __m256i r10 = rotl32_avx2(b, 10);
-    __m256i r18 = rotl32_avx2(b, 18);
-    __m256i r24 = rotl32_avx2(b, 24);
-    return _mm256_xor_si256(_mm256_xor_si256(_mm256_xor_si256(_mm256_xor_si256(b, r2), r10), r18), r24);
-}
-
-static void sm4_crypt8_blocks_avx2(const uint8_t* in, uint8_t* out, const uint32_t rk[32], int is_decrypt) {
-    sm4_init_tables();
-
-    uint32_t x0[8], x1[8], x2[8], x3[8];
-    for (int b = 0; b < 8; b++) {
-        const uint8_t* p = in + 16 * b;
-        x0[b] = load_be32(p + 0);
-        x1[b] = load_be32(p + 4);
-        x2[b] = load_be32(p + 8);
-        x3[b] = load_be32(p + 12);
-    }
-
-    __m256i X0 = _mm256_loadu_si256((const __m256i*)x0);
-    __m256i X1 = _mm256_loadu_si256((const __m256i*)x1);
-    __m256i X2 = _mm256_loadu_si256((const __m256i*)x2);
-    __m256i X3 = _mm256_loadu_si256((const __m256i*)x3);
-
-    for (int r = 0; r < 32; r++) {
-        __m256i t = _mm256_xor_si256(_mm256_xor_si256(X1, X2), X3);
-        t = _mm256_xor_si256(t, _mm256_set1_epi32(rk[r]));
-        __m256i tt = T_avx2(t);
-        __m256i newX0 = _mm256_xor_si256(X0, tt);
-        X0 = X1; X1 = X2; X2 = X3; X3 = newX0;
-    }
-
-    // 解密时需要反转输出顺序（与加密一致）
-    _mm256_storeu_si256((__m256i*)x0, X3);
-    _mm256_storeu_si256((__m256i*)x1, X2);
-    _mm256_storeu_si256((__m256i*)x2, X1);
-    _mm256_storeu_si256((__m256i*)x3, X0);
-
-    for (int b = 0; b < 8; b++) {
-        uint8_t* q = out + 16 * b;
-        store_be32(q + 0, x0[b]);
-        store_be32(q + 4, x1[b]);
-        store_be32(q + 8, x2[b]);
-        store_be32(q + 12, x3[b]);
-    }
-}
-
-// 标量单块加密/解密
-static void sm4_crypt_block_scalar(const uint8_t in[16], uint8_t out[16], const uint32_t rk[32], int is_decrypt) {
-    uint32_t X[4];
-    X[0] = load_be32(in + 0);
-    X[1] = load_be32(in + 4);
-    X[2] = load_be32(in + 8);
-    X[3] = load_be32(in + 12);
-
-    for (int r = 0; r < 32; r++) {
-        uint32_t t = X[1] ^ X[2] ^ X[3] ^ rk[r];
-        uint32_t newX = X[0] ^ T_scalar(t);
-        X[0] = X[1]; X[1] = X[2]; X[2] = X[3]; X[3] = newX;
-    }
-
-    store_be32(out + 0, X[3]);
-    store_be32(out + 4, X[2]);
-    store_be32(out + 8, X[1]);
-    store_be32(out + 12, X[0]);
-}
-
-// ====================== 公共接口 ======================
-void sm4_ecb_crypt_avx2(const uint8_t* in, uint8_t* out, size_t blocks, const uint8_t key[16], int is_decrypt) {
-    uint32_t rk_enc[32], rk_dec[32];
-    sm4_key_expand(key, rk_enc, rk_dec);
-    const uint32_t* rk = is_decrypt ? rk_dec : rk_enc;
-
-    size_t i = 0;
-    for (; i + 8 <= blocks; i += 8) {
-        sm4_crypt8_blocks_avx2(in + i * 16, out + i * 16, rk, is_decrypt);
-    }
-    for (; i < blocks; i++) {
-        sm4_crypt_block_scalar(in + i * 16, out + i * 16, rk, is_decrypt);
-    }
-}
-
-// ====================== 测试 ======================
-int main(void) {
-    // 标准测试向量
-    const uint8_t key[16] = {
-        0x01,0x23,0x45,0x67, 0x89,0xab,0xcd,0xef,
-        0xfe,0xdc,0xba,0x98, 0x76,0x54,0x32,0x10
-    };
-    const uint8_t pt[16] = {
-        0x01,0x23,0x45,0x67, 0x89,0xab,0xcd,0xef,
-        0xfe,0xdc,0xba,0x98, 0x76,0x54,0x32,0x10
-    };
-    const uint8_t ct_expected[16] = {
-        0x68,0x1e,0xdf,0x34, 0xd2,0x06,0x96,0x5e,
-        0x86,0xb3,0xe9,0x4f, 0x53,0x6e,0x42,0x46
-    };
-
-    // 测试加密
-    uint8_t ct[16];
-    sm4_ecb_crypt_avx2(pt, ct, 1, key, 0);
-    int ok = memcmp(ct, ct_expected, 16) == 0;
-    printf("SM4 AVX2 ECB encrypt test: %s\n", ok ? "PASS" : "FAIL");
-
-    // 测试解密
-    uint8_t decrypted[16];
-    sm4_ecb_crypt_avx2(ct, decrypted, 1, key, 1);
-    ok &= memcmp(decrypted, pt, 16) == 0;
-    printf("SM4 AVX2 ECB decrypt test: %s\n", ok ? "PASS" : "FAIL");
-
-    // 打印结果
-    if (ok) {
-        printf("Plaintext:  ");
-        for (int i = 0; i < 16; i++) printf("%02x", pt[i]);
-        printf("\nCiphertext: ");
-        for (int i = 0; i < 16; i++) printf("%02x", ct[i]);
-        printf("\nDecrypted:  ");
-        for (int i = 0; i < 16; i++) printf("%02x", decrypted[i]);
-        printf("\n");
-    }
-    else {
-        printf("Expected ciphertext: ");
-        for (int i = 0; i < 16; i++) printf("%02x", ct_expected[i]);
-        printf("\nActual ciphertext:  ");
-        for (int i = 0; i < 16; i++) printf("%02x", ct[i]);
-        printf("\n");
-    }
-
-    return ok ? 0 : 1;
-}
-
+#include <immintrin.h>
+#include <stdint.h>
+#include <stddef.h>
+#include <stdio.h>
+#include <string.h>
+
+// 编译为共享库时（-DSM4_BUILD_SHARED）导出公共接口，并去掉 main 测试
+#if defined(_WIN32)
+#define SM4_API __declspec(dllexport)
+#else
+#define SM4_API __attribute__((visibility("default")))
+#endif
+
+// AVX2 函数单独指定目标指令集，整个文件无需 -mavx2 也能编译，运行时再按 CPU 选择路径
+#if defined(__GNUC__) || defined(__clang__)
+#define SM4_TARGET_AVX2 __attribute__((target("avx2")))
+#define SM4_TARGET_AESNI __attribute__((target("aes,ssse3")))
+#define SM4_TARGET_GFNI __attribute__((target("avx2,gfni")))
+#define SM4_TARGET_GFNI512 __attribute__((target("avx512f,avx512bw,gfni")))
+#else
+#define SM4_TARGET_AVX2
+#define SM4_TARGET_AESNI
+#define SM4_TARGET_GFNI
+#define SM4_TARGET_GFNI512
+#endif
+
+// 批量路径（数值越大越快，运行时选择 CPU 支持的最高一级）
+#define SM4_IMPL_SCALAR 0
+#define SM4_IMPL_AVX2 1     // AVX2 gather 查 S 盒，8 块并行
+#define SM4_IMPL_AESNI 2    // AES-NI 计算 S 盒，4 块并行
+#define SM4_IMPL_GFNI 3     // GFNI + AVX2，8 块并行
+#define SM4_IMPL_GFNI512 4  // GFNI + AVX-512，16 块并行
+
+// ====================== 常量 ======================
+static const uint32_t SM4_CK[32] = {
+    0x00070e15, 0x1c232a31, 0x383f464d, 0x545b6269,
+    0x70777e85, 0x8c939aa1, 0xa8afb6bd, 0xc4cbd2d9,
+    0xe0e7eef5, 0xfc030a11, 0x181f262d, 0x343b4249,
+    0x50575e65, 0x6c737a81, 0x888f969d, 0xa4abb2b9,
+    0xc0c7ced5, 0xdce3eaf1, 0xf8ff060d, 0x141b2229,
+    0x30373e45, 0x4c535a61, 0x686f767d, 0x848b9299,
+    0xa0a7aeb5, 0xbcc3cad1, 0xd8dfe6ed, 0xf4fb0209,
+    0x10171e25, 0x2c333a41, 0x484f565d, 0x646b7279
+};
+static const uint32_t SM4_FK[4] = { 0xa3b1bac6, 0x56aa3350, 0x677d9197, 0xb27022dc };
+
+static const uint8_t SM4_SBOX[256] = {
+    0xd6,0x90,0xe9,0xfe,0xcc,0xe1,0x3d,0xb7,0x16,0xb6,0x14,0xc2,0x28,0xfb,0x2c,0x05,
+    0x2b,0x67,0x9a,0x76,0x2a,0xbe,0x04,0xc3,0xaa,0x44,0x13,0x26,0x49,0x86,0x06,0x99,
+    0x9c,0x42,0x50,0xf4,0x91,0xef,0x98,0x7a,0x33,0x54,0x0b,0x43,0xed,0xcf,0xac,0x62,
+    0xe4,0xb3,0x1c,0xa9,0xc9,0x08,0xe8,0x95,0x80,0xdf,0x94,0xfa,0x75,0x8f,0x3f,0xa6,
+    0x47,0x07,0xa7,0xfc,0xf3,0x73,0x17,0xba,0x83,0x59,0x3c,0x19,0xe6,0x85,0x4f,0xa8,
+    0x68,0x6b,0x81,0xb2,0x71,0x64,0xda,0x8b,0xf8,0xeb,0x0f,0x4b,0x70,0x56,0x9d,0x35,
+    0x1e,0x24,0x0e,0x5e,0x63,0x58,0xd1,0xa2,0x25,0x22,0x7c,0x3b,0x01,0x21,0x78,0x87,
+    0xd4,0x00,0x46,0x57,0x9f,0xd3,0x27,0x52,0x4c,0x36,0x02,0xe7,0xa0,0xc4,0xc8,0x9e,
+    0xea,0xbf,0x8a,0xd2,0x40,0xc7,0x38,0xb5,0xa3,0xf7,0xf2,0xce,0xf9,0x61,0x15,0xa1,
+    0xe0,0xae,0x5d,0xa4,0x9b,0x34,0x1a,0x55,0xad,0x93,0x32,0x30,0xf5,0x8c,0xb1,0xe3,
+    0x1d,0xf6,0xe2,0x2e,0x82,0x66,0xca,0x60,0xc0,0x29,0x23,0xab,0x0d,0x53,0x4e,0x6f,
+    0xd5,0xdb,0x37,0x45,0xde,0xfd,0x8e,0x2f,0x03,0xff,0x6a,0x72,0x6d,0x6c,0x5b,0x51,
+    0x8d,0x1b,0xaf,0x92,0xbb,0xdd,0xbc,0x7f,0x11,0xd9,0x5c,0x41,0x1f,0x10,0x5a,0xd8,
+    0x0a,0xc1,0x31,0x88,0xa5,0xcd,0x7b,0xbd,0x2d,0x74,0xd0,0x12,0xb8,0xe5,0xb4,0xb0,
+    0x89,0x69,0x97,0x4a,0x0c,0x96,0x77,0x7e,0x65,0xb9,0xf1,0x09,0xc5,0x6e,0xc6,0x84,
+    0x18,0xf0,0x7d,0xec,0x3a,0xdc,0x4d,0x20,0x79,0xee,0x5f,0x3e,0xd7,0xcb,0x39,0x48
+};
+
+// ====================== 工具函数 ======================
+static inline uint32_t rotl32(uint32_t x, int r) {
+    return (x << r) | (x >> (32 - r));
+}
+static inline uint32_t load_be32(const uint8_t* p) {
+    return ((uint32_t)p[0] << 24) | ((uint32_t)p[1] << 16) | ((uint32_t)p[2] << 8) | p[3];
+}
+static inline void store_be32(uint8_t* p, uint32_t v) {
+    p[0] = (uint8_t)(v >> 24);
+    p[1] = (uint8_t)(v >> 16);
+    p[2] = (uint8_t)(v >> 8);
+    p[3] = (uint8_t)(v);
+}
+
+// 标量 S-box 作用于 32 位
+static inline uint32_t sbox_word32(uint32_t x) {
+    uint32_t b0 = SM4_SBOX[(x >> 24) & 0xFF];
+    uint32_t b1 = SM4_SBOX[(x >> 16) & 0xFF];
+    uint32_t b2 = SM4_SBOX[(x >> 8) & 0xFF];
+    uint32_t b3 = SM4_SBOX[x & 0xFF];
+    return (b0 << 24) | (b1 << 16) | (b2 << 8) | b3;
+}
+static inline uint32_t L_scalar(uint32_t b) {
+    return b ^ rotl32(b, 2) ^ rotl32(b, 10) ^ rotl32(b, 18) ^ rotl32(b, 24);
+}
+static inline uint32_t Lp_scalar(uint32_t b) {
+    return b ^ rotl32(b, 13) ^ rotl32(b, 23);
+}
+static inline uint32_t T_scalar(uint32_t x) { return L_scalar(sbox_word32(x)); }
+static inline uint32_t Tp_scalar(uint32_t x) { return Lp_scalar(sbox_word32(x)); }
+
+// ====================== 轮密钥扩展 ======================
+SM4_API void sm4_key_expand(const uint8_t key[16], uint32_t rk_enc[32], uint32_t rk_dec[32]) {
+    uint32_t MK[4], K[36];
+    for (int i = 0; i < 4; i++) {
+        MK[i] = load_be32(key + 4 * i);
+    }
+    for (int i = 0; i < 4; i++) {
+        K[i] = MK[i] ^ SM4_FK[i];
+    }
+    for (int i = 0; i < 32; i++) {
+        uint32_t t = K[i + 1] ^ K[i + 2] ^ K[i + 3] ^ SM4_CK[i];
+        K[i + 4] = K[i] ^ Tp_scalar(t);
+        rk_enc[i] = K[i + 4];
+    }
+    // 解密轮密钥是加密轮密钥的逆序
+    for (int i = 0; i < 32; i++) {
+        rk_dec[i] = rk_enc[31 - i];
+    }
+}
+
+// ====================== AVX2 实现（8 块并行） ======================
+// S 盒扩展为 32 位，供 gather 按 4 字节步长读取；编译期初始化的只读表，多线程并发调用无需同步
+static const uint32_t SM4_SBOX32[256] = {
+    0xd6, 0x90, 0xe9, 0xfe, 0xcc, 0xe1, 0x3d, 0xb7,
+    0x16, 0xb6, 0x14, 0xc2, 0x28, 0xfb, 0x2c, 0x05,
+    0x2b, 0x67, 0x9a, 0x76, 0x2a, 0xbe, 0x04, 0xc3,
+    0xaa, 0x44, 0x13, 0x26, 0x49, 0x86, 0x06, 0x99,
+    0x9c, 0x42, 0x50, 0xf4, 0x91, 0xef, 0x98, 0x7a,
+    0x33, 0x54, 0x0b, 0x43, 0xed, 0xcf, 0xac, 0x62,
+    0xe4, 0xb3, 0x1c, 0xa9, 0xc9, 0x08, 0xe8, 0x95,
+    0x80, 0xdf, 0x94, 0xfa, 0x75, 0x8f, 0x3f, 0xa6,
+    0x47, 0x07, 0xa7, 0xfc, 0xf3, 0x73, 0x17, 0xba,
+    0x83, 0x59, 0x3c, 0x19, 0xe6, 0x85, 0x4f, 0xa8,
+    0x68, 0x6b, 0x81, 0xb2, 0x71, 0x64, 0xda, 0x8b,
+    0xf8, 0xeb, 0x0f, 0x4b, 0x70, 0x56, 0x9d, 0x35,
+    0x1e, 0x24, 0x0e, 0x5e, 0x63, 0x58, 0xd1, 0xa2,
+    0x25, 0x22, 0x7c, 0x3b, 0x01, 0x21, 0x78, 0x87,
+    0xd4, 0x00, 0x46, 0x57, 0x9f, 0xd3, 0x27, 0x52,
+    0x4c, 0x36, 0x02, 0xe7, 0xa0, 0xc4, 0xc8, 0x9e,
+    0xea, 0xbf, 0x8a, 0xd2, 0x40, 0xc7, 0x38, 0xb5,
+    0xa3, 0xf7, 0xf2, 0xce, 0xf9, 0x61, 0x15, 0xa1,
+    0xe0, 0xae, 0x5d, 0xa4, 0x9b, 0x34, 0x1a, 0x55,
+    0xad, 0x93, 0x32, 0x30, 0xf5, 0x8c, 0xb1, 0xe3,
+    0x1d, 0xf6, 0xe2, 0x2e, 0x82, 0x66, 0xca, 0x60,
+    0xc0, 0x29, 0x23, 0xab, 0x0d, 0x53, 0x4e, 0x6f,
+    0xd5, 0xdb, 0x37, 0x45, 0xde, 0xfd, 0x8e, 0x2f,
+    0x03, 0xff, 0x6a, 0x72, 0x6d, 0x6c, 0x5b, 0x51,
+    0x8d, 0x1b, 0xaf, 0x92, 0xbb, 0xdd, 0xbc, 0x7f,
+    0x11, 0xd9, 0x5c, 0x41, 0x1f, 0x10, 0x5a, 0xd8,
+    0x0a, 0xc1, 0x31, 0x88, 0xa5, 0xcd, 0x7b, 0xbd,
+    0x2d, 0x74, 0xd0, 0x12, 0xb8, 0xe5, 0xb4, 0xb0,
+    0x89, 0x69, 0x97, 0x4a, 0x0c, 0x96, 0x77, 0x7e,
+    0x65, 0xb9, 0xf1, 0x09, 0xc5, 0x6e, 0xc6, 0x84,
+    0x18, 0xf0, 0x7d, 0xec, 0x3a, 0xdc, 0x4d, 0x20,
+    0x79, 0xee, 0x5f, 0x3e, 0xd7, 0xcb, 0x39, 0x48
+};
+
+SM4_TARGET_AVX2 static inline __m256i rotl32_avx2(__m256i x, int r) {
+    return _mm256_or_si256(_mm256_slli_epi32(x, r), _mm256_srli_epi32(x, 32 - r));
+}
+
+SM4_TARGET_AVX2 static inline __m256i sbox_bytes_avx2(__m256i x) {
+    const __m256i mask_ff = _mm256_set1_epi32(0xFF);
+    __m256i i0 = _mm256_and_si256(x, mask_ff);
+    __m256i i1 = _mm256_and_si256(_mm256_srli_epi32(x, 8), mask_ff);
+    __m256i i2 = _mm256_and_si256(_mm256_srli_epi32(x, 16), mask_ff);
+    __m256i i3 = _mm256_and_si256(_mm256_srli_epi32(x, 24), mask_ff);
+
+    __m256i g0 = _mm256_i32gather_epi32((const int*)SM4_SBOX32, i0, 4);
+    __m256i g1 = _mm256_i32gather_epi32((const int*)SM4_SBOX32, i1, 4);
+    __m256i g2 = _mm256_i32gather_epi32((const int*)SM4_SBOX32, i2, 4);
+    __m256i g3 = _mm256_i32gather_epi32((const int*)SM4_SBOX32, i3, 4);
+
+    g1 = _mm256_slli_epi32(g1, 8);
+    g2 = _mm256_slli_epi32(g2, 16);
+    g3 = _mm256_slli_epi32(g3, 24);
+
+    return _mm256_or_si256(_mm256_or_si256(g0, g1), _mm256_or_si256(g2, g3));
+}
+
+SM4_TARGET_AVX2 static inline __m256i T_avx2(__m256i x) {
+    __m256i b = sbox_bytes_avx2(x);
+    __m256i r2 = rotl32_avx2(b, 2);
+    __m256i r10 = rotl32_avx2(b, 10);
+    __m256i r18 = rotl32_avx2(b, 18);
+    __m256i r24 = rotl32_avx2(b, 24);
+    return _mm256_xor_si256(_mm256_xor_si256(_mm256_xor_si256(_mm256_xor_si256(b, r2), r10), r18), r24);
+}
+
+SM4_TARGET_AVX2 static void sm4_crypt8_blocks_avx2(const uint8_t* in, uint8_t* out, const uint32_t rk[32], int is_decrypt) {
+    uint32_t x0[8], x1[8], x2[8], x3[8];
+    for (int b = 0; b < 8; b++) {
+        const uint8_t* p = in + 16 * b;
+        x0[b] = load_be32(p + 0);
+        x1[b] = load_be32(p + 4);
+        x2[b] = load_be32(p + 8);
+        x3[b] = load_be32(p + 12);
+    }
+
+    __m256i X0 = _mm256_loadu_si256((const __m256i*)x0);
+    __m256i X1 = _mm256_loadu_si256((const __m256i*)x1);
+    __m256i X2 = _mm256_loadu_si256((const __m256i*)x2);
+    __m256i X3 = _mm256_loadu_si256((const __m256i*)x3);
+
+    for (int r = 0; r < 32; r++) {
+        __m256i t = _mm256_xor_si256(_mm256_xor_si256(X1, X2), X3);
+        t = _mm256_xor_si256(t, _mm256_set1_epi32(rk[r]));
+        __m256i tt = T_avx2(t);
+        __m256i newX0 = _mm256_xor_si256(X0, tt);
+        X0 = X1; X1 = X2; X2 = X3; X3 = newX0;
+    }
+
+    // 解密时需要反转输出顺序（与加密一致）
+    _mm256_storeu_si256((__m256i*)x0, X3);
+    _mm256_storeu_si256((__m256i*)x1, X2);
+    _mm256_storeu_si256((__m256i*)x2, X1);
+    _mm256_storeu_si256((__m256i*)x3, X0);
+
+    for (int b = 0; b < 8; b++) {
+        uint8_t* q = out + 16 * b;
+        store_be32(q + 0, x0[b]);
+        store_be32(q + 4, x1[b]);
+        store_be32(q + 8, x2[b]);
+        store_be32(q + 12, x3[b]);
+    }
+}
+
+SM4_TARGET_AVX2 static inline __m256i Tp_avx2(__m256i x) {
+    __m256i b = sbox_bytes_avx2(x);
+    return _mm256_xor_si256(_mm256_xor_si256(b, rotl32_avx2(b, 13)), rotl32_avx2(b, 23));
+}
+
+SM4_TARGET_AVX2 static inline __m256i load_words8(const uint8_t* p, int word) {
+    uint32_t w[8];
+    for (int b = 0; b < 8; b++) w[b] = load_be32(p + 16 * b + 4 * word);
+    return _mm256_loadu_si256((const __m256i*)w);
+}
+
+SM4_TARGET_AVX2 static inline void store_words8(uint8_t* p, int word, __m256i v) {
+    uint32_t w[8];
+    _mm256_storeu_si256((__m256i*)w, v);
+    for (int b = 0; b < 8; b++) store_be32(p + 16 * b + 4 * word, w[b]);
+}
+
+// 8 个分组各用独立的密钥：8 路密钥扩展与加密轮函数同步推进，
+// 加密时第 r 轮轮密钥刚算出就立即使用；解密需要逆序轮密钥，先展开 32 轮再迭代
+SM4_TARGET_AVX2 static void sm4_multi_key8_avx2(const uint8_t* keys, const uint8_t* in, uint8_t* out, int is_decrypt) {
+    __m256i K0 = _mm256_xor_si256(load_words8(keys, 0), _mm256_set1_epi32(SM4_FK[0]));
+    __m256i K1 = _mm256_xor_si256(load_words8(keys, 1), _mm256_set1_epi32(SM4_FK[1]));
+    __m256i K2 = _mm256_xor_si256(load_words8(keys, 2), _mm256_set1_epi32(SM4_FK[2]));
+    __m256i K3 = _mm256_xor_si256(load_words8(keys, 3), _mm256_set1_epi32(SM4_FK[3]));
+    __m256i X0 = load_words8(in, 0), X1 = load_words8(in, 1), X2 = load_words8(in, 2), X3 = load_words8(in, 3);
+    __m256i RK[32];
+
+    for (int r = 0; r < 32; r++) {
+        __m256i t = _mm256_xor_si256(_mm256_xor_si256(K1, K2), K3);
+        t = _mm256_xor_si256(t, _mm256_set1_epi32(SM4_CK[r]));
+        __m256i rk = _mm256_xor_si256(K0, Tp_avx2(t));
+        K0 = K1; K1 = K2; K2 = K3; K3 = rk;
+        if (is_decrypt) {
+            RK[r] = rk;
+            continue;
+        }
+        t = _mm256_xor_si256(_mm256_xor_si256(_mm256_xor_si256(X1, X2), X3), rk);
+        __m256i newX0 = _mm256_xor_si256(X0, T_avx2(t));
+        X0 = X1; X1 = X2; X2 = X3; X3 = newX0;
+    }
+    if (is_decrypt) {
+        for (int r = 31; r >= 0; r--) {
+            __m256i t = _mm256_xor_si256(_mm256_xor_si256(_mm256_xor_si256(X1, X2), X3), RK[r]);
+            __m256i newX0 = _mm256_xor_si256(X0, T_avx2(t));
+            X0 = X1; X1 = X2; X2 = X3; X3 = newX0;
+        }
+    }
+
+    store_words8(out, 0, X3);
+    store_words8(out, 1, X2);
+    store_words8(out, 2, X1);
+    store_words8(out, 3, X0);
+}
+
+// 标量单块加密/解密
+static void sm4_crypt_block_scalar(const uint8_t in[16], uint8_t out[16], const uint32_t rk[32], int is_decrypt) {
+    uint32_t X[4];
+    X[0] = load_be32(in + 0);
+    X[1] = load_be32(in + 4);
+    X[2] = load_be32(in + 8);
+    X[3] = load_be32(in + 12);
+
+    for (int r = 0; r < 32; r++) {
+        uint32_t t = X[1] ^ X[2] ^ X[3] ^ rk[r];
+        uint32_t newX = X[0] ^ T_scalar(t);
+        X[0] = X[1]; X[1] = X[2]; X[2] = X[3]; X[3] = newX;
+    }
+
+    store_be32(out + 0, X[3]);
+    store_be32(out + 4, X[2]);
+    store_be32(out + 8, X[1]);
+    store_be32(out + 12, X[0]);
+}
+
+// ====================== AES-NI / GFNI 实现 ======================
+// SM4 S 盒与 AES S 盒同为“仿射变换 + GF(2^8) 求逆”，两个域同构：
+//   S(x) = post(AES_SBOX(pre(x)))        （AES-NI：AESENCLAST 计算 AES S 盒）
+//   S(x) = post'(inv_aes(pre(x)))        （GFNI：gf2p8affineqb + gf2p8affineinvqb）
+// 仿射矩阵由 sm4-AESNI.py 的 generate_c_constants() 推导生成。
+// 各分组的 4 个字经转置后分别放入 X0..X3，每个 32 位通道对应一个分组。
+static const uint8_t SM4_PRE_LO[16] = { 0x3e, 0xb2, 0x0e, 0x82, 0xbb, 0x37, 0x8b, 0x07, 0xa1, 0x2d, 0x91, 0x1d, 0x24, 0xa8, 0x14, 0x98 };
+static const uint8_t SM4_PRE_HI[16] = { 0x00, 0xdc, 0x2e, 0xf2, 0xc5, 0x19, 0xeb, 0x37, 0x08, 0xd4, 0x26, 0xfa, 0xcd, 0x11, 0xe3, 0x3f };
+static const uint8_t SM4_AESNI_POST_LO[16] = { 0x6c, 0xd4, 0xa6, 0x1e, 0x52, 0xea, 0x98, 0x20, 0x0b, 0xb3, 0xc1, 0x79, 0x35, 0x8d, 0xff, 0x47 };
+static const uint8_t SM4_AESNI_POST_HI[16] = { 0x00, 0xe0, 0x50, 0xb0, 0x9d, 0x7d, 0xcd, 0x2d, 0xc0, 0x20, 0x90, 0x70, 0x5d, 0xbd, 0x0d, 0xed };
+#define SM4_GFNI_PRE 0x4c287db91a22505dULL
+#define SM4_GFNI_PRE_C 0x3e
+#define SM4_GFNI_POST 0xf3ab34a974a6b589ULL
+#define SM4_GFNI_POST_C 0xd3
+
+// 线性变换 L 中按字节的循环左移用 PSHUFB 完成：L(b) = b ^ rotl(b, 24) ^ rotl(b ^ rotl(b, 8) ^ rotl(b, 16), 2)
+#define SM4_BSWAP32_MASK 3, 2, 1, 0, 7, 6, 5, 4, 11, 10, 9, 8, 15, 14, 13, 12
+#define SM4_ROTL8_MASK 3, 0, 1, 2, 7, 4, 5, 6, 11, 8, 9, 10, 15, 12, 13, 14
+#define SM4_ROTL16_MASK 2, 3, 0, 1, 6, 7, 4, 5, 10, 11, 8, 9, 14, 15, 12, 13
+#define SM4_ROTL24_MASK 1, 2, 3, 0, 5, 6, 7, 4, 9, 10, 11, 8, 13, 14, 15, 12
+
+// 4x4 的 32 位字转置（在每个 128 位通道内进行）
+#define SM4_TRANSPOSE4(W, unpacklo32, unpackhi32, unpacklo64, unpackhi64, a, b, c, d) do { \
+        W t0 = unpacklo32(a, b), t1 = unpacklo32(c, d);                               \
+        W t2 = unpackhi32(a, b), t3 = unpackhi32(c, d);                               \
+        a = unpacklo64(t0, t1); b = unpackhi64(t0, t1);                              \
+        c = unpacklo64(t2, t3); d = unpackhi64(t2, t3);                              \
+    } while (0)
+
+SM4_TARGET_AESNI static inline __m128i affine_nibbles(__m128i x, __m128i lo, __m128i hi) {
+    const __m128i mask = _mm_set1_epi8(0x0F);
+    __m128i l = _mm_shuffle_epi8(lo, _mm_and_si128(x, mask));
+    __m128i h = _mm_shuffle_epi8(hi, _mm_and_si128(_mm_srli_epi16(x, 4), mask));
+    return _mm_xor_si128(l, h);
+}
+
+SM4_TARGET_AESNI static inline __m128i T_aesni(__m128i x) {
+    const __m128i pre_lo = _mm_loadu_si128((const __m128i*)SM4_PRE_LO);
+    const __m128i pre_hi = _mm_loadu_si128((const __m128i*)SM4_PRE_HI);
+    const __m128i post_lo = _mm_loadu_si128((const __m128i*)SM4_AESNI_POST_LO);
+    const __m128i post_hi = _mm_loadu_si128((const __m128i*)SM4_AESNI_POST_HI);
+    const __m128i inv_shift_rows = _mm_setr_epi8(0, 13, 10, 7, 4, 1, 14, 11, 8, 5, 2, 15, 12, 9, 6, 3);
+    const __m128i r8 = _mm_setr_epi8(SM4_ROTL8_MASK);
+    const __m128i r16 = _mm_setr_epi8(SM4_ROTL16_MASK);
+    const __m128i r24 = _mm_setr_epi8(SM4_ROTL24_MASK);
+
+    // 先做逆 ShiftRows，抵消 AESENCLAST 中的 ShiftRows；轮密钥取 0
+    __m128i b = _mm_shuffle_epi8(affine_nibbles(x, pre_lo, pre_hi), inv_shift_rows);
+    b = affine_nibbles(_mm_aesenclast_si128(b, _mm_setzero_si128()), post_lo, post_hi);
+
+    __m128i t = _mm_xor_si128(_mm_xor_si128(b, _mm_shuffle_epi8(b, r8)), _mm_shuffle_epi8(b, r16));
+    t = _mm_or_si128(_mm_slli_epi32(t, 2), _mm_srli_epi32(t, 30));
+    return _mm_xor_si128(_mm_xor_si128(b, _mm_shuffle_epi8(b, r24)), t);
+}
+
+SM4_TARGET_AESNI static void sm4_crypt4_aesni(const uint8_t* in, uint8_t* out, const uint32_t rk[32]) {
+    const __m128i bswap = _mm_setr_epi8(SM4_BSWAP32_MASK);
+    __m128i X0 = _mm_shuffle_epi8(_mm_loadu_si128((const __m128i*)(in + 0)), bswap);
+    __m128i X1 = _mm_shuffle_epi8(_mm_loadu_si128((const __m128i*)(in + 16)), bswap);
+    __m128i X2 = _mm_shuffle_epi8(_mm_loadu_si128((const __m128i*)(in + 32)), bswap);
+    __m128i X3 = _mm_shuffle_epi8(_mm_loadu_si128((const __m128i*)(in + 48)), bswap);
+    SM4_TRANSPOSE4(__m128i, _mm_unpacklo_epi32, _mm_unpackhi_epi32, _mm_unpacklo_epi64, _mm_unpackhi_epi64,
+                   X0, X1, X2, X3);
+
+    for (int r = 0; r < 32; r++) {
+        __m128i t = _mm_xor_si128(_mm_xor_si128(X1, X2), _mm_xor_si128(X3, _mm_set1_epi32((int)rk[r])));
+        __m128i newX0 = _mm_xor_si128(X0, T_aesni(t));
+        X0 = X1; X1 = X2; X2 = X3; X3 = newX0;
+    }
+
+    // 反序变换 R：输出字顺序为 X3, X2, X1, X0
+    SM4_TRANSPOSE4(__m128i, _mm_unpacklo_epi32, _mm_unpackhi_epi32, _mm_unpacklo_epi64, _mm_unpackhi_epi64,
+                   X3, X2, X1, X0);
+    _mm_storeu_si128((__m128i*)(out + 0), _mm_shuffle_epi8(X3, bswap));
+    _mm_storeu_si128((__m128i*)(out + 16), _mm_shuffle_epi8(X2, bswap));
+    _mm_storeu_si128((__m128i*)(out + 32), _mm_shuffle_epi8(X1, bswap));
+    _mm_storeu_si128((__m128i*)(out + 48), _mm_shuffle_epi8(X0, bswap));
+}
+
+SM4_TARGET_GFNI static inline __m256i T_gfni(__m256i x) {
+    const __m256i r8 = _mm256_setr_epi8(SM4_ROTL8_MASK, SM4_ROTL8_MASK);
+    const __m256i r16 = _mm256_setr_epi8(SM4_ROTL16_MASK, SM4_ROTL16_MASK);
+    const __m256i r24 = _mm256_setr_epi8(SM4_ROTL24_MASK, SM4_ROTL24_MASK);
+
+    __m256i b = _mm256_gf2p8affine_epi64_epi8(x, _mm256_set1_epi64x((long long)SM4_GFNI_PRE), SM4_GFNI_PRE_C);
+    b = _mm256_gf2p8affineinv_epi64_epi8(b, _mm256_set1_epi64x((long long)SM4_GFNI_POST), SM4_GFNI_POST_C);
+
+    __m256i t = _mm256_xor_si256(_mm256_xor_si256(b, _mm256_shuffle_epi8(b, r8)), _mm256_shuffle_epi8(b, r16));
+    t = _mm256_or_si256(_mm256_slli_epi32(t, 2), _mm256_srli_epi32(t, 30));
+    return _mm256_xor_si256(_mm256_xor_si256(b, _mm256_shuffle_epi8(b, r24)), t);
+}
+
+SM4_TARGET_GFNI static void sm4_crypt8_gfni(const uint8_t* in, uint8_t* out, const uint32_t rk[32]) {
+    const __m256i bswap = _mm256_setr_epi8(SM4_BSWAP32_MASK, SM4_BSWAP32_MASK);
+    // 每个向量装入相邻两个分组，转置后同一个 X 中的 8 个通道对应 8 个分组
+    __m256i X0 = _mm256_shuffle_epi8(_mm256_loadu_si256((const __m256i*)(in + 0)), bswap);
+    __m256i X1 = _mm256_shuffle_epi8(_mm256_loadu_si256((const __m256i*)(in + 32)), bswap);
+    __m256i X2 = _mm256_shuffle_epi8(_mm256_loadu_si256((const __m256i*)(in + 64)), bswap);
+    __m256i X3 = _mm256_shuffle_epi8(_mm256_loadu_si256((const __m256i*)(in + 96)), bswap);
+    SM4_TRANSPOSE4(__m256i, _mm256_unpacklo_epi32, _mm256_unpackhi_epi32, _mm256_unpacklo_epi64,
+                   _mm256_unpackhi_epi64, X0, X1, X2, X3);
+
+    for (int r = 0; r < 32; r++) {
+        __m256i t = _mm256_xor_si256(_mm256_xor_si256(X1, X2), _mm256_xor_si256(X3, _mm256_set1_epi32((int)rk[r])));
+        __m256i newX0 = _mm256_xor_si256(X0, T_gfni(t));
+        X0 = X1; X1 = X2; X2 = X3; X3 = newX0;
+    }
+
+    SM4_TRANSPOSE4(__m256i, _mm256_unpacklo_epi32, _mm256_unpackhi_epi32, _mm256_unpacklo_epi64,
+                   _mm256_unpackhi_epi64, X3, X2, X1, X0);
+    _mm256_storeu_si256((__m256i*)(out + 0), _mm256_shuffle_epi8(X3, bswap));
+    _mm256_storeu_si256((__m256i*)(out + 32), _mm256_shuffle_epi8(X2, bswap));
+    _mm256_storeu_si256((__m256i*)(out + 64), _mm256_shuffle_epi8(X1, bswap));
+    _mm256_storeu_si256((__m256i*)(out + 96), _mm256_shuffle_epi8(X0, bswap));
+}
+
+SM4_TARGET_GFNI512 static inline __m512i T_gfni512(__m512i x) {
+    __m512i b = _mm512_gf2p8affine_epi64_epi8(x, _mm512_set1_epi64((long long)SM4_GFNI_PRE), SM4_GFNI_PRE_C);
+    b = _mm512_gf2p8affineinv_epi64_epi8(b, _mm512_set1_epi64((long long)SM4_GFNI_POST), SM4_GFNI_POST_C);
+    // AVX-512 有原生的 32 位循环移位，三输入异或用 ternarylogic（0x96）
+    __m512i t = _mm512_ternarylogic_epi32(b, _mm512_rol_epi32(b, 2), _mm512_rol_epi32(b, 10), 0x96);
+    return _mm512_ternarylogic_epi32(t, _mm512_rol_epi32(b, 18), _mm512_rol_epi32(b, 24), 0x96);
+}
+
+SM4_TARGET_GFNI512 static void sm4_crypt16_gfni512(const uint8_t* in, uint8_t* out, const uint32_t rk[32]) {
+    const __m512i bswap = _mm512_broadcast_i32x4(_mm_setr_epi8(SM4_BSWAP32_MASK));
+    __m512i X0 = _mm512_shuffle_epi8(_mm512_loadu_si512((const void*)(in + 0)), bswap);
+    __m512i X1 = _mm512_shuffle_epi8(_mm512_loadu_si512((const void*)(in + 64)), bswap);
+    __m512i X2 = _mm512_shuffle_epi8(_mm512_loadu_si512((const void*)(in + 128)), bswap);
+    __m512i X3 = _mm512_shuffle_epi8(_mm512_loadu_si512((const void*)(in + 192)), bswap);
+    SM4_TRANSPOSE4(__m512i, _mm512_unpacklo_epi32, _mm512_unpackhi_epi32, _mm512_unpacklo_epi64,
+                   _mm512_unpackhi_epi64, X0, X1, X2, X3);
+
+    for (int r = 0; r < 32; r++) {
+        __m512i t = _mm512_ternarylogic_epi32(X1, X2, X3, 0x96);
+        t = _mm512_xor_si512(t, _mm512_set1_epi32((int)rk[r]));
+        __m512i newX0 = _mm512_xor_si512(X0, T_gfni512(t));
+        X0 = X1; X1 = X2; X2 = X3; X3 = newX0;
+    }
+
+    SM4_TRANSPOSE4(__m512i, _mm512_unpacklo_epi32, _mm512_unpackhi_epi32, _mm512_unpacklo_epi64,
+                   _mm512_unpackhi_epi64, X3, X2, X1, X0);
+    _mm512_storeu_si512((void*)(out + 0), _mm512_shuffle_epi8(X3, bswap));
+    _mm512_storeu_si512((void*)(out + 64), _mm512_shuffle_epi8(X2, bswap));
+    _mm512_storeu_si512((void*)(out + 128), _mm512_shuffle_epi8(X1, bswap));
+    _mm512_storeu_si512((void*)(out + 192), _mm512_shuffle_epi8(X0, bswap));
+}
+
+// ====================== 公共接口 ======================
+// 运行时检测 CPU 是否支持 AVX2
+SM4_API int sm4_cpu_has_avx2(void) {
+#if defined(__GNUC__) || defined(__clang__)
+    __builtin_cpu_init();
+    return __builtin_cpu_supports("avx2") ? 1 : 0;
+#else
+    return 0;
+#endif
+}
+
+// 返回 CPU 支持的最高一级批量路径（SM4_IMPL_*）
+SM4_API int sm4_cpu_best_impl(void) {
+#if defined(__GNUC__) || defined(__clang__)
+    __builtin_cpu_init();
+    if (__builtin_cpu_supports("gfni")) {
+        if (__builtin_cpu_supports("avx512f") && __builtin_cpu_supports("avx512bw")) return SM4_IMPL_GFNI512;
+        if (__builtin_cpu_supports("avx2")) return SM4_IMPL_GFNI;
+    }
+    // AES-NI 虽然一次只处理 4 块，但省去了 gather 查表的访存，仍比 AVX2 路径快
+    if (__builtin_cpu_supports("aes") && __builtin_cpu_supports("ssse3")) return SM4_IMPL_AESNI;
+    if (__builtin_cpu_supports("avx2")) return SM4_IMPL_AVX2;
+#endif
+    return SM4_IMPL_SCALAR;
+}
+
+// 检查指定的批量路径在当前 CPU 上是否可用
+SM4_API int sm4_cpu_supports_impl(int impl) {
+#if defined(__GNUC__) || defined(__clang__)
+    __builtin_cpu_init();
+    switch (impl) {
+    case SM4_IMPL_SCALAR: return 1;
+    case SM4_IMPL_AVX2: return __builtin_cpu_supports("avx2") ? 1 : 0;
+    case SM4_IMPL_AESNI: return (__builtin_cpu_supports("aes") && __builtin_cpu_supports("ssse3")) ? 1 : 0;
+    case SM4_IMPL_GFNI: return (__builtin_cpu_supports("gfni") && __builtin_cpu_supports("avx2")) ? 1 : 0;
+    case SM4_IMPL_GFNI512:
+        return (__builtin_cpu_supports("gfni") && __builtin_cpu_supports("avx512f") &&
+                __builtin_cpu_supports("avx512bw")) ? 1 : 0;
+    }
+#endif
+    return impl == SM4_IMPL_SCALAR;
+}
+
+// 使用预先扩展好的轮密钥批量处理分组（解密时传入逆序轮密钥）
+// impl 为 SM4_IMPL_*（0/1 与原来的 use_avx2 含义相同）；宽路径处理不完的尾部逐级落到窄路径和标量
+SM4_API void sm4_crypt_blocks(const uint8_t* in, uint8_t* out, size_t blocks, const uint32_t rk[32], int impl) {
+    size_t i = 0;
+    switch (impl) {
+    case SM4_IMPL_GFNI512:
+        for (; i + 16 <= blocks; i += 16) {
+            sm4_crypt16_gfni512(in + i * 16, out + i * 16, rk);
+        }
+        /* fall through */
+    case SM4_IMPL_GFNI:
+        for (; i + 8 <= blocks; i += 8) {
+            sm4_crypt8_gfni(in + i * 16, out + i * 16, rk);
+        }
+        break;
+    case SM4_IMPL_AESNI:
+        for (; i + 4 <= blocks; i += 4) {
+            sm4_crypt4_aesni(in + i * 16, out + i * 16, rk);
+        }
+        break;
+    case SM4_IMPL_AVX2:
+        for (; i + 8 <= blocks; i += 8) {
+            sm4_crypt8_blocks_avx2(in + i * 16, out + i * 16, rk, 0);
+        }
+        break;
+    default:
+        break;
+    }
+    for (; i < blocks; i++) {
+        sm4_crypt_block_scalar(in + i * 16, out + i * 16, rk, 0);
+    }
+}
+
+// CBC 解密：各分组的解密互相独立，每 16 块交给所选的并行路径解密后再与前一密文分组异或；支持 in == out 原地解密
+SM4_API void sm4_cbc_decrypt(const uint8_t* in, uint8_t* out, size_t blocks, const uint32_t rk_dec[32],
+                             const uint8_t iv[16], int impl) {
+    uint8_t prev[16], ct[16 * 16];
+    memcpy(prev, iv, 16);
+    size_t i = 0;
+    while (i < blocks) {
+        size_t n = impl ? blocks - i : 1;
+        if (n > 16) n = 16;
+        // 先保存本组密文，原地解密时输出会覆盖输入
+        memcpy(ct, in + i * 16, n * 16);
+        uint8_t* dst = out + i * 16;
+        sm4_crypt_blocks(ct, dst, n, rk_dec, impl);
+        for (int j = 0; j < 16; j++) dst[j] ^= prev[j];
+        for (size_t k = 16; k < n * 16; k++) dst[k] ^= ct[k - 16];
+        memcpy(prev, ct + (n - 1) * 16, 16);
+        i += n;
+    }
+}
+
+// 多密钥批量处理：第 i 个分组使用 keys 中的第 i 个 16 字节密钥，支持 in == out
+SM4_API void sm4_crypt_multi_key(const uint8_t* keys, const uint8_t* in, uint8_t* out, size_t blocks,
+                                 int is_decrypt, int use_avx2) {
+    size_t i = 0;
+    if (use_avx2) {
+        for (; i + 8 <= blocks; i += 8) {
+            sm4_multi_key8_avx2(keys + i * 16, in + i * 16, out + i * 16, is_decrypt);
+        }
+    }
+    for (; i < blocks; i++) {
+        uint32_t rk_enc[32], rk_dec[32];
+        sm4_key_expand(keys + i * 16, rk_enc, rk_dec);
+        sm4_crypt_block_scalar(in + i * 16, out + i * 16, is_decrypt ? rk_dec : rk_enc, is_decrypt);
+    }
+}
+
+SM4_API void sm4_ecb_crypt_avx2(const uint8_t* in, uint8_t* out, size_t blocks, const uint8_t key[16], int is_decrypt) {
+    uint32_t rk_enc[32], rk_dec[32];
+    sm4_key_expand(key, rk_enc, rk_dec);
+    sm4_crypt_blocks(in, out, blocks, is_decrypt ? rk_dec : rk_enc, 1);
+}
+
+// ====================== 测试 ======================
+#ifndef SM4_BUILD_SHARED
+int main(void) {
+    // 标准测试向量
+    const uint8_t key[16] = {
+        0x01,0x23,0x45,0x67, 0x89,0xab,0xcd,0xef,
+        0xfe,0xdc,0xba,0x98, 0x76,0x54,0x32,0x10
+    };
+    const uint8_t pt[16] = {
+        0x01,0x23,0x45,0x67, 0x89,0xab,0xcd,0xef,
+        0xfe,0xdc,0xba,0x98, 0x76,0x54,0x32,0x10
+    };
+    const uint8_t ct_expected[16] = {
+        0x68,0x1e,0xdf,0x34, 0xd2,0x06,0x96,0x5e,
+        0x86,0xb3,0xe9,0x4f, 0x53,0x6e,0x42,0x46
+    };
+
+    // 测试加密
+    uint8_t ct[16];
+    sm4_ecb_crypt_avx2(pt, ct, 1, key, 0);
+    int ok = memcmp(ct, ct_expected, 16) == 0;
+    printf("SM4 AVX2 ECB encrypt test: %s\n", ok ? "PASS" : "FAIL");
+
+    // 测试解密
+    uint8_t decrypted[16];
+    sm4_ecb_crypt_avx2(ct, decrypted, 1, key, 1);
+    ok &= memcmp(decrypted, pt, 16) == 0;
+    printf("SM4 AVX2 ECB decrypt test: %s\n", ok ? "PASS" : "FAIL");
+
+    // 打印结果
+    if (ok) {
+        printf("Plaintext:  ");
+        for (int i = 0; i < 16; i++) printf("%02x", pt[i]);
+        printf("\nCiphertext: ");
+        for (int i = 0; i < 16; i++) printf("%02x", ct[i]);
+        printf("\nDecrypted:  ");
+        for (int i = 0; i < 16; i++) printf("%02x", decrypted[i]);
+        printf("\n");
+    }
+    else {
+        printf("Expected ciphertext: ");
+        for (int i = 0; i < 16; i++) printf("%02x", ct_expected[i]);
+        printf("\nActual ciphertext:  ");
+        for (int i = 0; i < 16; i++) printf("%02x", ct[i]);
+        printf("\n");
+    }
+
+    return ok ? 0 : 1;
+}
+#endif
@@ -0,0 +1,318 @@
+import bisect
+import json
+import os
+import platform
+import struct
+import sys
+import threading
+import time
+
+from sm4 import SM4
+from sm4_modes import BLOCK_SIZE, SM4Cipher, _crypt_words, _xor_bytes
+from sm4_native import HAS_AVX2, HAS_NATIVE, NATIVE_IMPLS, SM4_Native, _load_script
+
+# 标准测试向量：每个后端使用前都必须通过
+KAT_KEY = bytes.fromhex('0123456789abcdeffedcba9876543210')
+KAT_PLAINTEXT = bytes.fromhex('0123456789abcdeffedcba9876543210')
+KAT_CIPHERTEXT = bytes.fromhex('681edf34d206965e86b3e94f536e4246')
+
+# 校准时测试的批量大小（分组数）
+CALIBRATION_SIZES = (1, 8, 64, 512, 4096)
+# 每个批量大小的最短计时时间（秒）
+_MIN_TIME = 0.005
+# 单块耗时超过当前最快后端这么多倍时，不再测试更大的批量
+_PRUNE_RATIO = 20
+
+_ENV_CALIBRATION = 'SM4_CALIBRATION_FILE'
+_DEFAULT_CALIBRATION = os.path.join(os.path.expanduser('~'), '.cache', 'sm4', 'calibration.json')
+
+
+class _PythonEngine:
+    """内联T表的纯Python批量实现（sm4_modes内置路径）"""
+
+    def __init__(self, key):
+        sm4 = SM4(key)
+        self.rk, self.rk_dec = sm4.rk, sm4.rk_dec
+
+    def crypt(self, data, decrypt=False):
+        n = len(data) // BLOCK_SIZE
+        words = _crypt_words(struct.unpack(f'>{4 * n}I', data), self.rk_dec if decrypt else self.rk)
+        return struct.pack(f'>{4 * n}I', *words)
+
+
+class _BlockEngine:
+    """把只能处理单个分组的实现包装成批量接口"""
+
+    def __init__(self, encrypt, decrypt):
+        self._encrypt = encrypt
+        self._decrypt = decrypt
+
+    def crypt(self, data, decrypt=False):
+        fn = self._decrypt if decrypt else self._encrypt
+        return b''.join(fn(bytes(data[i:i + BLOCK_SIZE])) for i in range(0, len(data), BLOCK_SIZE))
+
+
+class _BulkEngine:
+    """包装按整段数据加解密的实现，并暴露其并行CBC解密"""
+
+    def __init__(self, encrypt, decrypt, decrypt_cbc):
+        self._encrypt = encrypt
+        self._decrypt = decrypt
+        self.decrypt_cbc = decrypt_cbc
+
+    def crypt(self, data, decrypt=False):
+        return (self._decrypt if decrypt else self._encrypt)(data)
+
+
+def _make_sm4(key):
+    sm4 = SM4(key)
+    return _BlockEngine(sm4.encrypt, sm4.decrypt)
+
+
+def _make_ttable(wide):
+    def make(key):
+        sm4 = _load_script('sm4-TTable.py', 'sm4_ttable').SM4_TTable(key, wide=wide)
+        return _BlockEngine(sm4.encrypt, sm4.decrypt)
+    return make
+
+
+def _make_aesni_class(name):
+    def make(key):
+        impl = getattr(_load_script('sm4-AESNI.py', 'sm4_aesni'), name)()
+        rk = impl.key_expansion(key)
+        return _BlockEngine(lambda b: impl.encrypt_block(b, rk), lambda b: impl.decrypt_block(b, rk))
+    return make
+
+
+def _make_numpy(key):
+    from sm4_numpy import SM4_NumPy
+    engine = SM4_NumPy(key)
+    return _BulkEngine(engine.encrypt_ecb, engine.decrypt_ecb, engine.decrypt_cbc)
+
+
+def _make_bitslice(key):
+    from sm4_bitslice import SM4_Bitslice
+    engine = SM4_Bitslice(key)
+    return _BulkEngine(engine.encrypt_ecb, engine.decrypt_ecb, engine.decrypt_cbc)
+
+
+def _make_native(impl):
+    def make(key):
+        engine = SM4_Native(key, impl=impl)
+        return _BulkEngine(engine.encrypt, engine.decrypt, engine.decrypt_cbc)
+    return make
+
+
+def _numpy_available():
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+# 后端名称 -> (是否可用, 构造函数)
+BACKENDS = {
+    'sm4': (lambda: True, _make_sm4),
+    'ttable': (lambda: True, _make_ttable(False)),
+    'ttable-wide': (lambda: True, _make_ttable(True)),
+    'basic': (_numpy_available, _make_aesni_class('SM4_Basic')),
+    'optimized': (_numpy_available, _make_aesni_class('SM4_Optimized_V2')),
+    'python': (lambda: True, _PythonEngine),
+    'numpy': (_numpy_available, _make_numpy),
+    'bitslice': (_numpy_available, _make_bitslice),
+    'native-scalar': (lambda: HAS_NATIVE, _make_native('scalar')),
+    'native-avx2': (lambda: HAS_AVX2, _make_native('avx2')),
+    'native-aesni': (lambda: 'aesni' in NATIVE_IMPLS, _make_native('aesni')),
+    'native-gfni': (lambda: 'gfni' in NATIVE_IMPLS, _make_native('gfni')),
+    'native-gfni-avx512': (lambda: 'gfni-avx512' in NATIVE_IMPLS, _make_native('gfni-avx512')),
+}
+
+_verified = {}
+_lock = threading.Lock()
+_calibration = None
+
+
+def _verify(name):
+    """使用标准测试向量验证后端（每个进程每个后端只验证一次）"""
+    with _lock:
+        if name not in _verified:
+            ok = False
+            available, make = BACKENDS[name]
+            try:
+                if available():
+                    engine = make(KAT_KEY)
+                    data = KAT_PLAINTEXT * 29  # 覆盖16/8/4路并行路径和标量尾部
+                    ct = engine.crypt(data, False)
+                    ok = ct == KAT_CIPHERTEXT * 29 and engine.crypt(ct, True) == data
+            except Exception:
+                ok = False
+            _verified[name] = ok
+        return _verified[name]
+
+
+def available_backends():
+    """返回通过标准向量验证的后端名称"""
+    return [name for name in BACKENDS if _verify(name)]
+
+
+def _fingerprint():
+    """校准结果只在相同的硬件/解释器/后端组合下有效"""
+    return {
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'python': sys.version.split()[0],
+        'native': HAS_NATIVE,
+        'avx2': HAS_AVX2,
+        'native_impls': NATIVE_IMPLS,
+        'backends': available_backends(),
+    }
+
+
+def _time_backend(engine, blocks):
+    """返回每个分组的平均耗时（秒）"""
+    data = KAT_PLAINTEXT * blocks
+    engine.crypt(data)  # 预热
+    reps = 0
+    start = time.perf_counter()
+    while True:
+        engine.crypt(data)
+        reps += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= _MIN_TIME or reps >= 1000:
+            return elapsed / (reps * blocks)
+
+
+def calibrate(sizes=CALIBRATION_SIZES):
+    """运行微基准，返回按批量大小划分的后端选择表 [(最大分组数, 后端名), ...]"""
+    names = available_backends()
+    engines = {name: BACKENDS[name][1](KAT_KEY) for name in names}
+    winners = []
+    for size in sizes:
+        timings = {name: _time_backend(engines[name], size) for name in names}
+        best = min(timings, key=timings.get)
+        winners.append((size, best))
+        # 明显落后的后端在更大的批量下也不会胜出
+        names = [n for n in names if timings[n] <= timings[best] * _PRUNE_RATIO]
+
+    # 相邻批量大小之间以几何中点为分界
+    table = []
+    for i, (size, name) in enumerate(winners):
+        if i + 1 < len(winners):
+            upper = int((size * winners[i + 1][0]) ** 0.5)
+        else:
+            upper = None
+        if table and table[-1][1] == name:
+            table[-1] = (upper, name)
+        else:
+            table.append((upper, name))
+    return table
+
+
+def _calibration_path():
+    return os.environ.get(_ENV_CALIBRATION) or _DEFAULT_CALIBRATION
+
+
+def load_calibration(recalibrate=False):
+    """读取缓存的校准结果；不存在、环境不匹配或recalibrate=True时重新校准并写入缓存"""
+    global _calibration
+    if _calibration is not None and not recalibrate:
+        return _calibration
+    path = _calibration_path()
+    fingerprint = _fingerprint()
+    table = None
+    if not recalibrate:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+            if cached.get('fingerprint') == fingerprint:
+                table = [tuple(entry) for entry in cached['table']]
+        except (OSError, ValueError, KeyError, TypeError):
+            table = None
+        if table and not all(name in fingerprint['backends'] for _, name in table):
+            table = None
+    if table is None:
+        table = calibrate()
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump({'fingerprint': fingerprint, 'table': table}, f, indent=2)
+        except OSError:
+            pass
+    _calibration = table
+    return table
+
+
+class SM4Dispatcher:
+    """按批量大小在已验证的后端之间自动切换的批量引擎"""
+
+    def __init__(self, key, table=None):
+        table = table or load_calibration()
+        self.table = table
+        self._bounds = [upper for upper, _ in table[:-1]]
+        engines = {}
+        for _, name in table:
+            if name not in engines:
+                engines[name] = BACKENDS[name][1](key)
+        self._engines = [engines[name] for _, name in table]
+        self.backends = [name for _, name in table]
+
+    def select(self, blocks):
+        """返回处理blocks个分组时使用的后端名称"""
+        return self.backends[bisect.bisect_left(self._bounds, blocks)]
+
+    def crypt(self, data, decrypt=False):
+        blocks = len(data) // BLOCK_SIZE
+        return self._engines[bisect.bisect_left(self._bounds, blocks)].crypt(data, decrypt)
+
+    def decrypt_cbc(self, data, iv):
+        """CBC批量解密：优先使用后端自带的并行实现，否则批量解密后整体异或"""
+        engine = self._engines[bisect.bisect_left(self._bounds, len(data) // BLOCK_SIZE)]
+        if hasattr(engine, 'decrypt_cbc'):
+            return engine.decrypt_cbc(data, iv)
+        return _xor_bytes(engine.crypt(data, True), bytes(iv) + bytes(data[:-BLOCK_SIZE]))
+
+
+def get_engine(key, backend='auto'):
+    """返回指定（或自动选择的）批量引擎"""
+    if len(key) != 16:
+        raise ValueError("SM4 密钥必须是 16 bytes (128 bits) 长")
+    if backend == 'auto':
+        return SM4Dispatcher(key)
+    if backend not in BACKENDS:
+        raise ValueError(f"未知的SM4后端: {backend}")
+    if not _verify(backend):
+        raise RuntimeError(f"SM4后端 {backend} 不可用或未通过标准向量验证")
+    return BACKENDS[backend][1](key)
+
+
+def new(key, mode='ECB', iv=None, backend='auto', decrypt=False, padding=None):
+    """创建SM4加解密对象（SM4Cipher），底层分组运算使用选定的后端"""
+    return SM4Cipher(key, mode, iv, decrypt=decrypt, padding=padding, engine=get_engine(key, backend))
+
+
+def dispatcher_demo():
+    """后端验证与校准结果展示"""
+    print("SM4后端自动选择")
+    print("=" * 40)
+    print(f"已验证后端: {', '.join(available_backends())}")
+
+    start = time.perf_counter()
+    table = load_calibration(recalibrate=True)
+    print(f"校准耗时: {time.perf_counter() - start:.2f}s")
+    lower = 1
+    for upper, name in table:
+        print(f"  {lower} ~ {upper if upper is not None else '∞'} 分组: {name}")
+        if upper is not None:
+            lower = upper + 1
+
+    key = os.urandom(16)
+    iv = os.urandom(16)
+    data = os.urandom(100000)
+    ct = new(key, 'CBC', iv).update(data)
+    ref = new(key, 'CBC', iv, backend='python').update(data)
+    print(f"自动后端与纯Python结果一致: {'✓' if ct == ref else '✗'}")
+
+
+if __name__ == "__main__":
+    dispatcher_demo()
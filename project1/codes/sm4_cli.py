@@ -0,0 +1,366 @@
+import argparse
+import errno
+import io
+import os
+import sys
+import tempfile
+import time
+
+from sm4_backend import BACKENDS, get_engine
+from sm4_gcm import SM4_GCM
+from sm4_metrics import LatencyHistogram
+from sm4_modes import BLOCK_SIZE, SM4Cipher
+
+try:
+    import numpy as np
+
+    from sm4_numpy import counter_blocks
+except ImportError:
+    np = None
+
+MODES = ('ECB', 'CBC', 'CTR', 'GCM')
+# 默认读缓冲区大小（16字节的整数倍），输入/输出缓冲区在整个过程中复用
+DEFAULT_BUFFER_SIZE = 4 * 1024 * 1024
+GCM_IV_SIZE = 12
+GCM_TAG_SIZE = 16
+
+_ENV_KEY = 'SM4_KEY'
+
+
+class StreamStats:
+    """记录每个缓冲区的处理延迟与总吞吐量"""
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.backend = None
+        self.start = time.perf_counter()
+
+    def add(self, seconds, n):
+        self.latency.add(seconds)
+        self.bytes_in += n
+
+    def report(self):
+        elapsed = time.perf_counter() - self.start
+        h = self.latency
+        mb = self.bytes_in / (1024 * 1024)
+        avg = h.total / h.count if h.count else 0.0
+        return (
+            f"后端: {self.backend}\n"
+            f"输入 {self.bytes_in} 字节, 输出 {self.bytes_out} 字节, {h.count} 个缓冲区\n"
+            f"总耗时 {elapsed:.3f}s ({mb / max(elapsed, 1e-9):.2f} MB/s), "
+            f"纯加解密 {h.total:.3f}s ({mb / max(h.total, 1e-9):.2f} MB/s)\n"
+            f"缓冲区延迟: 平均 {avg * 1e3:.3f}ms, p50 {h.percentile(50) * 1e3:.3f}ms, "
+            f"p99 {h.percentile(99) * 1e3:.3f}ms, 最大 {(h.max or 0.0) * 1e3:.3f}ms"
+        )
+
+
+def _read_exact(src, n):
+    """从流中读取恰好n字节（管道可能分多次返回），数据不足时抛出ValueError"""
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = src.read(n - len(buf))
+        if not chunk:
+            raise ValueError("输入数据过短，缺少 IV")
+        buf += chunk
+    return bytes(buf)
+
+
+def _backend_name(engine, buffer_size):
+    """返回处理一个完整缓冲区时实际使用的后端"""
+    if hasattr(engine, 'select'):
+        return engine.select(buffer_size // BLOCK_SIZE)
+    return type(engine).__name__
+
+
+class _NumpyCTR:
+    """CTR模式的NumPy快速路径：批量生成计数器、直接异或写入输出缓冲区
+
+    接口与SM4Cipher的update_into/finalize相同；读入长度不是16的倍数时，
+    多生成的密钥流留到下次使用。
+    """
+
+    def __init__(self, engine, iv):
+        self._engine = engine
+        self._counter = int.from_bytes(iv, 'big')
+        self._ks = np.empty(0, dtype=np.uint8)
+
+    def update_into(self, data, out):
+        n = len(data)
+        ks = self._ks
+        if len(ks) < n:
+            blocks = -(-(n - len(ks)) // BLOCK_SIZE)
+            fresh = self._engine.crypt(counter_blocks(self._counter, blocks).astype('>u4').tobytes())
+            self._counter = (self._counter + blocks) % (1 << 128)
+            ks = np.concatenate((ks, np.frombuffer(fresh, dtype=np.uint8)))
+        np.bitwise_xor(np.frombuffer(data, dtype=np.uint8), ks[:n],
+                       out=np.frombuffer(out, dtype=np.uint8, count=n))
+        self._ks = ks[n:]
+        return n
+
+    def finalize(self):
+        return b''
+
+
+def _crypt_blockmode(cipher, src, dst, buffer_size, stats):
+    """ECB/CBC/CTR：update_into直接写入预分配的输出缓冲区"""
+    inbuf = bytearray(buffer_size)
+    outbuf = bytearray(buffer_size + 2 * BLOCK_SIZE)
+    in_view = memoryview(inbuf)
+    out_view = memoryview(outbuf)
+    while True:
+        n = src.readinto(in_view)
+        if not n:
+            break
+        start = time.perf_counter()
+        m = cipher.update_into(in_view[:n], out_view)
+        stats.add(time.perf_counter() - start, n)
+        if m:
+            dst.write(out_view[:m])
+            stats.bytes_out += m
+    tail = cipher.finalize()
+    if tail:
+        dst.write(tail)
+        stats.bytes_out += len(tail)
+
+
+def _crypt_gcm(gcm, src, dst, buffer_size, stats):
+    """GCM：加密时在末尾追加认证标签；解密时始终保留输入的最后16字节作为标签
+
+    解密输出是流式写出的，标签校验失败时已写出的数据不可信：main()写文件时先写临时文件，
+    校验通过后才替换到目标路径；写到标准输出时需以返回码为准。
+    """
+    inbuf = bytearray(buffer_size)
+    in_view = memoryview(inbuf)
+    held = b''
+    while True:
+        n = src.readinto(in_view)
+        if not n:
+            break
+        start = time.perf_counter()
+        if gcm.decrypting:
+            data = held + in_view[:n]
+            held = data[-GCM_TAG_SIZE:]
+            out = gcm.update(data[:-GCM_TAG_SIZE])
+        else:
+            out = gcm.update(in_view[:n])
+        stats.add(time.perf_counter() - start, n)
+        dst.write(out)
+        stats.bytes_out += len(out)
+    if gcm.decrypting:
+        if len(held) < GCM_TAG_SIZE:
+            raise ValueError("输入数据过短，缺少认证标签")
+        gcm.finalize(held)
+    else:
+        tag = gcm.finalize()
+        dst.write(tag)
+        stats.bytes_out += len(tag)
+
+
+def crypt_stream(key, src, dst, mode='CBC', decrypt=False, iv=None, aad=b'', padding=None,
+                 backend='auto', buffer_size=DEFAULT_BUFFER_SIZE):
+    """流式加解密文件对象，返回StreamStats
+
+    iv为None时：加密随机生成IV并写在输出开头，解密从输入开头读取IV。
+    GCM加密在输出末尾追加16字节认证标签，解密时校验失败抛出ValueError。
+    """
+    mode = mode.upper()
+    if mode not in MODES:
+        raise ValueError(f"不支持的工作模式: {mode}")
+    buffer_size -= buffer_size % BLOCK_SIZE
+    if buffer_size <= 0:
+        raise ValueError("缓冲区大小至少为16字节")
+    stats = StreamStats()
+    iv_size = GCM_IV_SIZE if mode == 'GCM' else BLOCK_SIZE
+    if mode != 'ECB' and iv is None:
+        if decrypt:
+            iv = _read_exact(src, iv_size)
+        else:
+            iv = os.urandom(iv_size)
+            dst.write(iv)
+            stats.bytes_out += iv_size
+
+    if mode == 'GCM':
+        gcm = SM4_GCM(key, iv, decrypt=decrypt, backend=backend)
+        gcm.update_aad(aad)
+        stats.backend = _backend_name(gcm._engine, buffer_size)
+        _crypt_gcm(gcm, src, dst, buffer_size, stats)
+    else:
+        engine = get_engine(key, backend)
+        if mode == 'CTR' and np is not None:
+            cipher = _NumpyCTR(engine, iv)
+        else:
+            cipher = SM4Cipher(key, mode, iv, decrypt=decrypt, padding=padding, engine=engine)
+        stats.backend = _backend_name(engine, buffer_size)
+        _crypt_blockmode(cipher, src, dst, buffer_size, stats)
+    return stats
+
+
+def _file_mode():
+    """新建文件的常规权限（0666去掉umask）；mkstemp创建的临时文件只有属主可读写"""
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+def _load_key(args, parser):
+    """密钥来源优先级：--key > --key-file > 环境变量 SM4_KEY"""
+    if args.key:
+        text = args.key
+    elif args.key_file:
+        try:
+            with open(args.key_file, 'rb') as f:
+                raw = f.read()
+        except OSError as e:
+            parser.error(f"无法读取密钥文件 {args.key_file}: {e.strerror}")
+        if len(raw) == 16:
+            return raw
+        text = raw.decode('ascii', 'replace')
+    else:
+        text = os.environ.get(_ENV_KEY)
+        if not text:
+            parser.error(f"需要提供 --key、--key-file 或环境变量 {_ENV_KEY}")
+    try:
+        key = bytes.fromhex(text.strip())
+    except ValueError:
+        parser.error("密钥必须是32个16进制字符")
+    if len(key) != 16:
+        parser.error("密钥必须是32个16进制字符")
+    return key
+
+
+def cli_verification():
+    """各模式往返与参考实现一致性验证，以及内存流吞吐量"""
+    from sm4_gcm import encrypt as gcm_encrypt
+    from sm4_modes import encrypt as modes_encrypt
+
+    print("SM4命令行工具自检")
+    print("=" * 40)
+    key = os.urandom(16)
+    data = os.urandom(100003)
+    for mode in MODES:
+        iv = None if mode == 'ECB' else os.urandom(GCM_IV_SIZE if mode == 'GCM' else BLOCK_SIZE)
+        ct = io.BytesIO()
+        # 小缓冲区：覆盖跨缓冲区的不满分组和GCM标签拆分
+        crypt_stream(key, io.BytesIO(data), ct, mode, iv=iv, buffer_size=4096)
+        if mode == 'GCM':
+            ref_ct, ref_tag = gcm_encrypt(key, iv, data)
+            reference = ref_ct + ref_tag
+        else:
+            reference = modes_encrypt(key, data, mode, iv)
+        pt = io.BytesIO()
+        crypt_stream(key, io.BytesIO(ct.getvalue()), pt, mode, decrypt=True, iv=iv, buffer_size=4096)
+        ok = ct.getvalue() == reference and pt.getvalue() == data
+        print(f"{mode}: {'✓' if ok else '✗'}")
+
+        if mode != 'ECB':
+            # 不指定IV：随机IV写在密文开头，解密时自动读取
+            ct = io.BytesIO()
+            crypt_stream(key, io.BytesIO(data), ct, mode)
+            pt = io.BytesIO()
+            crypt_stream(key, io.BytesIO(ct.getvalue()), pt, mode, decrypt=True)
+            print(f"{mode} (IV写入密文头): {'✓' if pt.getvalue() == data else '✗'}")
+
+    ct = io.BytesIO()
+    crypt_stream(key, io.BytesIO(data), ct, 'GCM')
+    tampered = bytearray(ct.getvalue())
+    tampered[20] ^= 1
+    try:
+        crypt_stream(key, io.BytesIO(bytes(tampered)), io.BytesIO(), 'GCM', decrypt=True)
+        detected = False
+    except ValueError:
+        detected = True
+    print(f"GCM篡改检测: {'✓' if detected else '✗'}")
+
+    # CBC加密是串行的，吞吐量测试使用可并行的CTR加密和CBC解密
+    payload = os.urandom(16 * 1024 * 1024)
+    stats = crypt_stream(key, io.BytesIO(payload), io.BytesIO(), 'CTR')
+    print("\n[CTR 加密] " + stats.report())
+    stats = crypt_stream(key, io.BytesIO(payload), io.BytesIO(), 'CBC', decrypt=True, padding=False)
+    print("\n[CBC 解密] " + stats.report())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m sm4_cli',
+        description="SM4流式加解密：从标准输入/文件读取，写到标准输出/文件",
+    )
+    action = parser.add_mutually_exclusive_group()
+    action.add_argument('-e', '--encrypt', action='store_true', help="加密（默认）")
+    action.add_argument('-d', '--decrypt', action='store_true', help="解密")
+    parser.add_argument('-m', '--mode', default='CBC', type=str.upper, choices=MODES, help="工作模式，默认CBC")
+    parser.add_argument('-k', '--key', help="16字节密钥（32个16进制字符）")
+    parser.add_argument('--key-file', help="密钥文件（16字节原始密钥或32个16进制字符）")
+    parser.add_argument('--iv', help="IV（16进制）；不指定时加密随机生成并写在输出开头，解密从输入开头读取")
+    parser.add_argument('--aad', default='', help="GCM附加认证数据（16进制）")
+    parser.add_argument('--no-padding', action='store_true', help="ECB/CBC不使用PKCS#7填充")
+    parser.add_argument('-i', '--input', default='-', help="输入文件，默认标准输入")
+    parser.add_argument('-o', '--output', default='-', help="输出文件，默认标准输出")
+    parser.add_argument('-b', '--buffer-size', type=int, default=DEFAULT_BUFFER_SIZE, help="读缓冲区字节数")
+    parser.add_argument('--backend', default='auto', choices=['auto'] + list(BACKENDS),
+                        help="分组运算后端，默认按批量大小自动选择最快的")
+    parser.add_argument('-s', '--stats', action='store_true', help="在标准错误输出吞吐量与延迟统计")
+    parser.add_argument('--self-test', action='store_true', help="运行正确性与性能验证")
+    args = parser.parse_args(argv)
+
+    if args.self_test:
+        cli_verification()
+        return 0
+    key = _load_key(args, parser)
+    if args.iv and args.mode == 'ECB':
+        parser.error("ECB 模式不使用 IV")
+    if args.aad and args.mode != 'GCM':
+        parser.error("只有 GCM 模式使用 --aad")
+    try:
+        iv = bytes.fromhex(args.iv) if args.iv else None
+        aad = bytes.fromhex(args.aad)
+    except ValueError:
+        parser.error("IV/AAD 必须是16进制字符串")
+
+    src, dst, tmp = sys.stdin.buffer, sys.stdout.buffer, None
+    try:
+        if args.input != '-':
+            src = open(args.input, 'rb', buffering=0)
+    except OSError as e:
+        parser.error(f"无法打开 {args.input}: {e.strerror}")
+    try:
+        if args.output != '-':
+            if os.path.isdir(args.output):
+                raise IsADirectoryError(errno.EISDIR, os.strerror(errno.EISDIR))
+            # 先写到同目录下的临时文件，成功后再替换：GCM标签校验失败或中途出错时，
+            # 目标路径上不会留下未经认证或不完整的输出
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(args.output)), prefix='.tmp')
+            dst = os.fdopen(fd, 'wb')
+    except OSError as e:
+        if src is not sys.stdin.buffer:
+            src.close()
+        parser.error(f"无法打开 {args.output}: {e.strerror}")
+    try:
+        stats = crypt_stream(key, src, dst, args.mode, decrypt=args.decrypt, iv=iv, aad=aad,
+                             padding=False if args.no_padding else None, backend=args.backend,
+                             buffer_size=args.buffer_size)
+        dst.flush()
+        if tmp is not None:
+            dst.close()
+            os.chmod(tmp, _file_mode())
+            os.replace(tmp, args.output)
+            tmp = None
+    except (ValueError, OSError) as e:
+        # 读写过程中的I/O错误（磁盘已满、管道关闭等）与格式错误一样输出一行后返回非0
+        print(f"sm4_cli: {e}", file=sys.stderr)
+        return 1
+    finally:
+        if src is not sys.stdin.buffer:
+            src.close()
+        if dst is not sys.stdout.buffer:
+            dst.close()
+        if tmp is not None:
+            os.remove(tmp)
+    if args.stats:
+        print(stats.report(), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,291 @@
+import functools
+import hmac
+import struct
+
+from sm4 import SM4
+from sm4_modes import BLOCK_SIZE, _crypt_block
+
+try:
+    import numpy as np
+
+    from sm4_numpy import _CHUNK_BLOCKS, _rounds, expand_keys
+except ImportError:
+    np = None
+
+# 子密钥缓存容量（按密钥缓存轮密钥与K1/K2）
+SUBKEY_CACHE_SIZE = 4096
+
+_MASK32 = 0xFFFFFFFF
+_MASK128 = (1 << 128) - 1
+_RB = 0x87
+
+
+def _dbl(v):
+    """GF(2^128)中乘以x（CMAC子密钥推导）"""
+    v <<= 1
+    return (v & _MASK128) ^ _RB if v >> 128 else v
+
+
+def _words(v):
+    return (v >> 96) & _MASK32, (v >> 64) & _MASK32, (v >> 32) & _MASK32, v & _MASK32
+
+
+@functools.lru_cache(maxsize=SUBKEY_CACHE_SIZE)
+def _subkeys(key):
+    """LRU缓存的 (轮密钥, K1, K2)，K1/K2为4个32位字的元组"""
+    rk = tuple(SM4(key).rk)
+    l0, l1, l2, l3 = _crypt_block(rk, 0, 0, 0, 0)
+    k1 = _dbl((l0 << 96) | (l1 << 64) | (l2 << 32) | l3)
+    return rk, _words(k1), _words(_dbl(k1))
+
+
+def _pad_last(last):
+    """末块补 0x80 00..00，返回 (补齐后的16字节, 是否为完整分组)"""
+    if len(last) == BLOCK_SIZE:
+        return bytes(last), True
+    return bytes(last) + b'\x80' + bytes(BLOCK_SIZE - 1 - len(last)), False
+
+
+def _padded(m):
+    """把消息补齐为整数个分组（完整的末块不补）"""
+    if m and not len(m) % BLOCK_SIZE:
+        return bytes(m)
+    full = len(m) // BLOCK_SIZE * BLOCK_SIZE
+    return bytes(m[:full]) + _pad_last(m[full:])[0]
+
+
+class SM4_CMAC:
+    """SM4-CMAC（NIST SP 800-38B），接口与hmac/hashlib对象一致
+
+    轮密钥和子密钥按密钥缓存；update()只缓存最后一个（可能不完整的）分组，
+    其余分组立即串行链接。
+    """
+
+    block_size = BLOCK_SIZE
+
+    def __init__(self, key, msg=None, mac_length=16):
+        if len(key) != 16:
+            raise ValueError("SM4 密钥必须是 16 bytes (128 bits) 长")
+        if not 4 <= mac_length <= 16:
+            raise ValueError("MAC 长度必须在 4~16 字节之间")
+        self.digest_size = mac_length
+        self._rk, self._k1, self._k2 = _subkeys(bytes(key))
+        self._state = (0, 0, 0, 0)
+        self._buf = bytearray()
+        if msg is not None:
+            self.update(msg)
+
+    def update(self, data):
+        buf = self._buf
+        buf += data
+        # 保留最后一个分组（即使是完整的），它在digest()时要与子密钥异或
+        full = (len(buf) - 1) // BLOCK_SIZE * BLOCK_SIZE
+        if full > 0:
+            rk = self._rk
+            x0, x1, x2, x3 = self._state
+            for off in range(0, full, BLOCK_SIZE):
+                m0, m1, m2, m3 = struct.unpack_from('>4I', buf, off)
+                x0, x1, x2, x3 = _crypt_block(rk, x0 ^ m0, x1 ^ m1, x2 ^ m2, x3 ^ m3)
+            self._state = (x0, x1, x2, x3)
+            del buf[:full]
+
+    def copy(self):
+        other = SM4_CMAC.__new__(SM4_CMAC)
+        other.digest_size = self.digest_size
+        other._rk, other._k1, other._k2 = self._rk, self._k1, self._k2
+        other._state = self._state
+        other._buf = bytearray(self._buf)
+        return other
+
+    def digest(self):
+        last, complete = _pad_last(self._buf)
+        k = self._k1 if complete else self._k2
+        m = struct.unpack('>4I', last)
+        x = [s ^ w ^ kw for s, w, kw in zip(self._state, m, k)]
+        return struct.pack('>4I', *_crypt_block(self._rk, *x))[:self.digest_size]
+
+    def hexdigest(self):
+        return self.digest().hex()
+
+    def verify(self, tag):
+        """恒定时间比较，不匹配时抛出ValueError"""
+        if not hmac.compare_digest(self.digest(), bytes(tag)):
+            raise ValueError("MAC 校验失败")
+
+
+def cmac(key, data, mac_length=16):
+    """一次性计算SM4-CMAC"""
+    return SM4_CMAC(key, data, mac_length).digest()
+
+
+def cbc_mac(key, data):
+    """原始CBC-MAC（零IV，数据须为16字节整数倍）
+
+    只对固定长度的消息安全；变长消息请使用cmac()。
+    """
+    if not data or len(data) % BLOCK_SIZE:
+        raise ValueError("CBC-MAC 的数据长度必须是16字节的正整数倍")
+    rk = _subkeys(bytes(key))[0]
+    x0 = x1 = x2 = x3 = 0
+    for off in range(0, len(data), BLOCK_SIZE):
+        m0, m1, m2, m3 = struct.unpack_from('>4I', data, off)
+        x0, x1, x2, x3 = _crypt_block(rk, x0 ^ m0, x1 ^ m1, x2 ^ m2, x3 ^ m3)
+    return struct.pack('>4I', x0, x1, x2, x3)
+
+
+def _dbl_lanes(w):
+    """对(N, 4)的uint32字数组逐行做GF(2^128)乘x"""
+    out = w << np.uint32(1)
+    out[:, :3] |= w[:, 1:] >> np.uint32(31)
+    out[:, 3] ^= (w[:, 0] >> np.uint32(31)) * np.uint32(_RB)
+    return out
+
+
+def _cmac_lanes(messages, rk, k1, k2):
+    """一组消息的向量化CMAC，返回(N, 4)的uint32结果
+
+    rk为32个整数（共用密钥）或(32, N)数组，k1/k2为(4,)或(N, 4)数组。
+    按分组数降序排列后，第j步只需处理前 count_j 条仍有第j个分组的消息（数组前缀）。
+    """
+    n = len(messages)
+    lengths = np.fromiter((len(m) for m in messages), dtype=np.int64, count=n)
+    nblocks = np.maximum((lengths + BLOCK_SIZE - 1) // BLOCK_SIZE, 1)
+    order = np.argsort(-nblocks, kind='stable')
+    nblocks = nblocks[order]
+    complete = (lengths[order] > 0) & (lengths[order] % BLOCK_SIZE == 0)
+
+    # 所有消息补齐后首尾相接，starts[i]为第i条（排序后）消息首个分组的下标
+    flat = np.frombuffer(b''.join(_padded(messages[i]) for i in order), dtype='>u4').reshape(-1, 4)
+    flat = flat.astype(np.uint32)
+    starts = np.zeros(n, dtype=np.int64)
+    np.cumsum(nblocks[:-1], out=starts[1:])
+
+    last = starts + nblocks - 1
+    if k1.ndim == 2:
+        k1, k2 = k1[order], k2[order]
+        flat[last] ^= np.where(complete[:, None], k1, k2)
+        rk = rk[:, order]
+    else:
+        flat[last] ^= np.where(complete[:, None], k1[None, :], k2[None, :])
+
+    state = np.zeros((n, 4), dtype=np.uint32)
+    # counts[j]：分组数大于j的消息条数
+    counts = np.searchsorted(-nblocks, -np.arange(1, nblocks[0] + 1), side='right')
+    for j, k in enumerate(counts):
+        x = state[:k] ^ flat[starts[:k] + j]
+        y = _rounds(*(np.ascontiguousarray(x[:, c]) for c in range(4)),
+                    rk if isinstance(rk, tuple) else rk[:, :k])
+        for c in range(4):
+            state[:k, c] = y[c]
+    result = np.empty_like(state)
+    result[order] = state
+    return result
+
+
+def cmac_many(key, messages, mac_length=16):
+    """批量计算多条独立消息的CMAC，返回与messages顺序一致的MAC列表
+
+    key为单个16字节密钥（所有消息共用），或与messages等长的密钥序列（每条消息一个密钥）。
+    单条消息的链接是串行的，但不同消息互不依赖：NumPy可用时把每条消息作为一个向量通道，
+    所有消息的第j个分组在同一次32轮迭代中处理，Python开销与消息条数无关。
+    """
+    messages = list(messages)
+    single_key = isinstance(key, (bytes, bytearray, memoryview))
+    if not single_key:
+        keys = [bytes(k) for k in key]
+        if len(keys) != len(messages):
+            raise ValueError("密钥数量必须与消息数量相同")
+        if any(len(k) != 16 for k in keys):
+            raise ValueError("SM4 密钥必须是 16 bytes (128 bits) 长")
+    elif len(key) != 16:
+        raise ValueError("SM4 密钥必须是 16 bytes (128 bits) 长")
+    if not 4 <= mac_length <= 16:
+        raise ValueError("MAC 长度必须在 4~16 字节之间")
+    if not messages:
+        return []
+    if np is None:
+        if single_key:
+            return [cmac(key, m, mac_length) for m in messages]
+        return [cmac(k, m, mac_length) for k, m in zip(keys, messages)]
+
+    macs = []
+    if single_key:
+        rk, k1, k2 = _subkeys(bytes(key))
+        k1 = np.array(k1, dtype=np.uint32)
+        k2 = np.array(k2, dtype=np.uint32)
+    for i in range(0, len(messages), _CHUNK_BLOCKS):
+        chunk = messages[i:i + _CHUNK_BLOCKS]
+        if not single_key:
+            # 子密钥同样批量推导：L = E_K(0)，K1 = dbl(L)，K2 = dbl(K1)
+            rk = expand_keys(b''.join(keys[i:i + _CHUNK_BLOCKS]))
+            zero = np.zeros(len(chunk), dtype=np.uint32)
+            y = _rounds(zero, zero.copy(), zero.copy(), zero.copy(), rk)
+            k1 = _dbl_lanes(np.stack(y, axis=1))
+            k2 = _dbl_lanes(k1)
+        out = _cmac_lanes(chunk, rk, k1, k2).astype('>u4').tobytes()
+        macs += [out[j:j + mac_length] for j in range(0, len(out), BLOCK_SIZE)]
+    return macs
+
+
+def cmac_verification():
+    """正确性与批量吞吐量验证"""
+    import os
+    import time
+
+    from sm4_modes import encrypt as encrypt_cbc
+
+    print("SM4-CMAC")
+    print("=" * 40)
+    key = bytes.fromhex('0123456789abcdeffedcba9876543210')
+
+    # 参考实现：末块与子密钥异或后做零IV的CBC加密，取最后一个密文分组
+    def reference(k, m):
+        _, k1, k2 = _subkeys(k)
+        full = len(m) // BLOCK_SIZE * BLOCK_SIZE
+        if m and full == len(m):
+            body, (last, _) = m[:-BLOCK_SIZE], _pad_last(m[-BLOCK_SIZE:])
+            sub = k1
+        else:
+            body, (last, _) = m[:full], _pad_last(m[full:])
+            sub = k2
+        last = bytes(a ^ b for a, b in zip(last, struct.pack('>4I', *sub)))
+        return encrypt_cbc(k, body + last, 'CBC', bytes(16), padding=False)[-BLOCK_SIZE:]
+
+    messages = [os.urandom(n) for n in (0, 1, 15, 16, 17, 31, 32, 33, 64, 100, 1000)]
+    ok = all(cmac(key, m) == reference(key, m) for m in messages)
+    print(f"与CBC参考实现一致: {'✓' if ok else '✗'}")
+
+    m = os.urandom(1000)
+    h = SM4_CMAC(key)
+    for i in range(0, len(m), 7):
+        h.update(m[i:i + 7])
+    c = h.copy()
+    c.update(b'x')
+    print(f"增量计算与copy(): {'✓' if h.digest() == cmac(key, m) and c.digest() == cmac(key, m + b'x') else '✗'}")
+    try:
+        SM4_CMAC(key, m).verify(bytes(16))
+        rejected = False
+    except ValueError:
+        rejected = True
+    print(f"错误MAC被拒绝: {'✓' if rejected else '✗'}")
+    print(f"CBC-MAC: {'✓' if cbc_mac(key, m[:992]) == encrypt_cbc(key, m[:992], 'CBC', bytes(16), padding=False)[-16:] else '✗'}")
+
+    batch = [os.urandom(n) for n in (os.urandom(1)[0] % 80 for _ in range(2000))]
+    print(f"批量CMAC一致: {'✓' if cmac_many(key, batch) == [cmac(key, b) for b in batch] else '✗'}")
+    keys = [os.urandom(16) for _ in batch]
+    print(f"批量CMAC（每条独立密钥）一致: "
+          f"{'✓' if cmac_many(keys, batch, 8) == [cmac(k, b, 8) for k, b in zip(keys, batch)] else '✗'}")
+
+    records = [os.urandom(48) for _ in range(20000)]
+    start = time.perf_counter()
+    for r in records:
+        cmac(key, r)
+    serial = time.perf_counter() - start
+    start = time.perf_counter()
+    cmac_many(key, records)
+    batched = time.perf_counter() - start
+    print(f"\n20000 条 48 字节记录: 逐条 {len(records) / serial:.0f} 条/s, 批量 {len(records) / batched:.0f} 条/s")
+
+
+if __name__ == "__main__":
+    cmac_verification()
@@ -0,0 +1,320 @@
+import functools
+import hashlib
+import struct
+import threading
+
+from sm4_backend import get_engine
+from sm4_modes import BLOCK_SIZE, _counter_words, _xor_bytes
+
+try:
+    from sm4_numpy import counter_blocks
+except ImportError:
+    counter_blocks = None
+
+# 默认预取深度（环形缓冲区字节数）与后台线程每次生成的密钥流大小
+DEFAULT_DEPTH = 256 * 1024
+DEFAULT_SEGMENT = 16 * 1024
+# 接收方decrypt_packet()按密钥缓存的引擎个数
+RECEIVER_CACHE_SIZE = 64
+
+_COUNTER_SPACE = 1 << 128
+
+# 计数器区间登记：密钥摘要 -> [[起始计数器, 结束计数器或None(仍在使用)], ...]
+# 只记录在当前进程的内存中，不能防止其他进程或重启后的进程重复使用计数器
+_reserved = {}
+_reserved_lock = threading.Lock()
+
+
+def _key_id(key):
+    return hashlib.sha256(bytes(key)).digest()
+
+
+def _reserve(key_id, start):
+    """登记从start开始的计数器区间，返回不得超过的上限（下一个已登记区间的起点）"""
+    with _reserved_lock:
+        ranges = _reserved.setdefault(key_id, [])
+        limit = _COUNTER_SPACE
+        for lo, hi in ranges:
+            if lo <= start and (hi is None or start < hi):
+                raise ValueError("该密钥下的计数器已被使用，重复使用会泄露明文")
+            if lo > start:
+                limit = min(limit, lo)
+        entry = [start, None]
+        ranges.append(entry)
+        return entry, limit
+
+
+def _release(key_id, entry, end):
+    """关闭时把区间终点定为已生成的最后一个计数器（丢弃的密钥流也视为已使用）
+
+    已关闭的区间相互重叠或首尾相接时合并，从next_counter继续的多个实例只占一项。
+    """
+    with _reserved_lock:
+        entry[1] = end
+        ranges = _reserved[key_id]
+        merged = []
+        for r in sorted(r for r in ranges if r[1] is not None):
+            if merged and r[0] <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], r[1])
+            else:
+                merged.append(r)
+        ranges[:] = [r for r in ranges if r[1] is None] + merged
+
+
+def forget(key):
+    """密钥停用（换钥）后删除它的计数器登记，长期运行的进程不会因换钥无限增长
+
+    该密钥仍有未关闭的预取器时抛出ValueError；删除后同一密钥的计数器不再受保护，不得再用于加密。
+    """
+    key_id = _key_id(key)
+    with _reserved_lock:
+        if any(hi is None for _, hi in _reserved.get(key_id, ())):
+            raise ValueError("该密钥仍有未关闭的预取器")
+        _reserved.pop(key_id, None)
+
+
+@functools.lru_cache(maxsize=RECEIVER_CACHE_SIZE)
+def _receiver_engine(key, backend):
+    return get_engine(key, backend)
+
+
+def decrypt_packet(key, counter, packet, backend='auto'):
+    """按发送方给出的起始计数器解密一个数据包（接收方使用）
+
+    直接计算该包的密钥流，不需要预取器实例，也不登记计数器区间，
+    同一进程中的发送方和接收方可以使用相同的密钥和初始计数器。
+    """
+    blocks = -(-len(packet) // BLOCK_SIZE)
+    ks = _receiver_engine(bytes(key), backend).crypt(_counter_bytes(counter % _COUNTER_SPACE, blocks))
+    return _xor_bytes(packet, ks[:len(packet)])
+
+
+def _counter_bytes(counter, blocks):
+    """生成连续计数器分组（128位大端）"""
+    if counter_blocks is not None:
+        return counter_blocks(counter, blocks).astype('>u4').tobytes()
+    return struct.pack(f'>{4 * blocks}I', *_counter_words(counter, blocks))
+
+
+class CTRKeystreamPrefetcher:
+    """SM4-CTR密钥流预取器：后台线程提前为后续计数器生成密钥流，存入环形缓冲区
+
+    每个数据包从分组边界开始占用 ceil(len/16) 个计数器，encrypt() 只需取出密钥流做一次异或，
+    返回包的起始计数器供接收方用模块级的 decrypt_packet() 解密。
+    - 背压：缓冲区满时后台线程阻塞；密钥流不足时调用方最多等待 timeout 秒
+    - 计数器防重用：同一进程内相同密钥的计数器区间互不重叠，关闭后已生成（含未使用）的区间不再分配；
+      登记只在当前进程内有效，跨进程或重启时应持久化 next_counter 并以它作为新的起始计数器；
+      换钥后用 forget(key) 删除旧密钥的登记
+    原生/NumPy后端在计算期间释放GIL，密钥流生成可与网络I/O重叠。
+    """
+
+    def __init__(self, key, iv, depth=DEFAULT_DEPTH, segment=DEFAULT_SEGMENT, backend='auto', timeout=1.0):
+        if len(iv) != BLOCK_SIZE:
+            raise ValueError("初始计数器必须是 16 bytes")
+        if segment <= 0 or segment % BLOCK_SIZE:
+            raise ValueError("segment 必须是16字节的正整数倍")
+        if depth < 2 * segment or depth % segment:
+            raise ValueError("depth 必须是 segment 的整数倍且至少为两倍")
+        self._engine = get_engine(key, backend)
+        self.depth = depth
+        self.segment = segment
+        self.timeout = timeout
+        self._start = int.from_bytes(iv, 'big')
+        self._key_id = _key_id(key)
+        self._entry, self._limit = _reserve(self._key_id, self._start)
+
+        self._ring = bytearray(depth)
+        self._head = 0  # 已取出的字节数
+        self._tail = 0  # 已生成的字节数
+        self._closed = False
+        self._error = None
+        self.stalls = 0  # 调用方等待密钥流的次数
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._produce, name='sm4-ctr-prefetch', daemon=True)
+        self._thread.start()
+
+    def _produce(self):
+        ring, depth = self._ring, self.depth
+        try:
+            while True:
+                with self._cond:
+                    while not self._closed and self._tail + self.segment - self._head > depth:
+                        self._cond.wait()
+                    if self._closed:
+                        return
+                    tail = self._tail
+                counter = self._start + tail // BLOCK_SIZE
+                blocks = min(self.segment // BLOCK_SIZE, self._limit - counter)
+                if blocks <= 0:
+                    return
+                # 写入区域在head之前的空闲部分，调用方不会读取，无需持锁
+                ks = self._engine.crypt(_counter_bytes(counter, blocks))
+                pos = tail % depth
+                ring[pos:pos + len(ks)] = ks
+                with self._cond:
+                    self._tail = tail + len(ks)
+                    self._cond.notify_all()
+        except Exception as e:
+            with self._cond:
+                self._error = e
+                self._cond.notify_all()
+
+    def _take(self, n):
+        """取出n字节密钥流（按分组向上取整占用计数器），返回 (起始计数器, 密钥流)"""
+        size = -(-n // BLOCK_SIZE) * BLOCK_SIZE
+        if size > self.depth:
+            raise ValueError(f"数据包不能超过预取深度 {self.depth} 字节")
+        with self._cond:
+            if self._closed:
+                raise ValueError("预取器已关闭")
+            if self._start + (self._head + size) // BLOCK_SIZE > self._limit:
+                raise ValueError("计数器空间已用尽，请更换密钥或初始计数器")
+            if self._tail - self._head < size:
+                self.stalls += 1
+                if not self._cond.wait_for(lambda: self._tail - self._head >= size or self._error is not None,
+                                           self.timeout):
+                    raise TimeoutError("等待密钥流超时")
+                if self._error is not None:
+                    raise RuntimeError("密钥流生成失败") from self._error
+            head = self._head
+            pos = head % self.depth
+            end = pos + n
+            if end <= self.depth:
+                ks = bytes(self._ring[pos:end])
+            else:
+                ks = bytes(self._ring[pos:]) + bytes(self._ring[:end - self.depth])
+            self._head = head + size
+            self._cond.notify_all()
+        return self._start + head // BLOCK_SIZE, ks
+
+    def encrypt(self, packet):
+        """加密一个数据包，返回 (起始计数器, 密文)"""
+        if not packet:
+            raise ValueError("数据包不能为空")
+        counter, ks = self._take(len(packet))
+        return counter, _xor_bytes(packet, ks)
+
+    @property
+    def prefetched(self):
+        """当前已预取、可立即使用的密钥流字节数"""
+        with self._cond:
+            return self._tail - self._head
+
+    @property
+    def next_counter(self):
+        """下一个可安全使用的计数器（已生成的密钥流之后），重启时应以它继续"""
+        with self._cond:
+            return self._start + self._tail // BLOCK_SIZE
+
+    def close(self):
+        """停止后台线程；已生成但未使用的密钥流直接丢弃，其计数器不再分配"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        _release(self._key_id, self._entry, self.next_counter)
+        self._ring[:] = bytes(self.depth)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def prefetch_verification():
+    """正确性、计数器防重用与单包延迟对比"""
+    import os
+    import time
+
+    from sm4_metrics import LatencyHistogram
+    from sm4_modes import encrypt as encrypt_ctr
+
+    print("SM4-CTR密钥流预取")
+    print("=" * 40)
+    key = os.urandom(16)
+    iv = bytes(15) + b'\x00'
+    packets = [os.urandom(n) for n in (1, 15, 16, 17, 1400, 64, 1500, 9000) * 50]
+
+    ok = True
+    with CTRKeystreamPrefetcher(key, iv, depth=64 * 1024, segment=4096) as pf:
+        for p in packets:
+            counter, ct = pf.encrypt(p)
+            expected = encrypt_ctr(key, p, 'CTR', counter.to_bytes(16, 'big'))
+            ok = ok and ct == expected and decrypt_packet(key, counter, ct) == p
+    resume = pf.next_counter
+    print(f"逐包加密与CTR模式一致: {'✓' if ok else '✗'}")
+
+    try:
+        CTRKeystreamPrefetcher(key, iv).close()
+        reused = False
+    except ValueError:
+        reused = True
+    print(f"拒绝重复使用计数器: {'✓' if reused else '✗'}")
+    with CTRKeystreamPrefetcher(key, resume.to_bytes(16, 'big')) as pf:
+        print(f"从 next_counter 继续: {'✓' if pf.encrypt(b'x')[0] == resume else '✗'}")
+
+    limit_key = os.urandom(16)
+    CTRKeystreamPrefetcher(limit_key, (100).to_bytes(16, 'big')).close()
+    with CTRKeystreamPrefetcher(limit_key, (96).to_bytes(16, 'big'), depth=8192, segment=4096) as pf:
+        pf.encrypt(bytes(64))
+        try:
+            pf.encrypt(bytes(16))
+            bounded = False
+        except ValueError:
+            bounded = True
+    print(f"不越过已登记区间: {'✓' if bounded else '✗'}")
+
+    # 换钥：关闭后删除旧密钥的登记；仍在使用时拒绝删除
+    old_key = os.urandom(16)
+    start = 0
+    for _ in range(3):
+        with CTRKeystreamPrefetcher(old_key, start.to_bytes(16, 'big'), depth=8192, segment=4096) as pf:
+            pf.encrypt(bytes(100))
+        # 关闭后再读取：后台线程在关闭前可能还生成了更多密钥流
+        start = pf.next_counter
+    merged = len(_reserved[_key_id(old_key)]) == 1
+    pf = CTRKeystreamPrefetcher(old_key, start.to_bytes(16, 'big'), depth=8192, segment=4096)
+    try:
+        forget(old_key)
+        refused = False
+    except ValueError:
+        refused = True
+    pf.close()
+    forget(old_key)
+    ok = merged and refused and _key_id(old_key) not in _reserved
+    print(f"相邻区间合并、换钥后 forget() 删除登记: {'✓' if ok else '✗'}")
+
+    # 延迟对比：模拟每个包之间有少量I/O，预取线程在间隙中补充缓冲区
+    key = os.urandom(16)
+    packet = os.urandom(1400)
+    engine = get_engine(key)
+    rounds = 2000
+    direct = LatencyHistogram()
+    counter = 0
+    for _ in range(rounds):
+        start = time.perf_counter()
+        ks = engine.crypt(_counter_bytes(counter, 88))
+        _xor_bytes(packet, ks[:len(packet)])
+        direct.add(time.perf_counter() - start)
+        counter += 88
+        time.sleep(0.0001)
+    prefetched = LatencyHistogram()
+    with CTRKeystreamPrefetcher(key, os.urandom(16)) as pf:
+        time.sleep(0.05)
+        for _ in range(rounds):
+            start = time.perf_counter()
+            pf.encrypt(packet)
+            prefetched.add(time.perf_counter() - start)
+            time.sleep(0.0001)
+        stalls = pf.stalls
+    for name, h in (("逐包计算", direct), ("预取", prefetched)):
+        print(f"{name}: 平均 {h.total / h.count * 1e6:.1f}us, p50 {h.percentile(50) * 1e6:.1f}us, "
+              f"p99 {h.percentile(99) * 1e6:.1f}us")
+    print(f"预取缓冲区耗尽次数: {stalls}")
+
+
+if __name__ == "__main__":
+    prefetch_verification()
@@ -0,0 +1,164 @@
+import abc
+import threading
+import time
+
+# 已注册可插桩的类；全局开关通过设置这些类的 metrics 类属性实现
+_instrumented_classes = []
+
+
+class MetricsSink(abc.ABC):
+    """性能统计接收器接口
+
+    被插桩的对象在 metrics 不为 None 时调用 measure()，
+    子类只需实现 record() 即可接入自己的监控系统；未实现 record() 的子类不能实例化。
+    """
+
+    @abc.abstractmethod
+    def record(self, operation, seconds, nbytes, blocks):
+        """记录一次操作：操作名、耗时（秒）、字节数、分组数"""
+
+    def measure(self, operation, func, data, *args):
+        """计时调用 func(data, *args) 并记录结果"""
+        start = time.perf_counter()
+        result = func(data, *args)
+        elapsed = time.perf_counter() - start
+        n = len(data)
+        self.record(operation, elapsed, n, n // 16)
+        return result
+
+
+class LatencyHistogram:
+    """以2的幂（纳秒）为桶边界的延迟直方图"""
+
+    BUCKETS = 64
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, seconds):
+        ns = int(seconds * 1e9)
+        self.counts[min(ns.bit_length(), self.BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        """近似分位数（返回所在桶的上界，单位秒）"""
+        if not self.count:
+            return 0.0
+        target = self.count * p / 100
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if c and seen >= target:
+                return min((1 << i) / 1e9, self.max)
+        return self.max
+
+
+class SM4Metrics(MetricsSink):
+    """线程安全的统计实现：按操作记录调用次数、字节数、分组数和延迟直方图"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.operations = {}
+        self.last_latency = None
+
+    def record(self, operation, seconds, nbytes, blocks):
+        with self._lock:
+            stats = self.operations.get(operation)
+            if stats is None:
+                stats = self.operations[operation] = {
+                    'calls': 0, 'bytes': 0, 'blocks': 0, 'latency': LatencyHistogram()
+                }
+            stats['calls'] += 1
+            stats['bytes'] += nbytes
+            stats['blocks'] += blocks
+            stats['latency'].add(seconds)
+            self.last_latency = seconds
+
+    def reset(self):
+        with self._lock:
+            self.operations = {}
+            self.last_latency = None
+
+    def report(self):
+        """生成文本报告"""
+        lines = []
+        with self._lock:
+            for op, stats in sorted(self.operations.items()):
+                h = stats['latency']
+                mb_s = stats['bytes'] / (1024 * 1024) / h.total if h.total else 0.0
+                lines.append(
+                    f"{op}: {stats['calls']} 次, {stats['bytes']} 字节, {stats['blocks']} 分组, "
+                    f"平均 {h.total / h.count * 1e6:.2f}us, p50 {h.percentile(50) * 1e6:.2f}us, "
+                    f"p99 {h.percentile(99) * 1e6:.2f}us, {mb_s:.2f} MB/s"
+                )
+        return '\n'.join(lines)
+
+
+def register(cls):
+    """注册可插桩的类（类需定义 metrics = None 类属性）"""
+    if cls not in _instrumented_classes:
+        _instrumented_classes.append(cls)
+    return cls
+
+
+def set_global_sink(sink):
+    """为所有已注册类的实例全局启用（sink为None时关闭）统计；实例自身的设置优先"""
+    for cls in _instrumented_classes:
+        cls.metrics = sink
+
+
+def get_global_sink():
+    return _instrumented_classes[0].metrics if _instrumented_classes else None
+
+
+def metrics_demo():
+    """统计功能演示：对比关闭/开启统计时的开销"""
+    import os
+
+    from sm4 import SM4
+    from sm4_modes import SM4Cipher
+
+    print("SM4性能统计演示")
+    print("=" * 40)
+
+    key = bytes.fromhex('0123456789abcdeffedcba9876543210')
+    sm4 = SM4(key)
+    block = os.urandom(16)
+    iterations = 5000
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        sm4.encrypt(block)
+    disabled = time.perf_counter() - start
+
+    sink = SM4Metrics()
+    set_global_sink(sink)
+    try:
+        start = time.perf_counter()
+        for _ in range(iterations):
+            sm4.encrypt(block)
+        enabled = time.perf_counter() - start
+        cipher = SM4Cipher(key, 'CTR', os.urandom(16))
+        for _ in range(8):
+            cipher.update(os.urandom(64 * 1024))
+    finally:
+        set_global_sink(None)
+
+    print(f"关闭统计: {disabled / iterations * 1e6:.2f}us/块")
+    print(f"开启统计: {enabled / iterations * 1e6:.2f}us/块")
+    print(sink.report())
+
+
+if __name__ == "__main__":
+    # 以模块身份导入，确保与sm4等模块共用同一份注册表
+    import sm4_metrics
+    sm4_metrics.metrics_demo()
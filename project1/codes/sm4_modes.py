@@ -0,0 +1,382 @@
+import struct
+
+from sm4 import SM4
+from sm4_metrics import register
+
+BLOCK_SIZE = 16
+
+# 每次批量处理的分组数，限制中间整数列表的大小
+_CHUNK_BLOCKS = 4096
+
+_MASK32 = 0xFFFFFFFF
+_MASK128 = (1 << 128) - 1
+
+
+def _rotl(x, n):
+    """循环左移"""
+    return ((x << n) | (x >> (32 - n))) & _MASK32
+
+
+def _build_t_tables():
+    """预计算合成变换T的4张查找表（S盒+线性变换L）"""
+    tables = [[0] * 256 for _ in range(4)]
+    for i in range(256):
+        s = SM4.S_BOX[i]
+        for j in range(4):
+            b = s << (24 - 8 * j)
+            tables[j][i] = b ^ _rotl(b, 2) ^ _rotl(b, 10) ^ _rotl(b, 18) ^ _rotl(b, 24)
+    return tables
+
+
+_T0, _T1, _T2, _T3 = _build_t_tables()
+
+
+def _crypt_block(rk, x0, x1, x2, x3):
+    """单个分组的32轮迭代（输入输出均为4个32位字）"""
+    T0, T1, T2, T3 = _T0, _T1, _T2, _T3
+    for r in rk:
+        t = x1 ^ x2 ^ x3 ^ r
+        x0, x1, x2, x3 = x1, x2, x3, (x0 ^ T0[t >> 24] ^ T1[(t >> 16) & 0xFF] ^
+                                      T2[(t >> 8) & 0xFF] ^ T3[t & 0xFF])
+    return x3, x2, x1, x0
+
+
+def _crypt_words(words, rk):
+    """对连续的分组（按字展开）执行ECB变换，循环内联避免逐块函数调用"""
+    T0, T1, T2, T3 = _T0, _T1, _T2, _T3
+    out = []
+    for i in range(0, len(words), 4):
+        x0, x1, x2, x3 = words[i:i + 4]
+        for r in rk:
+            t = x1 ^ x2 ^ x3 ^ r
+            x0, x1, x2, x3 = x1, x2, x3, (x0 ^ T0[t >> 24] ^ T1[(t >> 16) & 0xFF] ^
+                                          T2[(t >> 8) & 0xFF] ^ T3[t & 0xFF])
+        out += (x3, x2, x1, x0)
+    return out
+
+
+def _counter_words(counter, blocks):
+    """生成连续计数器分组的字序列（128位大端计数器）"""
+    words = []
+    for i in range(blocks):
+        c = (counter + i) & _MASK128
+        words += ((c >> 96) & _MASK32, (c >> 64) & _MASK32, (c >> 32) & _MASK32, c & _MASK32)
+    return words
+
+
+def _xor_bytes(a, b):
+    """整段异或，利用大整数运算代替逐字节循环"""
+    n = len(a)
+    return (int.from_bytes(a, 'big') ^ int.from_bytes(b, 'big')).to_bytes(n, 'big')
+
+
+def pkcs7_pad(data):
+    """PKCS#7填充"""
+    n = BLOCK_SIZE - len(data) % BLOCK_SIZE
+    return bytes(data) + bytes([n]) * n
+
+
+def pkcs7_unpad(data):
+    """去除PKCS#7填充"""
+    if not data or len(data) % BLOCK_SIZE:
+        raise ValueError("填充数据长度无效")
+    n = data[-1]
+    if n < 1 or n > BLOCK_SIZE or data[-n:] != bytes([n]) * n:
+        raise ValueError("PKCS#7 填充无效")
+    return bytes(data[:-n])
+
+
+@register
+class SM4Cipher:
+    """增量式SM4加解密对象，支持ECB/CBC/CTR/OFB/CFB模式
+
+    update()只输出完整分组，未满一组的数据缓存到下次调用或finalize()。
+    ECB/CBC默认使用PKCS#7填充；CTR/OFB/CFB为流模式，最后一个分组允许不满16字节。
+    """
+
+    MODES = ('ECB', 'CBC', 'CTR', 'OFB', 'CFB')
+
+    # 性能统计接收器，为 None 时不做任何计时
+    metrics = None
+
+    def __init__(self, key, mode='CBC', iv=None, decrypt=False, padding=None, engine=None):
+        mode = mode.upper()
+        if mode not in self.MODES:
+            raise ValueError(f"不支持的工作模式: {mode}")
+        if mode != 'ECB':
+            if iv is None or len(iv) != BLOCK_SIZE:
+                raise ValueError("IV 必须是 16 bytes")
+        elif iv is not None:
+            raise ValueError("ECB 模式不使用 IV")
+        if padding is None:
+            padding = mode in ('ECB', 'CBC')
+        elif padding and mode not in ('ECB', 'CBC'):
+            raise ValueError(f"{mode} 模式为流模式，不使用填充")
+
+        self.mode = mode
+        self.decrypting = decrypt
+        self.padding = padding
+        sm4 = SM4(key)
+        self.rk = sm4.rk
+        self.rk_dec = sm4.rk_dec
+        # 可选的批量分组引擎，需提供 crypt(data, decrypt) -> bytes；为None时使用内置的纯Python实现
+        self.engine = engine
+        self._state = struct.unpack('>4I', iv) if iv is not None else None
+        self._counter = int.from_bytes(iv, 'big') if mode == 'CTR' else 0
+        self._pending = bytearray()
+        self._finalized = False
+
+    # ---------------- 批量分组处理 ----------------
+
+    def _ecb(self, data, decrypt=False):
+        """对整数个分组做ECB变换（字节进、字节出）"""
+        if self.engine is not None:
+            return self.engine.crypt(data, decrypt)
+        n = len(data) // BLOCK_SIZE
+        rk = self.rk_dec if decrypt else self.rk
+        return struct.pack(f'>{4 * n}I', *_crypt_words(struct.unpack(f'>{4 * n}I', data), rk))
+
+    def _block(self, x0, x1, x2, x3):
+        """加密单个分组（串行模式使用，输入输出均为4个32位字）"""
+        if self.engine is None:
+            return _crypt_block(self.rk, x0, x1, x2, x3)
+        return struct.unpack('>4I', self.engine.crypt(struct.pack('>4I', x0, x1, x2, x3), False))
+
+    def _process(self, src, dst):
+        """处理整数个分组，src/dst为等长的字节缓冲区"""
+        mode = self.mode
+        for off in range(0, len(src), _CHUNK_BLOCKS * BLOCK_SIZE):
+            chunk = src[off:off + _CHUNK_BLOCKS * BLOCK_SIZE]
+            n = len(chunk) // BLOCK_SIZE
+            if mode == 'ECB':
+                out = self._ecb(chunk, self.decrypting)
+            elif mode == 'CTR':
+                ks = self._ecb(struct.pack(f'>{4 * n}I', *_counter_words(self._counter, n)))
+                self._counter = (self._counter + n) & _MASK128
+                out = _xor_bytes(chunk, ks)
+            elif mode == 'CBC':
+                out = self._cbc(chunk, n)
+            elif mode == 'OFB':
+                out = _xor_bytes(chunk, self._ofb_keystream(n))
+            else:
+                out = self._cfb(chunk, n)
+            dst[off:off + len(out)] = out
+
+    def _cbc(self, chunk, n):
+        if self.decrypting:
+            # 解密各分组互相独立，批量解密后与前一密文分组整体异或
+            iv = struct.pack('>4I', *self._state)
+            self._state = struct.unpack('>4I', chunk[-BLOCK_SIZE:])
+            if hasattr(self.engine, 'decrypt_cbc'):
+                return self.engine.decrypt_cbc(chunk, iv)
+            return _xor_bytes(self._ecb(chunk, True), iv + bytes(chunk[:-BLOCK_SIZE]))
+        words = struct.unpack(f'>{4 * n}I', chunk)
+        block = self._block
+        c0, c1, c2, c3 = self._state
+        out = []
+        for i in range(0, 4 * n, 4):
+            c0, c1, c2, c3 = block(words[i] ^ c0, words[i + 1] ^ c1, words[i + 2] ^ c2, words[i + 3] ^ c3)
+            out += (c0, c1, c2, c3)
+        self._state = (c0, c1, c2, c3)
+        return struct.pack(f'>{4 * n}I', *out)
+
+    def _ofb_keystream(self, n):
+        block = self._block
+        s = self._state
+        ks = []
+        for _ in range(n):
+            s = block(*s)
+            ks += s
+        self._state = s
+        return struct.pack(f'>{4 * n}I', *ks)
+
+    def _cfb(self, chunk, n):
+        if self.decrypting:
+            # 解密时密钥流来自已知的前一密文分组，可以批量计算
+            ks = self._ecb(struct.pack('>4I', *self._state) + bytes(chunk[:-BLOCK_SIZE]))
+            self._state = struct.unpack('>4I', chunk[-BLOCK_SIZE:])
+            return _xor_bytes(chunk, ks)
+        words = struct.unpack(f'>{4 * n}I', chunk)
+        block = self._block
+        s = self._state
+        out = []
+        for i in range(0, 4 * n, 4):
+            k0, k1, k2, k3 = block(*s)
+            s = (words[i] ^ k0, words[i + 1] ^ k1, words[i + 2] ^ k2, words[i + 3] ^ k3)
+            out += s
+        self._state = s
+        return struct.pack(f'>{4 * n}I', *out)
+
+    def _stream_tail(self, tail):
+        """流模式下处理最后不足一组的数据"""
+        if self.mode == 'CTR':
+            c = self._counter
+            block = self._block((c >> 96) & _MASK32, (c >> 64) & _MASK32, (c >> 32) & _MASK32, c & _MASK32)
+            self._counter = (c + 1) & _MASK128
+        else:
+            block = self._block(*self._state)
+        ks = struct.pack('>4I', *block)[:len(tail)]
+        return _xor_bytes(tail, ks)
+
+    # ---------------- 公共接口 ----------------
+
+    def update_into(self, data, out):
+        """处理data并把结果写入out，返回写入的字节数
+
+        out的长度至少为 len(data) + 15（解密且有填充时额外保留一个分组）。
+        """
+        if self.metrics is None:
+            return self._update_into(data, out)
+        return self.metrics.measure('update', self._update_into, data, out)
+
+    def _update_into(self, data, out):
+        if self._finalized:
+            raise ValueError("finalize() 之后不能继续调用 update")
+        src = memoryview(data).cast('B')
+        dst = memoryview(out).cast('B')
+        pending = self._pending
+        total = len(pending) + len(src)
+        if self.decrypting and self.padding:
+            # 解密带填充时始终保留最后一个分组，留到finalize()去填充
+            usable = (total - 1) // BLOCK_SIZE * BLOCK_SIZE
+        else:
+            usable = total // BLOCK_SIZE * BLOCK_SIZE
+        if not usable:
+            pending += src
+            return 0
+        if len(dst) < usable:
+            raise ValueError("输出缓冲区太小")
+
+        written = 0
+        if pending:
+            # 先补齐缓存中的半个分组
+            need = BLOCK_SIZE - len(pending)
+            head = bytes(pending) + bytes(src[:need])
+            self._process(head, dst[:BLOCK_SIZE])
+            written = BLOCK_SIZE
+            src = src[need:]
+            pending.clear()
+        body = usable - written
+        if body:
+            self._process(src[:body], dst[written:usable])
+        pending += src[body:]
+        return usable
+
+    def update(self, data):
+        """处理数据，返回本次可输出的密文/明文"""
+        out = bytearray(len(data) + len(self._pending))
+        n = self.update_into(data, out)
+        return bytes(out[:n])
+
+    def finalize(self):
+        """结束处理，返回剩余输出（含填充/去填充）"""
+        if self._finalized:
+            raise ValueError("finalize() 只能调用一次")
+        self._finalized = True
+        tail = bytes(self._pending)
+        self._pending.clear()
+        if self.mode in ('ECB', 'CBC'):
+            if self.padding and not self.decrypting:
+                tail = pkcs7_pad(tail)
+            if len(tail) % BLOCK_SIZE:
+                raise ValueError("数据长度不是16字节的整数倍")
+            out = bytearray(len(tail))
+            self._process(tail, out)
+            if self.padding and self.decrypting:
+                return pkcs7_unpad(out)
+            return bytes(out)
+        return self._stream_tail(tail) if tail else b''
+
+    def crypt_stream(self, src, dst, buffer_size=1 << 20):
+        """以固定大小缓冲区流式处理文件对象，返回输出字节数
+
+        src需支持readinto()，输入/输出缓冲区在整个过程中复用。
+        """
+        buffer_size -= buffer_size % BLOCK_SIZE
+        inbuf = bytearray(max(buffer_size, BLOCK_SIZE))
+        outbuf = bytearray(len(inbuf) + 2 * BLOCK_SIZE)
+        in_view = memoryview(inbuf)
+        out_view = memoryview(outbuf)
+        total = 0
+        while True:
+            n = src.readinto(in_view)
+            if not n:
+                break
+            m = self.update_into(in_view[:n], out_view)
+            if m:
+                dst.write(out_view[:m])
+                total += m
+        tail = self.finalize()
+        if tail:
+            dst.write(tail)
+            total += len(tail)
+        return total
+
+
+def encrypt(key, data, mode='CBC', iv=None, padding=None, engine=None):
+    """一次性加密任意长度数据"""
+    cipher = SM4Cipher(key, mode, iv, decrypt=False, padding=padding, engine=engine)
+    return cipher.update(data) + cipher.finalize()
+
+
+def decrypt(key, data, mode='CBC', iv=None, padding=None, engine=None):
+    """一次性解密任意长度数据"""
+    cipher = SM4Cipher(key, mode, iv, decrypt=True, padding=padding, engine=engine)
+    return cipher.update(data) + cipher.finalize()
+
+
+def modes_verification():
+    """工作模式正确性与性能验证"""
+    import io
+    import os
+    import time
+
+    print("SM4工作模式验证")
+    print("=" * 40)
+
+    key = bytes.fromhex('0123456789abcdeffedcba9876543210')
+    iv = bytes.fromhex('000102030405060708090a0b0c0d0e0f')
+    ref = SM4(key)
+
+    # ECB模式与单块接口一致
+    ct = encrypt(key, key, 'ECB', padding=False)
+    print(f"ECB标准向量: {ct.hex()} {'✓' if ct.hex() == '681edf34d206965e86b3e94f536e4246' else '✗'}")
+
+    # CBC与逐块实现对比
+    data = os.urandom(16 * 37 + 5)
+    padded = pkcs7_pad(data)
+    expected = b''
+    prev = iv
+    for i in range(0, len(padded), 16):
+        prev = ref.encrypt(_xor_bytes(padded[i:i + 16], prev))
+        expected += prev
+    ct = encrypt(key, data, 'CBC', iv)
+    print(f"CBC与逐块实现一致: {'✓' if ct == expected else '✗'}")
+
+    for mode in SM4Cipher.MODES:
+        m_iv = None if mode == 'ECB' else iv
+        ct = encrypt(key, data, mode, m_iv)
+        # 以不规则的分片大小增量解密
+        dec = SM4Cipher(key, mode, m_iv, decrypt=True)
+        pt = b''
+        for i in range(0, len(ct), 7):
+            pt += dec.update(ct[i:i + 7])
+        pt += dec.finalize()
+        print(f"{mode} 往返验证: {'✓' if pt == data else '✗'}")
+
+    # 流式接口
+    src = io.BytesIO(data)
+    dst = io.BytesIO()
+    SM4Cipher(key, 'CTR', iv).crypt_stream(src, dst, buffer_size=64)
+    print(f"CTR流式接口一致: {'✓' if dst.getvalue() == encrypt(key, data, 'CTR', iv) else '✗'}")
+
+    size = 1024 * 1024
+    payload = os.urandom(size)
+    start = time.perf_counter()
+    encrypt(key, payload, 'CTR', iv)
+    elapsed = time.perf_counter() - start
+    print(f"\nCTR 1MB: {elapsed:.3f}s ({size / (1024 * 1024) / elapsed:.2f} MB/s)")
+
+
+if __name__ == "__main__":
+    modes_verification()
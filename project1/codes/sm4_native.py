@@ -0,0 +1,343 @@
+import ctypes
+import hashlib
+import importlib.util
+import os
+import subprocess
+import sys
+import sysconfig
+import tempfile
+import threading
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+BLOCK_SIZE = 16
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+_SOURCE = os.path.join(_HERE, 'sm4_AVX2.c')
+
+# 可通过环境变量指定已编译好的库或编译器
+_ENV_LIB = 'SM4_NATIVE_LIB'
+_ENV_CC = 'CC'
+
+_script_lock = threading.RLock()
+
+
+def _load_script(filename, name):
+    """加载文件名含'-'、无法直接import的同目录脚本
+
+    每个进程只执行一次，模块登记在sys.modules[name]中，之后直接复用
+    （类级别的查找表、lru_cache等只构建一次）。
+    """
+    with _script_lock:
+        module = sys.modules.get(name)
+        if module is None:
+            spec = importlib.util.spec_from_file_location(name, os.path.join(_HERE, filename))
+            module = importlib.util.module_from_spec(spec)
+            sys.modules[name] = module
+            try:
+                spec.loader.exec_module(module)
+            except BaseException:
+                del sys.modules[name]
+                raise
+    return module
+
+
+def _library_path():
+    """按源码内容哈希命名共享库，源码修改后自动重新编译"""
+    with open(_SOURCE, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:12]
+    suffix = '.dll' if sys.platform == 'win32' else '.so'
+    return os.path.join(_HERE, f'_sm4_native_{digest}{suffix}')
+
+
+def build_library(path=None):
+    """编译sm4_AVX2.c为共享库，返回库路径
+
+    先编译到同目录下的临时文件再os.replace()到目标路径：多个进程同时导入时，
+    不会加载到写了一半的库，也不会互相覆盖编译器的输出。
+    """
+    path = path or _library_path()
+    cc = os.environ.get(_ENV_CC) or sysconfig.get_config_var('CC') or 'cc'
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp', suffix=os.path.splitext(path)[1])
+    os.close(fd)
+    try:
+        cmd = cc.split() + ['-O3', '-shared', '-fPIC', '-DSM4_BUILD_SHARED', _SOURCE, '-o', tmp]
+        subprocess.run(cmd, check=True, capture_output=True)
+        # mkstemp创建的文件只有属主可读写，改为编译器输出的常规权限
+        os.chmod(tmp, 0o755)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return path
+
+
+def _load_library():
+    """加载（必要时先编译）原生库，失败时返回None"""
+    path = os.environ.get(_ENV_LIB)
+    try:
+        if not path:
+            path = _library_path()
+            if not os.path.exists(path):
+                build_library(path)
+        # CDLL 调用外部函数期间会释放GIL，其他线程可并行执行
+        lib = ctypes.CDLL(path)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    u8p = ctypes.POINTER(ctypes.c_uint8)
+    u32p = ctypes.POINTER(ctypes.c_uint32)
+    lib.sm4_cpu_has_avx2.argtypes = []
+    lib.sm4_cpu_has_avx2.restype = ctypes.c_int
+    lib.sm4_cpu_best_impl.argtypes = []
+    lib.sm4_cpu_best_impl.restype = ctypes.c_int
+    lib.sm4_cpu_supports_impl.argtypes = [ctypes.c_int]
+    lib.sm4_cpu_supports_impl.restype = ctypes.c_int
+    lib.sm4_key_expand.argtypes = [u8p, u32p, u32p]
+    lib.sm4_key_expand.restype = None
+    lib.sm4_crypt_blocks.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t, u32p, ctypes.c_int]
+    lib.sm4_crypt_blocks.restype = None
+    lib.sm4_cbc_decrypt.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t, u32p,
+                                    ctypes.c_char_p, ctypes.c_int]
+    lib.sm4_cbc_decrypt.restype = None
+    lib.sm4_crypt_multi_key.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t,
+                                        ctypes.c_int, ctypes.c_int]
+    lib.sm4_crypt_multi_key.restype = None
+    return lib
+
+
+_lib = _load_library()
+HAS_NATIVE = _lib is not None
+HAS_AVX2 = bool(HAS_NATIVE and _lib.sm4_cpu_has_avx2())
+
+# 批量路径名称，下标与sm4_AVX2.c中的SM4_IMPL_*一致
+IMPL_NAMES = ('scalar', 'avx2', 'aesni', 'gfni', 'gfni-avx512')
+# 当前CPU支持的原生批量路径
+NATIVE_IMPLS = [name for i, name in enumerate(IMPL_NAMES) if HAS_NATIVE and _lib.sm4_cpu_supports_impl(i)]
+HAS_AESNI = 'aesni' in NATIVE_IMPLS
+HAS_GFNI = 'gfni' in NATIVE_IMPLS
+DEFAULT_IMPL = IMPL_NAMES[_lib.sm4_cpu_best_impl()] if HAS_NATIVE else None
+
+
+def _readonly_pointer(data):
+    """获取输入缓冲区地址，返回 (地址, 需要保持存活的对象)
+
+    bytes与可写缓冲区直接取地址；只读的memoryview切片、mmap视图等借助NumPy取地址，同样不拷贝。
+    只有没有NumPy（或缓冲区不连续）时才复制一份。
+    """
+    if isinstance(data, bytes):
+        return ctypes.cast(ctypes.c_char_p(data), ctypes.c_void_p), data
+    try:
+        buf = (ctypes.c_char * len(data)).from_buffer(data)
+        return ctypes.addressof(buf), buf
+    except TypeError:
+        pass
+    if np is not None:
+        try:
+            arr = np.frombuffer(data, dtype=np.uint8)
+            return arr.ctypes.data, arr
+        except (TypeError, ValueError):
+            pass
+    data = bytes(data)
+    return ctypes.cast(ctypes.c_char_p(data), ctypes.c_void_p), data
+
+
+class SM4_Native:
+    """基于sm4_AVX2.c的原生SM4后端
+
+    运行时检测CPU特性并选择最快的批量路径（impl可手动指定）：
+    GFNI+AVX-512每16块、GFNI+AVX2每8块、AES-NI每4块计算S盒，AVX2每8块gather查表，
+    不足一组的尾部走C标量路径；
+    原生库不可用（无编译器等）时回退到纯Python的SM4_TTable。
+    encrypt/decrypt接受任意16字节整数倍长度的数据（ECB）。
+    """
+
+    def __init__(self, key, use_avx2=None, impl=None):
+        if len(key) != 16:
+            raise ValueError("SM4 密钥必须是 16 bytes (128 bits) 长")
+        if _lib is None:
+            self.backend = 'python'
+            # _load_script只在第一次执行脚本，之后的实例复用同一个模块（T表、密钥扩展缓存共享）
+            self._fallback = _load_script('sm4-TTable.py', 'sm4_ttable').SM4_TTable(key)
+            return
+        if impl is None:
+            if use_avx2 is None:
+                impl = DEFAULT_IMPL
+            else:
+                impl = 'avx2' if use_avx2 else 'scalar'
+        if impl not in IMPL_NAMES:
+            raise ValueError(f"未知的原生实现: {impl}")
+        if impl not in NATIVE_IMPLS:
+            raise RuntimeError(f"当前CPU不支持{impl}")
+        self.backend = impl
+        self._impl = IMPL_NAMES.index(impl)
+        self._rk_enc = (ctypes.c_uint32 * 32)()
+        self._rk_dec = (ctypes.c_uint32 * 32)()
+        key_buf = (ctypes.c_uint8 * 16).from_buffer_copy(key)
+        _lib.sm4_key_expand(key_buf, self._rk_enc, self._rk_dec)
+
+    def _crypt_into(self, src, dst, rk):
+        n = len(src)
+        if n % BLOCK_SIZE:
+            raise ValueError("数据长度必须是16字节的整数倍")
+        if len(dst) < n:
+            raise ValueError("输出缓冲区太小")
+        if n:
+            src_ptr, _keep = _readonly_pointer(src)
+            dst_ptr = ctypes.addressof((ctypes.c_char * n).from_buffer(dst))
+            _lib.sm4_crypt_blocks(src_ptr, dst_ptr, n // BLOCK_SIZE, rk, self._impl)
+        return n
+
+    def _crypt(self, data, decrypt):
+        if self.backend == 'python':
+            if len(data) % BLOCK_SIZE:
+                raise ValueError("数据长度必须是16字节的整数倍")
+            fn = self._fallback.decrypt if decrypt else self._fallback.encrypt
+            return b''.join(fn(bytes(data[i:i + BLOCK_SIZE])) for i in range(0, len(data), BLOCK_SIZE))
+        out = bytearray(len(data))
+        self._crypt_into(data, out, self._rk_dec if decrypt else self._rk_enc)
+        return bytes(out)
+
+    def encrypt(self, plaintext):
+        """加密"""
+        return self._crypt(plaintext, decrypt=False)
+
+    def decrypt(self, ciphertext):
+        """解密"""
+        return self._crypt(ciphertext, decrypt=True)
+
+    def _crypt_buffer(self, src, dst, decrypt):
+        if not isinstance(src, bytes):
+            src = memoryview(src).cast('B')
+        dst = memoryview(dst).cast('B')
+        if dst.readonly:
+            raise ValueError("输出缓冲区不可写")
+        if self.backend == 'python':
+            fn = self._fallback.decrypt_into if decrypt else self._fallback.encrypt_into
+            return fn(src, dst)
+        return self._crypt_into(src, dst, self._rk_dec if decrypt else self._rk_enc)
+
+    def encrypt_into(self, src, dst):
+        """加密src并直接写入dst（bytearray/memoryview/NumPy数组，可原地），返回写入的字节数"""
+        return self._crypt_buffer(src, dst, decrypt=False)
+
+    def decrypt_into(self, src, dst):
+        """解密src并直接写入dst"""
+        return self._crypt_buffer(src, dst, decrypt=True)
+
+    def decrypt_cbc(self, ciphertext, iv):
+        """CBC模式批量解密（不处理填充），分组解密与链式异或均在C中完成"""
+        if len(iv) != BLOCK_SIZE:
+            raise ValueError("IV 必须是 16 bytes")
+        n = len(ciphertext)
+        if n % BLOCK_SIZE:
+            raise ValueError("数据长度必须是16字节的整数倍")
+        if self.backend == 'python':
+            plain = self._crypt(ciphertext, decrypt=True)
+            prev = bytes(iv) + bytes(ciphertext[:n - BLOCK_SIZE])
+            return (int.from_bytes(plain, 'big') ^ int.from_bytes(prev, 'big')).to_bytes(n, 'big')
+        out = bytearray(n)
+        if n:
+            src_ptr, _keep = _readonly_pointer(ciphertext)
+            dst_ptr = ctypes.addressof((ctypes.c_char * n).from_buffer(out))
+            _lib.sm4_cbc_decrypt(src_ptr, dst_ptr, n // BLOCK_SIZE, self._rk_dec, bytes(iv), self._impl)
+        return bytes(out)
+
+
+def crypt_multi_key(keys, blocks, decrypt=False, use_avx2=None):
+    """多密钥批量加解密：第i个分组使用第i个16字节密钥
+
+    AVX2路径每8个分组为一组，8路密钥扩展与轮函数同步执行；
+    原生库不可用时回退到 sm4_numpy.crypt_multi_key。
+    """
+    if _lib is None:
+        from sm4_numpy import crypt_multi_key as numpy_crypt_multi_key
+        return numpy_crypt_multi_key(keys, blocks, decrypt)
+    if use_avx2 is None:
+        use_avx2 = HAS_AVX2
+    elif use_avx2 and not HAS_AVX2:
+        raise RuntimeError("当前CPU不支持AVX2")
+    n = len(blocks)
+    if n % BLOCK_SIZE:
+        raise ValueError("数据长度必须是16字节的整数倍")
+    if len(keys) != n:
+        raise ValueError("密钥数量必须与分组数量相同")
+    out = bytearray(n)
+    if n:
+        key_ptr, _keep_keys = _readonly_pointer(keys)
+        src_ptr, _keep_src = _readonly_pointer(blocks)
+        dst_ptr = ctypes.addressof((ctypes.c_char * n).from_buffer(out))
+        _lib.sm4_crypt_multi_key(key_ptr, src_ptr, dst_ptr, n // BLOCK_SIZE, int(decrypt), int(use_avx2))
+    return bytes(out)
+
+
+def native_verification():
+    """原生后端正确性与吞吐量测试"""
+    import threading
+    import time
+
+    from sm4_modes import encrypt as encrypt_cbc
+    from sm4_numpy import SM4_NumPy
+
+    print("SM4原生后端验证")
+    print("=" * 40)
+    print(f"原生库可用: {'✓' if HAS_NATIVE else '✗'}")
+    print(f"CPU支持AVX2: {'✓' if HAS_AVX2 else '✗'}")
+    print(f"可用批量路径: {', '.join(NATIVE_IMPLS) or '无'}（默认 {DEFAULT_IMPL}）")
+
+    key = bytes.fromhex('0123456789abcdeffedcba9876543210')
+    data = os.urandom(16 * 1000)
+    reference = SM4_NumPy(key).encrypt_ecb(data)
+
+    backends = [SM4_Native(key, impl=impl) for impl in NATIVE_IMPLS] or [SM4_Native(key)]
+    for sm4 in backends:
+        ct = sm4.encrypt(key)
+        print(f"\n[{sm4.backend}] 标准向量: {ct.hex()} "
+              f"{'✓' if ct.hex() == '681edf34d206965e86b3e94f536e4246' else '✗'}")
+        print(f"[{sm4.backend}] 批量加密一致: {'✓' if sm4.encrypt(data) == reference else '✗'}")
+        print(f"[{sm4.backend}] 解密还原: {'✓' if sm4.decrypt(reference) == data else '✗'}")
+        iv = os.urandom(16)
+        cbc_ct = encrypt_cbc(key, data, 'CBC', iv, padding=False)
+        print(f"[{sm4.backend}] CBC并行解密: {'✓' if sm4.decrypt_cbc(cbc_ct, iv) == data else '✗'}")
+        buf = bytearray(data)
+        sm4.encrypt_into(buf, buf)
+        print(f"[{sm4.backend}] 原地加密(encrypt_into): {'✓' if buf == reference else '✗'}")
+
+        size = 64 * 1024 * 1024 if sm4.backend != 'python' else 64 * 1024
+        payload = os.urandom(size)
+        start = time.perf_counter()
+        sm4.encrypt(payload)
+        elapsed = time.perf_counter() - start
+        print(f"[{sm4.backend}] 吞吐量: {size / (1024 * 1024) / elapsed:.2f} MB/s")
+
+    keys = os.urandom(16 * 1001)
+    blocks = os.urandom(16 * 1001)
+    expected = b''.join(SM4_NumPy(keys[i:i + 16]).encrypt_ecb(blocks[i:i + 16]) for i in range(0, len(keys), 16))
+    multi = crypt_multi_key(keys, blocks)
+    print(f"\n多密钥批量加密一致: {'✓' if multi == expected else '✗'}")
+    print(f"多密钥批量解密还原: {'✓' if crypt_multi_key(keys, multi, decrypt=True) == blocks else '✗'}")
+    size = 16 * 1024 * 1024 if HAS_NATIVE else 64 * 1024
+    start = time.perf_counter()
+    crypt_multi_key(os.urandom(size), os.urandom(size))
+    print(f"每块独立密钥吞吐量: {size / (1024 * 1024) / (time.perf_counter() - start):.2f} MB/s")
+
+    if HAS_NATIVE:
+        # 多线程并行加密（调用期间GIL已释放）
+        sm4 = SM4_Native(key)
+        payload = os.urandom(32 * 1024 * 1024)
+        threads = [threading.Thread(target=sm4.encrypt, args=(payload,)) for _ in range(4)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+        print(f"\n4线程并行吞吐量: {4 * len(payload) / (1024 * 1024) / elapsed:.2f} MB/s")
+
+
+if __name__ == "__main__":
+    native_verification()
@@ -0,0 +1,289 @@
+import numpy as np
+
+from sm4 import SM4
+
+BLOCK_SIZE = 16
+
+# 每批处理的分组数（512KB），中间数组可留在缓存中
+_CHUNK_BLOCKS = 32768
+
+
+def _build_t_tables(rotations=(2, 10, 18, 24)):
+    """预计算4张T表（uint32数组），T(x) = T0[x>>24] ^ T1[..] ^ T2[..] ^ T3[x&0xff]
+
+    rotations为线性变换中的循环左移位数：加密用L，密钥扩展用L'(13, 23)。
+    """
+    s = np.array(SM4.S_BOX, dtype=np.uint32)
+    tables = []
+    for j in range(4):
+        b = s << np.uint32(24 - 8 * j)
+        l_val = b.copy()
+        for n in rotations:
+            l_val ^= (b << np.uint32(n)) | (b >> np.uint32(32 - n))
+        tables.append(l_val)
+    return tuple(tables)
+
+
+T_TABLES = _build_t_tables()
+# 密钥扩展使用的T'表（S盒 + L'）
+T_PRIME_TABLES = _build_t_tables((13, 23))
+
+_FK = np.array(SM4.FK, dtype=np.uint32)
+
+
+def _byte_lanes(t):
+    """返回uint32数组t按大端顺序的4个字节视图（查表下标，省去移位和掩码）"""
+    tb = t.view(np.uint8).reshape(-1, 4)
+    if np.little_endian:
+        return tb[:, 3], tb[:, 2], tb[:, 1], tb[:, 0]
+    return tb[:, 0], tb[:, 1], tb[:, 2], tb[:, 3]
+
+
+def _rounds(x0, x1, x2, x3, rk):
+    """在所有通道上同时执行32轮迭代，返回反序变换后的4个字数组
+
+    rk的每一项可以是整数（所有通道共用一个密钥），也可以是与通道等长的
+    uint32数组（每个通道使用各自的轮密钥）。
+    """
+    T0, T1, T2, T3 = T_TABLES
+    t = np.empty_like(x0)
+    b0, b1, b2, b3 = _byte_lanes(t)
+    for r in rk:
+        np.bitwise_xor(x1, x2, out=t)
+        t ^= x3
+        t ^= r
+        x0 ^= T0.take(b0)
+        x0 ^= T1.take(b1)
+        x0 ^= T2.take(b2)
+        x0 ^= T3.take(b3)
+        # 通过重命名轮换状态，避免数组拷贝
+        x0, x1, x2, x3 = x1, x2, x3, x0
+    return x3, x2, x1, x0
+
+
+def _crypt_words(words, rk, out=None):
+    """words为(N, 4)的uint32数组，返回(N, 4)的大端uint32结果
+
+    指定out时结果直接写入out（可以与words共享内存：每批先读出再写回）。
+    """
+    if out is None:
+        out = np.empty(words.shape, dtype='>u4')
+    for i in range(0, len(words), _CHUNK_BLOCKS):
+        w = words[i:i + _CHUNK_BLOCKS]
+        x = [np.ascontiguousarray(w[:, j], dtype=np.uint32) for j in range(4)]
+        y = _rounds(*x, rk)
+        o = out[i:i + _CHUNK_BLOCKS]
+        for j in range(4):
+            o[:, j] = y[j]
+    return out
+
+
+def _load_blocks(data):
+    """把字节缓冲区解析为(N, 4)的大端字数组（不拷贝）"""
+    if len(data) % BLOCK_SIZE:
+        raise ValueError("数据长度必须是16字节的整数倍")
+    return np.frombuffer(data, dtype='>u4').reshape(-1, 4)
+
+
+def crypt_blocks(data, round_keys):
+    """使用给定轮密钥批量处理整数个分组（解密时传入逆序轮密钥）"""
+    if not len(data):
+        return b''
+    return _crypt_words(_load_blocks(data), round_keys).tobytes()
+
+
+def crypt_blocks_into(src, dst, round_keys):
+    """批量处理src中的全部分组，结果直接写入可写缓冲区dst，返回写入的字节数"""
+    src, dst = memoryview(src).cast('B'), memoryview(dst).cast('B')
+    n = len(src)
+    if len(dst) < n:
+        raise ValueError("输出缓冲区太小")
+    if n:
+        out = np.frombuffer(dst, dtype='>u4', count=n // 4).reshape(-1, 4)
+        _crypt_words(_load_blocks(src), round_keys, out)
+    return n
+
+
+def expand_keys(keys):
+    """批量密钥扩展：keys为N个16字节密钥（拼接的字节串或(N, 16)数组）
+
+    N个密钥作为向量通道同步执行32步扩展，返回(32, N)的uint32轮密钥数组，
+    第i行为所有密钥的第i个轮密钥（解密时使用逆序的行即可）。
+    """
+    mk = _load_blocks(memoryview(keys).cast('B'))
+    k0, k1, k2, k3 = (mk[:, j] ^ _FK[j] for j in range(4))
+    TP0, TP1, TP2, TP3 = T_PRIME_TABLES
+    rk = np.empty((32, len(mk)), dtype=np.uint32)
+    t = np.empty(len(mk), dtype=np.uint32)
+    b0, b1, b2, b3 = _byte_lanes(t)
+    for i, ck in enumerate(SM4.CK):
+        np.bitwise_xor(k1, k2, out=t)
+        t ^= k3
+        t ^= ck
+        k0 ^= TP0.take(b0)
+        k0 ^= TP1.take(b1)
+        k0 ^= TP2.take(b2)
+        k0 ^= TP3.take(b3)
+        rk[i] = k0
+        k0, k1, k2, k3 = k1, k2, k3, k0
+    return rk
+
+
+def crypt_multi_key(keys, blocks, decrypt=False):
+    """密钥灵活的批量加解密：第i个分组使用第i个密钥
+
+    keys与blocks均为N*16字节（或同样大小的数组），密钥扩展与32轮迭代
+    都以N个通道同步执行，适合“每条记录一个密钥”的场景。
+    """
+    keys = memoryview(keys).cast('B')
+    blocks = memoryview(blocks).cast('B')
+    if len(keys) != len(blocks):
+        raise ValueError("密钥数量必须与分组数量相同")
+    if not len(blocks):
+        return b''
+    words = _load_blocks(blocks)
+    out = np.empty(words.shape, dtype='>u4')
+    for i in range(0, len(words), _CHUNK_BLOCKS):
+        rk = expand_keys(keys[i * BLOCK_SIZE:(i + _CHUNK_BLOCKS) * BLOCK_SIZE])
+        if decrypt:
+            rk = rk[::-1]
+        w = words[i:i + _CHUNK_BLOCKS]
+        y = _rounds(*(np.ascontiguousarray(w[:, j], dtype=np.uint32) for j in range(4)), rk)
+        o = out[i:i + _CHUNK_BLOCKS]
+        for j in range(4):
+            o[:, j] = y[j]
+    return out.tobytes()
+
+
+def counter_blocks(counter, blocks):
+    """生成从counter开始的连续128位大端计数器，返回(N, 4)字数组"""
+    hi = np.uint64(counter >> 64)
+    lo = np.uint64(counter & 0xFFFFFFFFFFFFFFFF)
+    low = lo + np.arange(blocks, dtype=np.uint64)
+    # 低64位回绕时向高64位进位
+    high = hi + (low < lo).astype(np.uint64)
+    words = np.empty((blocks, 4), dtype=np.uint32)
+    words[:, 0] = high >> np.uint64(32)
+    words[:, 1] = high & np.uint64(0xFFFFFFFF)
+    words[:, 2] = low >> np.uint64(32)
+    words[:, 3] = low & np.uint64(0xFFFFFFFF)
+    return words
+
+
+class SM4_NumPy:
+    """NumPy向量化的SM4批量引擎
+
+    N个分组按字拆成4个uint32数组，32轮迭代在所有通道上同时进行，
+    S盒与线性变换L通过T表的数组下标批量查表完成。
+    """
+
+    def __init__(self, key):
+        sm4 = SM4(key)
+        self.rk = sm4.rk
+        self.rk_dec = sm4.rk_dec
+
+    def encrypt_ecb(self, data):
+        """ECB模式批量加密（长度需为16字节整数倍）"""
+        return crypt_blocks(data, self.rk)
+
+    def decrypt_ecb(self, data):
+        """ECB模式批量解密"""
+        return crypt_blocks(data, self.rk_dec)
+
+    def encrypt_into(self, src, dst):
+        """ECB加密src并写入dst（bytearray/memoryview/NumPy数组，可原地），返回写入的字节数"""
+        return crypt_blocks_into(src, dst, self.rk)
+
+    def decrypt_into(self, src, dst):
+        """ECB解密src并写入dst"""
+        return crypt_blocks_into(src, dst, self.rk_dec)
+
+    def decrypt_cbc(self, data, iv):
+        """CBC模式批量解密（不处理填充）：所有分组同时解密，再与前一密文分组整体异或"""
+        if len(iv) != BLOCK_SIZE:
+            raise ValueError("IV 必须是 16 bytes")
+        if not len(data):
+            return b''
+        plain = np.frombuffer(self.decrypt_ecb(data), dtype=np.uint64)
+        ct = np.frombuffer(data, dtype=np.uint64)
+        prev = np.concatenate((np.frombuffer(bytes(iv), dtype=np.uint64), ct[:-2]))
+        return (plain ^ prev).tobytes()
+
+    def ctr_keystream(self, iv, blocks):
+        """生成CTR模式的密钥流，iv为16字节初始计数器"""
+        counter = int.from_bytes(iv, 'big')
+        out = bytearray(blocks * BLOCK_SIZE)
+        view = np.frombuffer(out, dtype='>u4').reshape(-1, 4)
+        for i in range(0, blocks, _CHUNK_BLOCKS):
+            n = min(_CHUNK_BLOCKS, blocks - i)
+            view[i:i + n] = _crypt_words(counter_blocks((counter + i) % (1 << 128), n), self.rk)
+        return bytes(out)
+
+    def crypt_ctr(self, data, iv):
+        """CTR模式加解密（任意长度）"""
+        blocks = -(-len(data) // BLOCK_SIZE)
+        ks = np.frombuffer(self.ctr_keystream(iv, blocks), dtype=np.uint8)[:len(data)]
+        return (np.frombuffer(data, dtype=np.uint8) ^ ks).tobytes()
+
+
+def numpy_engine_verification():
+    """批量引擎正确性与吞吐量测试"""
+    import os
+    import time
+
+    from sm4_modes import encrypt as modes_encrypt
+
+    print("SM4 NumPy批量引擎验证")
+    print("=" * 40)
+
+    key = bytes.fromhex('0123456789abcdeffedcba9876543210')
+    engine = SM4_NumPy(key)
+    ct = engine.encrypt_ecb(key * 3)
+    print(f"标准向量: {ct[:16].hex()} {'✓' if ct[:16].hex() == '681edf34d206965e86b3e94f536e4246' else '✗'}")
+    print(f"解密还原: {'✓' if engine.decrypt_ecb(ct) == key * 3 else '✗'}")
+
+    iv = os.urandom(16)
+    data = os.urandom(16 * 1000 + 7)
+    print(f"ECB与sm4_modes一致: "
+          f"{'✓' if engine.encrypt_ecb(data[:16000]) == modes_encrypt(key, data[:16000], 'ECB', padding=False) else '✗'}")
+    print(f"CTR与sm4_modes一致: {'✓' if engine.crypt_ctr(data, iv) == modes_encrypt(key, data, 'CTR', iv) else '✗'}")
+    cbc_ct = modes_encrypt(key, data[:16000], 'CBC', iv, padding=False)
+    print(f"CBC并行解密一致: {'✓' if engine.decrypt_cbc(cbc_ct, iv) == data[:16000] else '✗'}")
+    wrap_iv = b'\xff' * 16
+    print(f"CTR计数器回绕一致: "
+          f"{'✓' if engine.crypt_ctr(data, wrap_iv) == modes_encrypt(key, data, 'CTR', wrap_iv) else '✗'}")
+
+    keys = os.urandom(16 * 1000)
+    blocks = os.urandom(16 * 1000)
+    multi = crypt_multi_key(keys, blocks)
+    expected = b''.join(SM4(keys[i:i + 16]).encrypt(blocks[i:i + 16]) for i in range(0, len(keys), 16))
+    print(f"多密钥批量加密一致: {'✓' if multi == expected else '✗'}")
+    print(f"多密钥批量解密还原: {'✓' if crypt_multi_key(keys, multi, decrypt=True) == blocks else '✗'}")
+
+    sm4_scalar = SM4(key)
+    block = os.urandom(16)
+    iterations = 2000
+    start = time.perf_counter()
+    for _ in range(iterations):
+        sm4_scalar.encrypt(block)
+    scalar_speed = iterations * 16 / (1024 * 1024) / (time.perf_counter() - start)
+
+    for size, label in ((1024 * 1024, "1MB"), (16 * 1024 * 1024, "16MB")):
+        payload = os.urandom(size)
+        start = time.perf_counter()
+        engine.encrypt_ecb(payload)
+        ecb_time = time.perf_counter() - start
+        start = time.perf_counter()
+        engine.crypt_ctr(payload, iv)
+        ctr_time = time.perf_counter() - start
+        start = time.perf_counter()
+        crypt_multi_key(os.urandom(size), payload)
+        multi_time = time.perf_counter() - start
+        print(f"\n{label}: ECB {size / (1024 * 1024) / ecb_time:.2f} MB/s, "
+              f"CTR {size / (1024 * 1024) / ctr_time:.2f} MB/s, "
+              f"每块独立密钥 {size / (1024 * 1024) / multi_time:.2f} MB/s")
+    print(f"标量SM4单块加密: {scalar_speed:.2f} MB/s")
+
+
+if __name__ == "__main__":
+    numpy_engine_verification()
@@ -1,5 +1,7 @@
 import struct
 
+import sm3
+
 class SM3_Basic:
     """基础SM3哈希算法实现"""
 
@@ -52,13 +54,8 @@ class SM3_Basic:
         return [(vi ^ xi) & 0xFFFFFFFF for vi, xi in zip(v, [a, b, c, d, e, f, g, h])]
 
     def _padding(self, message):
-        msg_len = len(message)
-        msg_bits = msg_len * 8
-        padded = message + b'\x80'
-        while (len(padded) % 64) != 56:
-            padded += b'\x00'
-        padded += struct.pack('>Q', msg_bits)
-        return padded
+        # 补零个数直接算出，一次拼接完成
+        return message + sm3.padding(len(message))
 
     def hash(self, message):
         padded_message = self._padding(message)
@@ -80,33 +77,18 @@ class SM3_LengthExtensionAttack:
         self.sm3 = SM3_Basic()
 
     def _generate_padding(self, original_length: int) -> bytes:
-        msg_bits = original_length * 8
-        padding = b'\x80'
-        while ((original_length + len(padding)) % 64) != 56:
-            padding += b'\x00'
-        padding += struct.pack('>Q', msg_bits)
-        return padding
+        return sm3.padding(original_length)
 
     def forge_hash(self, original_hash: bytes, original_length: int, additional_data: bytes):
         # 1. 计算原始消息的填充
         padding = self._generate_padding(original_length)
-        # 2. 恢复内部状态
-        state = list(struct.unpack('>8I', original_hash))
-        # 3. 计算扩展消息的总长度
-        extended_msg_length = original_length + len(padding) + len(additional_data)
-        # 4. 为扩展消息生成填充
-        extended_padding = self._generate_padding(extended_msg_length)
-        # 5. 构造要处理的数据
-        to_process = additional_data + extended_padding
-        # 6. 从原始状态开始处理新数据
-        v = state
-        for i in range(0, len(to_process), 64):
-            block = to_process[i:i + 64]
-            v = self.sm3._compress(block, v)
-        # 7. 返回完整后缀和计算出的哈希
+        # 2. 恢复内部状态：原始哈希就是“消息 + 填充”（整数个分组）压缩后的链接值
+        h = sm3.from_state(original_hash, original_length + len(padding))
+        # 3. 从原始状态开始处理新数据，扩展消息的填充由digest()按总长度生成
+        h.update(additional_data)
+        # 4. 返回完整后缀和计算出的哈希
         complete_suffix = padding + additional_data
-        result_hash = b''.join(struct.pack('>I', val) for val in v)
-        return complete_suffix, result_hash
+        return complete_suffix, h.digest()
 
 def demonstrate_length_extension_attack():
     print("=" * 60)
@@ -3,6 +3,9 @@ import time
 import os
 from typing import List
 
+import sm3
+from sm3_native import SM3_Native
+
 class SM3_Basic:
     """基础SM3哈希算法实现"""
 
@@ -73,14 +76,11 @@ class SM3_Basic:
             v_new.append((vi ^ xi) & 0xFFFFFFFF)
         return v_new
 
-    def _padding(self, message: bytes) -> bytes:
+    @staticmethod
+    def _padding(message: bytes) -> bytes:
+        # 填充由 sm3.padding() 按长度直接生成，一次拼接完成（不再逐字节追加、反复复制整条消息）
         msg_len = len(message)
-        msg_bits = msg_len * 8
-        padded = message + b'\x80'
-        while (len(padded) % 64) != 56:
-            padded += b'\x00'
-        padded += struct.pack('>Q', msg_bits)
-        return padded
+        return message + sm3.padding(msg_len)
 
     def hash(self, message: bytes) -> bytes:
         padded_message = self._padding(message)
@@ -164,12 +164,15 @@ class SM3_Optimized:
         return [(vi ^ xi) & 0xFFFFFFFF for vi, xi in zip(v, [a, b, c, d, e, f, g, h])]
 
     def hash(self, message: bytes) -> bytes:
-        basic_sm3 = SM3_Basic()
-        padded_message = basic_sm3._padding(message)
+        # 完整分组直接从原消息压缩，只对最后不满一组的尾部补填充
         v = self.IV.copy()
-        for i in range(0, len(padded_message), 64):
-            v = self._compress_optimized(padded_message[i:i + 64], v)
-        return b''.join(struct.pack('>I', val) for val in v)
+        full = len(message) // 64 * 64
+        for i in range(0, full, 64):
+            v = self._compress_optimized(message[i:i + 64], v)
+        tail = message[full:] + sm3.padding(len(message))
+        for i in range(0, len(tail), 64):
+            v = self._compress_optimized(tail[i:i + 64], v)
+        return struct.pack('>8I', *v)
 
     def hash_hex(self, message: bytes) -> str:
         return self.hash(message).hex()
@@ -183,6 +186,7 @@ def test_sm3_basic_functionality():
 
     sm3_basic = SM3_Basic()
     sm3_optimized = SM3_Optimized()
+    sm3_native = SM3_Native()
 
     test_vectors = [
         {
@@ -213,15 +217,27 @@ def test_sm3_basic_functionality():
         result_optimized = sm3_optimized.hash_hex(vector['message'])
         print(f"优化: {result_optimized}")
 
+        # 代码生成的完全展开压缩函数（sm3_unrolled.py）
+        result_unrolled = sm3.new(vector['message'], engine='unrolled').hexdigest()
+        print(f"展开: {result_unrolled}")
+
+        # C原生实现（sm3_native.c，通过ctypes调用）
+        result_native = sm3_native.hash_hex(vector['message'])
+        print(f"原生: {result_native}")
+
         basic_correct = result_basic == vector['expected']
         optimized_correct = result_optimized == vector['expected']
-        consistent = result_basic == result_optimized
+        unrolled_correct = result_unrolled == vector['expected']
+        native_correct = result_native == vector['expected']
+        consistent = result_basic == result_optimized == result_unrolled == result_native
 
         print(f"基础实现正确: {'✓' if basic_correct else '✗'}")
         print(f"优化实现正确: {'✓' if optimized_correct else '✗'}")
-        print(f"两版本一致: {'✓' if consistent else '✗'}")
+        print(f"展开实现正确: {'✓' if unrolled_correct else '✗'}")
+        print(f"原生实现正确: {'✓' if native_correct else '✗'}")
+        print(f"各版本一致: {'✓' if consistent else '✗'}")
 
-        if not (basic_correct and optimized_correct and consistent):
+        if not (basic_correct and optimized_correct and unrolled_correct and native_correct and consistent):
             all_passed = False
 
     print(f"\n总体测试结果: {'全部通过' if all_passed else '存在错误'}")
@@ -236,6 +252,7 @@ def test_sm3_performance():
 
     sm3_basic = SM3_Basic()
     sm3_optimized = SM3_Optimized()
+    sm3_native = SM3_Native()
 
     test_sizes = [
         (1024, "1KB"),
@@ -259,6 +276,11 @@ def test_sm3_performance():
             hash_optimized = sm3_optimized.hash(test_data)
         optimized_time = time.time() - start_time
 
+        start_time = time.time()
+        for _ in range(10):
+            hash_native = sm3_native.hash(test_data)
+        native_time = time.time() - start_time
+
         basic_throughput = (size * 10) / (1024 * 1024 * basic_time)
         optimized_throughput = (size * 10) / (1024 * 1024 * optimized_time)
         speedup = basic_time / optimized_time
@@ -266,8 +288,10 @@ def test_sm3_performance():
         print(f"基础实现: {basic_time:.4f}s ({basic_throughput:.2f} MB/s)")
         print(f"优化实现: {optimized_time:.4f}s ({optimized_throughput:.2f} MB/s)")
         print(f"性能提升: {speedup:.2f}x")
+        print(f"原生实现({sm3_native.backend}): {native_time:.4f}s "
+              f"({(size * 10) / (1024 * 1024 * max(native_time, 1e-9)):.2f} MB/s)")
 
-        if hash_basic == hash_optimized:
+        if hash_basic == hash_optimized == hash_native:
             print("✓ 结果一致")
         else:
             print("✗ 结果不一致")
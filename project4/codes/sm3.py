@@ -0,0 +1,287 @@
+import mmap
+import os
+import struct
+
+BLOCK_SIZE = 64
+DIGEST_SIZE = 32
+# 文件哈希默认每次读取/映射的字节数
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+IV = (
+    0x7380166F, 0x4914B2B9, 0x172442D7, 0xDA8A0600,
+    0xA96F30BC, 0x163138AA, 0xE38DEE4D, 0xB0FB0E4E
+)
+
+_MASK32 = 0xFFFFFFFF
+
+
+def _rotl(x, n):
+    return ((x << n) | (x >> (32 - n))) & _MASK32
+
+
+# 每轮使用的 T_j <<< (j mod 32)，预先计算
+_T_ROT = tuple(_rotl(0x79CC4519 if j <= 15 else 0x7A879D8A, j % 32) for j in range(64))
+
+
+def padding(length):
+    """返回长度为length字节的消息的填充（0x80 + 0...0 + 64位长度），与消息内容无关，O(1)生成"""
+    return b'\x80' + bytes((55 - length) % BLOCK_SIZE) + struct.pack('>Q', (length * 8) & 0xFFFFFFFFFFFFFFFF)
+
+
+def compress_blocks(v, data, offset=0, end=None):
+    """对data[offset:end]中的整数个64字节分组依次执行压缩函数，返回新的8字状态
+
+    data可以是bytes/bytearray/memoryview，直接按偏移解包，不切片拷贝。
+    消息扩展、布尔函数和置换函数全部内联。
+    """
+    if end is None:
+        end = len(data)
+    M = _MASK32
+    T = _T_ROT
+    unpack_from = struct.unpack_from
+    V0, V1, V2, V3, V4, V5, V6, V7 = v
+    for off in range(offset, end, BLOCK_SIZE):
+        w = list(unpack_from('>16I', data, off))
+        for j in range(16, 68):
+            x = w[j - 16] ^ w[j - 9]
+            y = w[j - 3]
+            x ^= ((y << 15) | (y >> 17)) & M
+            x ^= (((x << 15) | (x >> 17)) ^ ((x << 23) | (x >> 9))) & M
+            y = w[j - 13]
+            w.append(x ^ (((y << 7) | (y >> 25)) & M) ^ w[j - 6])
+
+        a, b, c, d, e, f, g, h = V0, V1, V2, V3, V4, V5, V6, V7
+        for j in range(16):
+            a12 = ((a << 12) | (a >> 20)) & M
+            ss1 = (a12 + e + T[j]) & M
+            ss1 = ((ss1 << 7) | (ss1 >> 25)) & M
+            tt1 = ((a ^ b ^ c) + d + (ss1 ^ a12) + (w[j] ^ w[j + 4])) & M
+            tt2 = ((e ^ f ^ g) + h + ss1 + w[j]) & M
+            d, c, b, a = c, ((b << 9) | (b >> 23)) & M, a, tt1
+            h, g, f = g, ((f << 19) | (f >> 13)) & M, e
+            e = tt2 ^ (((tt2 << 9) | (tt2 >> 23)) ^ ((tt2 << 17) | (tt2 >> 15))) & M
+        for j in range(16, 64):
+            a12 = ((a << 12) | (a >> 20)) & M
+            ss1 = (a12 + e + T[j]) & M
+            ss1 = ((ss1 << 7) | (ss1 >> 25)) & M
+            tt1 = (((a & b) | (a & c) | (b & c)) + d + (ss1 ^ a12) + (w[j] ^ w[j + 4])) & M
+            tt2 = (((e & f) | (~e & g)) + h + ss1 + w[j]) & M
+            d, c, b, a = c, ((b << 9) | (b >> 23)) & M, a, tt1
+            h, g, f = g, ((f << 19) | (f >> 13)) & M, e
+            e = tt2 ^ (((tt2 << 9) | (tt2 >> 23)) ^ ((tt2 << 17) | (tt2 >> 15))) & M
+
+        V0 ^= a
+        V1 ^= b
+        V2 ^= c
+        V3 ^= d
+        V4 ^= e
+        V5 ^= f
+        V6 ^= g
+        V7 ^= h
+    return V0, V1, V2, V3, V4, V5, V6, V7
+
+
+def _load_unrolled():
+    from sm3_unrolled import compress_blocks as unrolled
+    return unrolled
+
+
+def _load_native():
+    from sm3_native import compress_blocks as native
+    return native
+
+
+# 可选的压缩函数实现：名称 -> 返回 compress_blocks(v, data, offset, end) 的加载函数
+# 'native' 为C实现（sm3_native.c），原生库不可用时自动回退到展开版
+ENGINES = {
+    'inline': lambda: compress_blocks,
+    'unrolled': _load_unrolled,
+    'native': _load_native,
+}
+DEFAULT_ENGINE = 'native'
+
+
+def get_engine(name=None):
+    """返回指定名称（默认DEFAULT_ENGINE）的压缩函数"""
+    name = name or DEFAULT_ENGINE
+    if name not in ENGINES:
+        raise ValueError(f"未知的SM3压缩实现: {name}")
+    return ENGINES[name]()
+
+
+class SM3:
+    """增量式SM3哈希对象，接口与hashlib一致
+
+    update()只缓存不满一个分组的尾部数据，完整分组直接从输入缓冲区压缩；
+    digest()在状态副本上补填充，之后仍可继续update()。
+    engine选择压缩函数实现（见ENGINES）。
+    """
+
+    name = 'sm3'
+    digest_size = DIGEST_SIZE
+    block_size = BLOCK_SIZE
+
+    def __init__(self, data=b'', engine=None):
+        self.engine = engine or DEFAULT_ENGINE
+        self._compress = get_engine(self.engine)
+        self._v = IV
+        self._buf = bytearray()
+        self._length = 0
+        if data:
+            self.update(data)
+
+    def update(self, data):
+        data = memoryview(data).cast('B')
+        n = len(data)
+        self._length += n
+        buf = self._buf
+        start = 0
+        if buf:
+            # 先补齐上次留下的半个分组
+            start = min(BLOCK_SIZE - len(buf), n)
+            buf += data[:start]
+            if len(buf) < BLOCK_SIZE:
+                return
+            self._v = self._compress(self._v, buf)
+            buf.clear()
+        end = start + (n - start) // BLOCK_SIZE * BLOCK_SIZE
+        if end > start:
+            self._v = self._compress(self._v, data, start, end)
+        buf += data[end:]
+
+    def copy(self):
+        other = SM3.__new__(SM3)
+        other.engine = self.engine
+        other._compress = self._compress
+        other._v = self._v
+        other._buf = bytearray(self._buf)
+        other._length = self._length
+        return other
+
+    def digest(self):
+        tail = bytes(self._buf) + padding(self._length)
+        return struct.pack('>8I', *self._compress(self._v, tail))
+
+    def hexdigest(self):
+        return self.digest().hex()
+
+    def export_state(self):
+        """导出分组边界处的压缩状态 (state, length)
+
+        state为32字节大端链接值，length为已压缩的字节数（64的倍数），可用from_state()恢复。
+        已输入的数据不是整数个分组时无法导出。
+        """
+        if self._buf:
+            raise ValueError("只能在分组边界导出状态（已输入的长度必须是64的倍数）")
+        return struct.pack('>8I', *self._v), self._length
+
+
+def new(data=b'', engine=None):
+    """创建SM3哈希对象（与hashlib.new('sm3', data)用法相同）"""
+    return SM3(data, engine)
+
+
+def from_state(state, length, data=b'', engine=None):
+    """从export_state()导出的状态继续哈希，返回SM3对象
+
+    state为32字节链接值，length为产生该状态时已压缩的字节数（64的倍数，用于最终填充）。
+    某条消息的SM3摘要就是“消息 + 填充”之后的状态，长度扩展攻击也用它恢复状态。
+    """
+    if len(state) != DIGEST_SIZE:
+        raise ValueError("状态必须是 32 bytes")
+    if length < 0 or length % BLOCK_SIZE:
+        raise ValueError("已压缩的长度必须是64的非负整数倍")
+    h = SM3(engine=engine)
+    h._v = struct.unpack('>8I', state)
+    h._length = length
+    if data:
+        h.update(data)
+    return h
+
+
+def hash_file(path, chunk_size=DEFAULT_CHUNK_SIZE, use_mmap=False, engine=None):
+    """计算文件的SM3摘要，内存占用与文件大小无关
+
+    默认用固定大小的缓冲区readinto()循环读取；use_mmap=True时映射整个文件，
+    按chunk_size切片交给update()（由操作系统按需换入页面，不复制到Python对象）。
+    """
+    if chunk_size <= 0:
+        raise ValueError("chunk_size 必须为正数")
+    h = SM3(engine=engine)
+    with open(path, 'rb', buffering=0) as f:
+        size = os.fstat(f.fileno()).st_size
+        if use_mmap and size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                view = memoryview(mm)
+                try:
+                    for off in range(0, len(view), chunk_size):
+                        h.update(view[off:off + chunk_size])
+                finally:
+                    view.release()
+        else:
+            buf = bytearray(chunk_size)
+            view = memoryview(buf)
+            while True:
+                n = f.readinto(view)
+                if not n:
+                    break
+                h.update(view[:n])
+    return h.digest()
+
+
+def sm3_verification():
+    """标准向量、增量接口与文件哈希验证"""
+    import tempfile
+    import time
+
+    print("SM3增量哈希对象验证")
+    print("=" * 40)
+    vectors = [
+        (b'abc', '66c7f0f462eeedd9d1f2d46bdc10e4e24167c4875cf2f7a2297da02b8f4ba8e0'),
+        (b'abcd' * 16, 'debe9ff92275b8a138604889c18e5a4d6fdb70e5387e5765293dcba39c0c5732'),
+        (b'', '1ab21d8355cfa17f8e61194831e81a8f22bec8c728fefb747ed035eb5082aa2b'),
+    ]
+    for msg, expected in vectors:
+        ok = all(new(msg, engine).hexdigest() == expected for engine in ENGINES)
+        print(f"标准向量 {msg[:8]!r}（全部实现）: {'✓' if ok else '✗'}")
+
+    data = os.urandom(10000)
+    reference = new(data).digest()
+    ok = True
+    for step in (1, 7, 63, 64, 65, 1000):
+        h = new()
+        for i in range(0, len(data), step):
+            h.update(data[i:i + step])
+        ok = ok and h.digest() == reference
+    print(f"任意分段update一致: {'✓' if ok else '✗'}")
+    h = new(data[:5000])
+    c = h.copy()
+    c.update(data[5000:])
+    h.digest()
+    h.update(data[5000:])
+    print(f"copy()与digest()后继续update: {'✓' if c.digest() == reference == h.digest() else '✗'}")
+    state, length = new(data[:4096]).export_state()
+    ok = from_state(state, length, data[4096:]).digest() == reference
+    # 摘要即“消息 + 填充”之后的状态
+    ok = ok and from_state(new(b'abc').digest(), BLOCK_SIZE).digest() == new(b'abc' + padding(3)).digest()
+    print(f"导出/恢复分组边界状态: {'✓' if ok else '✗'}")
+
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, 'data.bin')
+        with open(path, 'wb') as f:
+            f.write(data)
+        ok = hash_file(path, chunk_size=4096) == reference == hash_file(path, chunk_size=4096, use_mmap=True)
+        print(f"文件分块/mmap哈希一致: {'✓' if ok else '✗'}")
+
+        size = 1024 * 1024
+        with open(path, 'wb') as f:
+            f.write(os.urandom(size))
+        for use_mmap in (False, True):
+            start = time.perf_counter()
+            hash_file(path, use_mmap=use_mmap)
+            elapsed = time.perf_counter() - start
+            print(f"1MB文件{'(mmap)' if use_mmap else '(分块读取)'}: {size / (1024 * 1024) / elapsed:.2f} MB/s")
+
+
+if __name__ == "__main__":
+    sm3_verification()
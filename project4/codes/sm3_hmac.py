@@ -0,0 +1,214 @@
+import functools
+import hmac
+import struct
+
+import sm3
+from sm3 import BLOCK_SIZE, DIGEST_SIZE, IV, padding
+
+try:
+    from sm3_batch import LANE_CHUNK, digest_lanes, use_lanes
+except ImportError:
+    digest_lanes = None
+
+# 中间状态缓存容量（按密钥缓存ipad/opad分组压缩后的链接值）
+MIDSTATE_CACHE_SIZE = 4096
+
+_IPAD = bytes(0x36 for _ in range(BLOCK_SIZE))
+_OPAD = bytes(0x5C for _ in range(BLOCK_SIZE))
+# 外层哈希的输入固定为 opad分组 + 32字节内层摘要，填充是常量
+_OUTER_PAD = padding(BLOCK_SIZE + DIGEST_SIZE)
+
+
+def _xor(a, b):
+    return (int.from_bytes(a, 'big') ^ int.from_bytes(b, 'big')).to_bytes(BLOCK_SIZE, 'big')
+
+
+@functools.lru_cache(maxsize=MIDSTATE_CACHE_SIZE)
+def _midstates(key):
+    """LRU缓存的 (内层中间状态, 外层中间状态)
+
+    即 SM3 压缩 K⊕ipad、K⊕opad 一个分组后的8字链接值（与长度扩展攻击中恢复的状态相同），
+    之后每次计算MAC都从这里继续，省去两次压缩。
+    """
+    if len(key) > BLOCK_SIZE:
+        key = sm3.new(key).digest()
+    key = key.ljust(BLOCK_SIZE, b'\x00')
+    compress = sm3.get_engine()
+    return compress(IV, _xor(key, _IPAD)), compress(IV, _xor(key, _OPAD))
+
+
+def _outer(compress, outer, v):
+    """由内层链接值（已完成填充）计算最终的MAC"""
+    return struct.pack('>8I', *compress(outer, struct.pack('>8I', *v) + _OUTER_PAD))
+
+
+class HMAC_SM3:
+    """HMAC-SM3（RFC 2104），接口与hmac/hashlib对象一致
+
+    K⊕ipad、K⊕opad 的压缩结果按密钥缓存，每条消息只需压缩消息本身和外层的一个分组；
+    update()与sm3.SM3相同，只缓存不满一个分组的尾部。
+    """
+
+    name = 'hmac-sm3'
+    digest_size = DIGEST_SIZE
+    block_size = BLOCK_SIZE
+
+    def __init__(self, key, msg=None, engine=None):
+        self._compress = sm3.get_engine(engine)
+        self._v, self._outer = _midstates(bytes(key))
+        self._buf = bytearray()
+        self._length = BLOCK_SIZE
+        if msg is not None:
+            self.update(msg)
+
+    def update(self, data):
+        data = memoryview(data).cast('B')
+        n = len(data)
+        self._length += n
+        buf = self._buf
+        start = 0
+        if buf:
+            start = min(BLOCK_SIZE - len(buf), n)
+            buf += data[:start]
+            if len(buf) < BLOCK_SIZE:
+                return
+            self._v = self._compress(self._v, buf)
+            buf.clear()
+        end = start + (n - start) // BLOCK_SIZE * BLOCK_SIZE
+        if end > start:
+            self._v = self._compress(self._v, data, start, end)
+        buf += data[end:]
+
+    def copy(self):
+        other = HMAC_SM3.__new__(HMAC_SM3)
+        other._compress = self._compress
+        other._v, other._outer = self._v, self._outer
+        other._buf = bytearray(self._buf)
+        other._length = self._length
+        return other
+
+    def digest(self):
+        v = self._compress(self._v, bytes(self._buf) + padding(self._length))
+        return _outer(self._compress, self._outer, v)
+
+    def hexdigest(self):
+        return self.digest().hex()
+
+    def verify(self, tag):
+        """恒定时间比较，不匹配时抛出ValueError"""
+        if not hmac.compare_digest(self.digest(), bytes(tag)):
+            raise ValueError("MAC 校验失败")
+
+
+def mac(key, data):
+    """一次性计算HMAC-SM3"""
+    return HMAC_SM3(key, data).digest()
+
+
+def mac_many(key, messages):
+    """同一密钥下批量计算多条消息的HMAC-SM3，返回与messages顺序一致的MAC列表
+
+    中间状态只查一次缓存，之后默认逐条从中间状态继续压缩。
+    NumPy可用且批量足够大时（由sm3_batch.use_lanes按当前压缩函数判断，外层多算一个分组；
+    C实现下要上千条才划算）把每条消息作为一个向量通道，
+    所有通道从内层中间状态出发压缩消息，再从外层中间状态压缩内层摘要。
+    """
+    messages = list(messages)
+    inner, outer = _midstates(bytes(key))
+    compress = sm3.get_engine()
+    if digest_lanes is not None and use_lanes(len(messages), max(map(len, messages), default=0) + BLOCK_SIZE):
+        macs = []
+        for i in range(0, len(messages), LANE_CHUNK):
+            v = digest_lanes(messages[i:i + LANE_CHUNK], inner, BLOCK_SIZE).astype('>u4').tobytes()
+            digests = [v[j:j + DIGEST_SIZE] for j in range(0, len(v), DIGEST_SIZE)]
+            out = digest_lanes(digests, outer, BLOCK_SIZE).astype('>u4').tobytes()
+            macs += [out[j:j + DIGEST_SIZE] for j in range(0, len(out), DIGEST_SIZE)]
+        return macs
+
+    macs = []
+    for m in messages:
+        n = len(m)
+        full = n // BLOCK_SIZE * BLOCK_SIZE
+        v = compress(inner, m, 0, full) if full else inner
+        v = compress(v, bytes(m[full:]) + padding(BLOCK_SIZE + n))
+        macs.append(_outer(compress, outer, v))
+    return macs
+
+
+def hmac_verification():
+    """正确性、中间状态缓存与批量吞吐量"""
+    import os
+    import time
+
+    print("HMAC-SM3")
+    print("=" * 40)
+
+    # 参考实现：按RFC 2104直接拼接计算 H(K⊕opad || H(K⊕ipad || m))
+    def reference(k, m):
+        k = (sm3.new(k).digest() if len(k) > BLOCK_SIZE else k).ljust(BLOCK_SIZE, b'\x00')
+        inner = sm3.new(_xor(k, _IPAD) + m).digest()
+        return sm3.new(_xor(k, _OPAD) + inner).digest()
+
+    keys = [b'', b'key', os.urandom(16), os.urandom(64), os.urandom(100)]
+    messages = [os.urandom(n) for n in (0, 1, 55, 56, 63, 64, 65, 119, 120, 1000)]
+    ok = all(mac(k, m) == reference(k, m) for k in keys for m in messages)
+    print(f"与RFC 2104参考实现一致: {'✓' if ok else '✗'}")
+    try:
+        # OpenSSL提供SM3时，与标准库hmac对比
+        import hashlib
+        hashlib.new('sm3')
+        ok = all(mac(k, m) == hmac.new(k, m, 'sm3').digest() for k in keys for m in messages)
+        print(f"与标准库 hmac + OpenSSL SM3 一致: {'✓' if ok else '✗'}")
+    except ValueError:
+        pass
+
+    key = os.urandom(32)
+    m = os.urandom(1000)
+    h = HMAC_SM3(key)
+    for i in range(0, len(m), 7):
+        h.update(m[i:i + 7])
+    c = h.copy()
+    c.update(b'x')
+    print(f"增量计算与copy(): {'✓' if h.digest() == mac(key, m) and c.digest() == mac(key, m + b'x') else '✗'}")
+    try:
+        HMAC_SM3(key, m).verify(bytes(32))
+        rejected = False
+    except ValueError:
+        rejected = True
+    print(f"错误MAC被拒绝: {'✓' if rejected else '✗'}")
+    # 2000条短消息超过多通道门槛，前5条走逐条计算
+    batch = [os.urandom(n) for n in (os.urandom(1)[0] % 64 for _ in range(2000))]
+    expected = [mac(key, b) for b in batch]
+    ok = mac_many(key, batch) == expected and mac_many(key, batch[:5]) == expected[:5]
+    print(f"批量HMAC一致: {'✓' if ok else '✗'}")
+
+    for count in (16, 100):
+        small = [os.urandom(100) for _ in range(count)]
+        start = time.perf_counter()
+        for r in small:
+            mac(key, r)
+        loop = time.perf_counter() - start
+        start = time.perf_counter()
+        mac_many(key, small)
+        print(f"{count} 条 100 字节请求: 逐条 {loop * 1000:.2f}ms, mac_many {(time.perf_counter() - start) * 1000:.2f}ms")
+
+    requests = [os.urandom(100) for _ in range(20000)]
+    start = time.perf_counter()
+    for r in requests:
+        reference(key, r)
+    plain = time.perf_counter() - start
+    start = time.perf_counter()
+    for r in requests:
+        mac(key, r)
+    cached = time.perf_counter() - start
+    start = time.perf_counter()
+    mac_many(key, requests)
+    batched = time.perf_counter() - start
+    print("\n20000 条 100 字节请求:")
+    print(f"每次压缩ipad/opad: {len(requests) / plain:.0f} 条/s")
+    print(f"缓存中间状态: {len(requests) / cached:.0f} 条/s")
+    print(f"mac_many批量: {len(requests) / batched:.0f} 条/s")
+
+
+if __name__ == "__main__":
+    hmac_verification()
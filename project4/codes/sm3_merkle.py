@@ -0,0 +1,311 @@
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+
+import sm3
+from sm3 import DIGEST_SIZE
+
+# 默认叶子大小：每个叶子单独哈希，也是增量更新的最小单位
+DEFAULT_LEAF_SIZE = 4 * 1024 * 1024
+# 每个进程任务处理的叶子数，减少进程间通信次数
+LEAVES_PER_TASK = 4
+# 默认的索引文件后缀（与数据文件放在同一目录）
+INDEX_SUFFIX = '.sm3tree'
+
+# 叶子与内部节点使用不同的前缀，防止把内部节点当作叶子伪造（第二原像攻击）
+_LEAF_PREFIX = b'\x00'
+_NODE_PREFIX = b'\x01'
+
+# 索引文件头：魔数、叶子大小、文件大小、修改时间(ns)、叶子数；之后依次是各层的全部节点
+_INDEX_MAGIC = b'SM3TREE1'
+_INDEX_HEADER = struct.Struct('>8sQQQQ')
+
+
+def leaf_hash(data):
+    """叶子摘要 SM3(0x00 || data)"""
+    h = sm3.new(_LEAF_PREFIX)
+    h.update(data)
+    return h.digest()
+
+
+def node_hash(left, right):
+    """内部节点摘要 SM3(0x01 || left || right)"""
+    return sm3.new(_NODE_PREFIX + left + right).digest()
+
+
+def _leaf_count(size, leaf_size):
+    # 空文件也有一个（空）叶子
+    return max(1, -(-size // leaf_size))
+
+
+def _hash_leaves(path, leaf_size, indices):
+    """进程池任务：读取并哈希指定的若干叶子，返回摘要列表"""
+    digests = []
+    buf = bytearray(leaf_size)
+    view = memoryview(buf)
+    with open(path, 'rb', buffering=0) as f:
+        for i in indices:
+            f.seek(i * leaf_size)
+            n = 0
+            while n < leaf_size:
+                got = f.readinto(view[n:])
+                if not got:
+                    break
+                n += got
+            digests.append(leaf_hash(view[:n]))
+    return digests
+
+
+def hash_leaves(path, indices, leaf_size=DEFAULT_LEAF_SIZE, workers=None):
+    """在进程池中哈希指定的叶子，返回与indices顺序一致的摘要列表
+
+    workers为进程数（默认CPU核数），为1或叶子很少时直接在当前进程中计算。
+    """
+    indices = list(indices)
+    tasks = [indices[i:i + LEAVES_PER_TASK] for i in range(0, len(indices), LEAVES_PER_TASK)]
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(tasks) <= 1:
+        return _hash_leaves(path, leaf_size, indices)
+    digests = []
+    with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+        for part in pool.map(_hash_leaves, [path] * len(tasks), [leaf_size] * len(tasks), tasks):
+            digests += part
+    return digests
+
+
+def _update_levels(levels, dirty):
+    """levels[0]（叶子层）更新后，只重算dirty中叶子到根的路径
+
+    每层两两合并，落单的最后一个节点直接提升到上一层。层长度变化时，
+    调用方保证dirty包含叶子层的最后一个下标，逐层向上它的父节点也都会被重算。
+    """
+    k = 0
+    while len(levels[k]) > 1:
+        child = levels[k]
+        n = (len(child) + 1) // 2
+        if k + 1 == len(levels):
+            levels.append([])
+        parent = levels[k + 1]
+        del parent[n:]
+        dirty = {i // 2 for i in dirty} | set(range(len(parent), n))
+        parent.extend([None] * (n - len(parent)))
+        for i in dirty:
+            if 2 * i + 1 < len(child):
+                parent[i] = node_hash(child[2 * i], child[2 * i + 1])
+            else:
+                parent[i] = child[2 * i]
+        k += 1
+    del levels[k + 1:]
+
+
+class MerkleTree:
+    """文件的SM3 Merkle树（自有内容寻址存储使用，结果与普通SM3摘要不同）
+
+    文件按leaf_size切分为叶子，叶子在进程池中并行哈希，再两两合并到根。
+    每一层的全部节点都保存在内存和索引文件中，文件局部修改后只需重新哈希改动的叶子，
+    并沿路径重算到根。
+    """
+
+    def __init__(self, leaf_size=DEFAULT_LEAF_SIZE):
+        if leaf_size <= 0:
+            raise ValueError("leaf_size 必须为正数")
+        self.leaf_size = leaf_size
+        self.size = 0
+        self.mtime_ns = 0
+        self.levels = [[leaf_hash(b'')]]
+
+    @property
+    def root(self):
+        return self.levels[-1][0]
+
+    @property
+    def hexroot(self):
+        return self.root.hex()
+
+    @property
+    def leaves(self):
+        return self.levels[0]
+
+    @classmethod
+    def build(cls, path, leaf_size=DEFAULT_LEAF_SIZE, workers=None):
+        """完整计算文件的Merkle树"""
+        tree = cls(leaf_size)
+        st = os.stat(path)
+        count = _leaf_count(st.st_size, leaf_size)
+        tree.levels = [hash_leaves(path, range(count), leaf_size, workers)]
+        _update_levels(tree.levels, range(count))
+        tree.size, tree.mtime_ns = st.st_size, st.st_mtime_ns
+        return tree
+
+    def update(self, path, changed, workers=None):
+        """文件被修改后增量更新，返回重新哈希的叶子下标
+
+        changed为修改过的 (偏移, 长度) 区间列表；文件变长或变短时，
+        原来的最后一个叶子和新增的叶子自动计入。
+        """
+        st = os.stat(path)
+        leaf_size = self.leaf_size
+        old_count = len(self.leaves)
+        count = _leaf_count(st.st_size, leaf_size)
+        dirty = set()
+        for offset, length in changed:
+            if offset < 0 or length < 0:
+                raise ValueError("修改区间的偏移和长度不能为负")
+            if length:
+                dirty.update(range(offset // leaf_size, (offset + length - 1) // leaf_size + 1))
+        if st.st_size != self.size:
+            dirty.update(range(min(old_count, count) - 1, count))
+        dirty = sorted(i for i in dirty if i < count)
+
+        leaves = self.levels[0]
+        del leaves[count:]
+        leaves.extend([None] * (count - len(leaves)))
+        for i, digest in zip(dirty, hash_leaves(path, dirty, leaf_size, workers)):
+            leaves[i] = digest
+        _update_levels(self.levels, dirty)
+        self.size, self.mtime_ns = st.st_size, st.st_mtime_ns
+        return dirty
+
+    def matches(self, path):
+        """文件大小和修改时间与树记录的一致（未修改）"""
+        st = os.stat(path)
+        return st.st_size == self.size and st.st_mtime_ns == self.mtime_ns
+
+    def save(self, index_path):
+        """把所有层的节点写入索引文件（先写临时文件再替换，中途失败不会留下损坏的索引）"""
+        tmp = index_path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(_INDEX_HEADER.pack(_INDEX_MAGIC, self.leaf_size, self.size, self.mtime_ns, len(self.leaves)))
+            for level in self.levels:
+                f.write(b''.join(level))
+        os.replace(tmp, index_path)
+
+    @classmethod
+    def load(cls, index_path):
+        """读取save()写入的索引文件"""
+        with open(index_path, 'rb') as f:
+            data = f.read()
+        if len(data) < _INDEX_HEADER.size:
+            raise ValueError("索引文件已损坏")
+        magic, leaf_size, size, mtime_ns, count = _INDEX_HEADER.unpack_from(data)
+        if magic != _INDEX_MAGIC or not leaf_size or not count:
+            raise ValueError("不是有效的SM3 Merkle索引文件")
+        tree = cls(leaf_size)
+        tree.size, tree.mtime_ns = size, mtime_ns
+        tree.levels = []
+        off = _INDEX_HEADER.size
+        while True:
+            end = off + count * DIGEST_SIZE
+            if end > len(data):
+                raise ValueError("索引文件已损坏")
+            tree.levels.append([data[i:i + DIGEST_SIZE] for i in range(off, end, DIGEST_SIZE)])
+            off = end
+            if count == 1:
+                break
+            count = (count + 1) // 2
+        if off != len(data):
+            raise ValueError("索引文件已损坏")
+        return tree
+
+
+def tree_hash(path, leaf_size=DEFAULT_LEAF_SIZE, workers=None, index_path=None, changed=None):
+    """计算文件的SM3 Merkle根，并维护旁路索引文件（默认 path + INDEX_SUFFIX）
+
+    - 索引存在且文件大小、修改时间未变：直接返回保存的根，不读取文件
+    - 文件已修改且给出changed区间：只重新哈希这些区间所在的叶子
+    - 否则（无索引、叶子大小不同或未知修改位置）：完整计算
+    """
+    index_path = index_path or path + INDEX_SUFFIX
+    tree = None
+    try:
+        tree = MerkleTree.load(index_path)
+    except (OSError, ValueError):
+        pass
+    if tree is not None and tree.leaf_size == leaf_size:
+        if tree.matches(path):
+            return tree.root
+        if changed is not None:
+            tree.update(path, changed, workers)
+            tree.save(index_path)
+            return tree.root
+    tree = MerkleTree.build(path, leaf_size, workers)
+    tree.save(index_path)
+    return tree.root
+
+
+def merkle_verification():
+    """正确性、增量更新与并行速度"""
+    import tempfile
+    import time
+
+    print("SM3 Merkle树哈希")
+    print("=" * 40)
+
+    # 参考实现：整体读入后逐层合并
+    def reference(data, leaf_size):
+        level = [leaf_hash(data[i:i + leaf_size]) for i in range(0, max(len(data), 1), leaf_size)]
+        while len(level) > 1:
+            level = [node_hash(level[i], level[i + 1]) if i + 1 < len(level) else level[i]
+                     for i in range(0, len(level), 2)]
+        return level[0]
+
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, 'image.bin')
+        ok = True
+        for size in (0, 1, 1024, 1025, 5 * 1024 + 7):
+            data = os.urandom(size)
+            with open(path, 'wb') as f:
+                f.write(data)
+            ok = ok and MerkleTree.build(path, 1024, workers=2).root == reference(data, 1024)
+        print(f"与逐层参考实现一致: {'✓' if ok else '✗'}")
+
+        data = bytearray(os.urandom(37 * 1024 + 100))
+        with open(path, 'wb') as f:
+            f.write(data)
+        tree = MerkleTree.build(path, 1024)
+        tree.save(path + INDEX_SUFFIX)
+        ok = MerkleTree.load(path + INDEX_SUFFIX).levels == tree.levels
+        print(f"索引文件保存与读取: {'✓' if ok else '✗'}")
+
+        ok = True
+        for offset, patch in ((5000, b'x' * 10), (0, b'y'), (37 * 1024 + 99, b'z'), (len(data), b'w' * 3000)):
+            data[offset:offset + len(patch)] = patch
+            with open(path, 'r+b') as f:
+                f.seek(offset)
+                f.write(patch)
+            rehashed = tree.update(path, [(offset, len(patch))])
+            ok = ok and tree.root == reference(bytes(data), 1024) and len(rehashed) <= 4
+        del data[2048:]
+        with open(path, 'r+b') as f:
+            f.truncate(2048)
+        tree.update(path, [])
+        ok = ok and tree.root == reference(bytes(data), 1024)
+        print(f"局部修改/追加/截断后增量更新: {'✓' if ok else '✗'}")
+
+        # 大文件：完整计算、未修改时直接读取索引、修改一处后增量更新
+        leaf_size = 1024 * 1024
+        size = 32 * leaf_size
+        with open(path, 'wb') as f:
+            f.write(os.urandom(size))
+        os.remove(path + INDEX_SUFFIX)
+        for workers in (1, 4):
+            start = time.perf_counter()
+            root = MerkleTree.build(path, leaf_size, workers).root
+            elapsed = time.perf_counter() - start
+            print(f"32MB 完整计算（{workers} 进程）: {size / (1024 * 1024) / elapsed:.1f} MB/s")
+        start = time.perf_counter()
+        ok = tree_hash(path, leaf_size) == root and tree_hash(path, leaf_size) == root
+        print(f"tree_hash 首次计算 + 未修改直接读取索引: {time.perf_counter() - start:.3f}s {'✓' if ok else '✗'}")
+        with open(path, 'r+b') as f:
+            f.seek(size // 2)
+            f.write(b'changed')
+        start = time.perf_counter()
+        root = tree_hash(path, leaf_size, changed=[(size // 2, 7)])
+        elapsed = time.perf_counter() - start
+        ok = root == MerkleTree.build(path, leaf_size).root
+        print(f"修改7字节后增量更新: {elapsed:.3f}s {'✓' if ok else '✗'}")
+        print(f"（本机 {os.cpu_count()} 核）")
+
+
+if __name__ == "__main__":
+    merkle_verification()
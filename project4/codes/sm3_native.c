@@ -0,0 +1,209 @@
+#include <immintrin.h>
+#include <stdint.h>
+#include <stddef.h>
+#include <stdio.h>
+#include <string.h>
+
+// 编译为共享库时（-DSM3_BUILD_SHARED）导出公共接口，并去掉 main 测试
+#if defined(_WIN32)
+#define SM3_API __declspec(dllexport)
+#else
+#define SM3_API __attribute__((visibility("default")))
+#endif
+
+// AVX2 函数单独指定目标指令集，整个文件无需 -mavx2 也能编译，运行时再按 CPU 选择路径
+#if defined(__GNUC__) || defined(__clang__)
+#define SM3_TARGET_AVX2 __attribute__((target("avx2")))
+#else
+#define SM3_TARGET_AVX2
+#endif
+
+#define SM3_BLOCK_SIZE 64
+#define SM3_DIGEST_SIZE 32
+
+static const uint32_t SM3_IV[8] = {
+    0x7380166F, 0x4914B2B9, 0x172442D7, 0xDA8A0600,
+    0xA96F30BC, 0x163138AA, 0xE38DEE4D, 0xB0FB0E4E
+};
+
+// T_j <<< (j mod 32)
+static const uint32_t SM3_T_ROT[64] = {
+    0x79CC4519, 0xF3988A32, 0xE7311465, 0xCE6228CB,
+    0x9CC45197, 0x3988A32F, 0x7311465E, 0xE6228CBC,
+    0xCC451979, 0x988A32F3, 0x311465E7, 0x6228CBCE,
+    0xC451979C, 0x88A32F39, 0x11465E73, 0x228CBCE6,
+    0x9D8A7A87, 0x3B14F50F, 0x7629EA1E, 0xEC53D43C,
+    0xD8A7A879, 0xB14F50F3, 0x629EA1E7, 0xC53D43CE,
+    0x8A7A879D, 0x14F50F3B, 0x29EA1E76, 0x53D43CEC,
+    0xA7A879D8, 0x4F50F3B1, 0x9EA1E762, 0x3D43CEC5,
+    0x7A879D8A, 0xF50F3B14, 0xEA1E7629, 0xD43CEC53,
+    0xA879D8A7, 0x50F3B14F, 0xA1E7629E, 0x43CEC53D,
+    0x879D8A7A, 0x0F3B14F5, 0x1E7629EA, 0x3CEC53D4,
+    0x79D8A7A8, 0xF3B14F50, 0xE7629EA1, 0xCEC53D43,
+    0x9D8A7A87, 0x3B14F50F, 0x7629EA1E, 0xEC53D43C,
+    0xD8A7A879, 0xB14F50F3, 0x629EA1E7, 0xC53D43CE,
+    0x8A7A879D, 0x14F50F3B, 0x29EA1E76, 0x53D43CEC,
+    0xA7A879D8, 0x4F50F3B1, 0x9EA1E762, 0x3D43CEC5
+};
+
+static inline uint32_t rotl32(uint32_t x, int n) {
+    return (x << n) | (x >> (32 - n));
+}
+
+static inline uint32_t load_be32(const uint8_t* p) {
+    return ((uint32_t)p[0] << 24) | ((uint32_t)p[1] << 16) | ((uint32_t)p[2] << 8) | p[3];
+}
+
+static inline void store_be32(uint8_t* p, uint32_t x) {
+    p[0] = (uint8_t)(x >> 24);
+    p[1] = (uint8_t)(x >> 16);
+    p[2] = (uint8_t)(x >> 8);
+    p[3] = (uint8_t)x;
+}
+
+#define P0(x) ((x) ^ rotl32((x), 9) ^ rotl32((x), 17))
+#define P1(x) ((x) ^ rotl32((x), 15) ^ rotl32((x), 23))
+
+// ====================== 消息扩展 ======================
+// W 需要多留 4 个字：AVX2 路径每次写 4 个字（只有前 3 个有效）
+static void sm3_expand_scalar(const uint8_t* block, uint32_t W[72], uint32_t W1[64]) {
+    for (int j = 0; j < 16; j++) {
+        W[j] = load_be32(block + 4 * j);
+    }
+    for (int j = 16; j < 68; j++) {
+        W[j] = P1(W[j - 16] ^ W[j - 9] ^ rotl32(W[j - 3], 15)) ^ rotl32(W[j - 13], 7) ^ W[j - 6];
+    }
+    for (int j = 0; j < 64; j++) {
+        W1[j] = W[j] ^ W[j + 4];
+    }
+}
+
+SM3_TARGET_AVX2
+static inline __m128i rotl128(__m128i x, int n) {
+    return _mm_or_si128(_mm_slli_epi32(x, n), _mm_srli_epi32(x, 32 - n));
+}
+
+// W[j] 依赖 W[j-3]，每次只能同时计算 3 个字：用128位向量，第4个通道的结果下一轮会被覆盖。
+// 字节序转换与 W'[j] = W[j] ^ W[j+4] 没有依赖，用256位向量每次处理 8 个字。
+SM3_TARGET_AVX2
+static void sm3_expand_avx2(const uint8_t* block, uint32_t W[72], uint32_t W1[64]) {
+    const __m256i bswap = _mm256_setr_epi8(
+        3, 2, 1, 0, 7, 6, 5, 4, 11, 10, 9, 8, 15, 14, 13, 12,
+        3, 2, 1, 0, 7, 6, 5, 4, 11, 10, 9, 8, 15, 14, 13, 12);
+    __m256i lo = _mm256_loadu_si256((const __m256i*)block);
+    __m256i hi = _mm256_loadu_si256((const __m256i*)(block + 32));
+    _mm256_storeu_si256((__m256i*)W, _mm256_shuffle_epi8(lo, bswap));
+    _mm256_storeu_si256((__m256i*)(W + 8), _mm256_shuffle_epi8(hi, bswap));
+    W[16] = 0;  // 第一次读取 W[j-3..j] 时的第4个通道，结果被丢弃
+
+    for (int j = 16; j < 68; j += 3) {
+        __m128i w16 = _mm_loadu_si128((const __m128i*)(W + j - 16));
+        __m128i w9 = _mm_loadu_si128((const __m128i*)(W + j - 9));
+        __m128i w3 = _mm_loadu_si128((const __m128i*)(W + j - 3));
+        __m128i w13 = _mm_loadu_si128((const __m128i*)(W + j - 13));
+        __m128i w6 = _mm_loadu_si128((const __m128i*)(W + j - 6));
+        __m128i x = _mm_xor_si128(_mm_xor_si128(w16, w9), rotl128(w3, 15));
+        x = _mm_xor_si128(_mm_xor_si128(x, rotl128(x, 15)), rotl128(x, 23));
+        x = _mm_xor_si128(_mm_xor_si128(x, rotl128(w13, 7)), w6);
+        _mm_storeu_si128((__m128i*)(W + j), x);
+    }
+
+    for (int j = 0; j < 64; j += 8) {
+        __m256i a = _mm256_loadu_si256((const __m256i*)(W + j));
+        __m256i b = _mm256_loadu_si256((const __m256i*)(W + j + 4));
+        _mm256_storeu_si256((__m256i*)(W1 + j), _mm256_xor_si256(a, b));
+    }
+}
+
+// ====================== 压缩函数 ======================
+#define SM3_ROUND(j, FF, GG) do {                                  \
+    uint32_t a12 = rotl32(A, 12);                                  \
+    uint32_t ss1 = rotl32(a12 + E + SM3_T_ROT[j], 7);              \
+    uint32_t tt1 = (FF) + D + (ss1 ^ a12) + W1[j];                 \
+    uint32_t tt2 = (GG) + H + ss1 + W[j];                          \
+    D = C; C = rotl32(B, 9); B = A; A = tt1;                       \
+    H = G; G = rotl32(F, 19); F = E; E = P0(tt2);                  \
+} while (0)
+
+static void sm3_rounds(uint32_t v[8], const uint32_t W[72], const uint32_t W1[64]) {
+    uint32_t A = v[0], B = v[1], C = v[2], D = v[3];
+    uint32_t E = v[4], F = v[5], G = v[6], H = v[7];
+    for (int j = 0; j < 16; j++) {
+        SM3_ROUND(j, A ^ B ^ C, E ^ F ^ G);
+    }
+    for (int j = 16; j < 64; j++) {
+        SM3_ROUND(j, (A & B) | (A & C) | (B & C), (E & F) | (~E & G));
+    }
+    v[0] ^= A; v[1] ^= B; v[2] ^= C; v[3] ^= D;
+    v[4] ^= E; v[5] ^= F; v[6] ^= G; v[7] ^= H;
+}
+
+SM3_API int sm3_cpu_has_avx2(void) {
+#if defined(__GNUC__) || defined(__clang__)
+    __builtin_cpu_init();
+    return __builtin_cpu_supports("avx2") ? 1 : 0;
+#else
+    return 0;
+#endif
+}
+
+// 对连续 blocks 个64字节分组依次压缩，v 为8字链接值（原地更新）
+SM3_API void sm3_compress_blocks(uint32_t v[8], const uint8_t* data, size_t blocks, int use_avx2) {
+    uint32_t W[72], W1[64];
+    for (size_t i = 0; i < blocks; i++, data += SM3_BLOCK_SIZE) {
+        if (use_avx2) {
+            sm3_expand_avx2(data, W, W1);
+        } else {
+            sm3_expand_scalar(data, W, W1);
+        }
+        sm3_rounds(v, W, W1);
+    }
+}
+
+// 一次性计算 len 字节消息的摘要：完整分组直接从输入压缩，只对尾部补填充
+SM3_API void sm3_hash(const uint8_t* data, size_t len, uint8_t out[SM3_DIGEST_SIZE], int use_avx2) {
+    uint32_t v[8];
+    uint8_t tail[2 * SM3_BLOCK_SIZE];
+    size_t full = len / SM3_BLOCK_SIZE, rest = len % SM3_BLOCK_SIZE;
+    size_t tail_len = rest < 56 ? SM3_BLOCK_SIZE : 2 * SM3_BLOCK_SIZE;
+    uint64_t bits = (uint64_t)len << 3;
+
+    memcpy(v, SM3_IV, sizeof(v));
+    sm3_compress_blocks(v, data, full, use_avx2);
+    memset(tail, 0, sizeof(tail));
+    memcpy(tail, data + full * SM3_BLOCK_SIZE, rest);
+    tail[rest] = 0x80;
+    store_be32(tail + tail_len - 8, (uint32_t)(bits >> 32));
+    store_be32(tail + tail_len - 4, (uint32_t)bits);
+    sm3_compress_blocks(v, tail, tail_len / SM3_BLOCK_SIZE, use_avx2);
+    for (int i = 0; i < 8; i++) {
+        store_be32(out + 4 * i, v[i]);
+    }
+}
+
+#ifndef SM3_BUILD_SHARED
+static int check(const char* name, const uint8_t* msg, size_t len, const char* expected, int use_avx2) {
+    uint8_t out[SM3_DIGEST_SIZE];
+    char hex[2 * SM3_DIGEST_SIZE + 1];
+    sm3_hash(msg, len, out, use_avx2);
+    for (int i = 0; i < SM3_DIGEST_SIZE; i++) {
+        sprintf(hex + 2 * i, "%02x", out[i]);
+    }
+    int ok = strcmp(hex, expected) == 0;
+    printf("%s%s: %s\n", name, use_avx2 ? " (AVX2)" : "", ok ? "OK" : "FAIL");
+    return ok;
+}
+
+int main(void) {
+    uint8_t abcd[64];
+    int ok = 1;
+    for (int i = 0; i < 64; i++) abcd[i] = "abcd"[i % 4];
+    for (int use_avx2 = 0; use_avx2 <= sm3_cpu_has_avx2(); use_avx2++) {
+        ok &= check("abc", (const uint8_t*)"abc", 3,
+                    "66c7f0f462eeedd9d1f2d46bdc10e4e24167c4875cf2f7a2297da02b8f4ba8e0", use_avx2);
+        ok &= check("abcd*16", abcd, 64,
+                    "debe9ff92275b8a138604889c18e5a4d6fdb70e5387e5765293dcba39c0c5732", use_avx2);
+    }
+    return ok ? 0 : 1;
+}
+#endif
@@ -0,0 +1,226 @@
+import ctypes
+import hashlib
+import os
+import subprocess
+import sys
+import sysconfig
+import tempfile
+
+from sm3 import BLOCK_SIZE, DIGEST_SIZE
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+_SOURCE = os.path.join(_HERE, 'sm3_native.c')
+
+# 可通过环境变量指定已编译好的库或编译器
+_ENV_LIB = 'SM3_NATIVE_LIB'
+_ENV_CC = 'CC'
+
+
+def _library_path():
+    """按源码内容哈希命名共享库，源码修改后自动重新编译"""
+    with open(_SOURCE, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:12]
+    suffix = '.dll' if sys.platform == 'win32' else '.so'
+    return os.path.join(_HERE, f'_sm3_native_{digest}{suffix}')
+
+
+def build_library(path=None):
+    """编译sm3_native.c为共享库，返回库路径
+
+    先编译到同目录下的临时文件再os.replace()到目标路径：多个进程同时导入时，
+    不会加载到写了一半的库，也不会互相覆盖编译器的输出。
+    """
+    path = path or _library_path()
+    cc = os.environ.get(_ENV_CC) or sysconfig.get_config_var('CC') or 'cc'
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp', suffix=os.path.splitext(path)[1])
+    os.close(fd)
+    try:
+        cmd = cc.split() + ['-O3', '-shared', '-fPIC', '-DSM3_BUILD_SHARED', _SOURCE, '-o', tmp]
+        subprocess.run(cmd, check=True, capture_output=True)
+        # mkstemp创建的文件只有属主可读写，改为编译器输出的常规权限
+        os.chmod(tmp, 0o755)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return path
+
+
+def _load_library():
+    """加载（必要时先编译）原生库，失败时返回None"""
+    path = os.environ.get(_ENV_LIB)
+    try:
+        if not path:
+            path = _library_path()
+            if not os.path.exists(path):
+                build_library(path)
+        # CDLL 调用外部函数期间会释放GIL，多个线程可同时哈希不同的数据
+        lib = ctypes.CDLL(path)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    lib.sm3_cpu_has_avx2.argtypes = []
+    lib.sm3_cpu_has_avx2.restype = ctypes.c_int
+    lib.sm3_compress_blocks.argtypes = [ctypes.POINTER(ctypes.c_uint32), ctypes.c_void_p, ctypes.c_size_t,
+                                        ctypes.c_int]
+    lib.sm3_compress_blocks.restype = None
+    lib.sm3_hash.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_char_p, ctypes.c_int]
+    lib.sm3_hash.restype = None
+    return lib
+
+
+_lib = _load_library()
+HAS_NATIVE = _lib is not None
+HAS_AVX2 = bool(HAS_NATIVE and _lib.sm3_cpu_has_avx2())
+# 实际使用的实现：'avx2'（AVX2消息扩展）、'scalar'（C标量）或 'python'（原生库不可用时的回退）
+BACKEND = ('avx2' if HAS_AVX2 else 'scalar') if HAS_NATIVE else 'python'
+
+
+def _buffer_pointer(data, offset=0):
+    """返回data[offset:]的地址和需要保持存活的对象，尽量不拷贝
+
+    bytes与可写缓冲区直接取地址；只读的memoryview/mmap借助NumPy取地址，没有NumPy时复制一份。
+    """
+    if isinstance(data, bytes):
+        return ctypes.cast(ctypes.c_char_p(data), ctypes.c_void_p).value + offset, data
+    try:
+        buf = (ctypes.c_char * len(data)).from_buffer(data)
+        return ctypes.addressof(buf) + offset, buf
+    except TypeError:
+        pass
+    if np is not None:
+        arr = np.frombuffer(data, dtype=np.uint8)
+        return arr.ctypes.data + offset, arr
+    data = bytes(data)
+    return ctypes.cast(ctypes.c_char_p(data), ctypes.c_void_p).value + offset, data
+
+
+def _python_compress():
+    from sm3_unrolled import compress_blocks as unrolled
+    return unrolled
+
+
+def compress_blocks(v, data, offset=0, end=None, use_avx2=None):
+    """对data[offset:end]中的整数个64字节分组执行压缩函数，接口与sm3.compress_blocks相同
+
+    整段分组在一次C调用中完成，调用期间释放GIL；原生库不可用时使用展开版纯Python实现。
+    """
+    if end is None:
+        end = len(data)
+    if _lib is None:
+        return _python_compress()(v, data, offset, end)
+    state = (ctypes.c_uint32 * 8)(*v)
+    if end > offset:
+        ptr, _keep = _buffer_pointer(data, offset)
+        use_avx2 = HAS_AVX2 if use_avx2 is None else use_avx2
+        _lib.sm3_compress_blocks(state, ptr, (end - offset) // BLOCK_SIZE, use_avx2)
+    return tuple(state)
+
+
+class SM3_Native:
+    """基于sm3_native.c的原生SM3，接口与sm3-pro.py中的SM3_Basic/SM3_Optimized相同
+
+    hash()在一次C调用中完成压缩和填充，期间释放GIL；
+    use_avx2默认按CPU自动选择，False强制使用C标量路径。
+    原生库不可用时回退到sm3.py的增量对象（展开版压缩函数）。
+    """
+
+    def __init__(self, use_avx2=None):
+        if use_avx2 and not HAS_AVX2:
+            raise RuntimeError("当前CPU或原生库不支持AVX2")
+        if _lib is None:
+            self.backend = 'python'
+        else:
+            self.backend = 'avx2' if (HAS_AVX2 if use_avx2 is None else use_avx2) else 'scalar'
+        self._use_avx2 = int(self.backend == 'avx2')
+
+    def hash(self, message):
+        if self.backend == 'python':
+            import sm3
+            return sm3.new(message, engine='unrolled').digest()
+        if not isinstance(message, bytes):
+            message = memoryview(message).cast('B')
+        out = ctypes.create_string_buffer(DIGEST_SIZE)
+        ptr, _keep = _buffer_pointer(message)
+        _lib.sm3_hash(ptr, len(message), out, self._use_avx2)
+        return out.raw
+
+    def hash_hex(self, message):
+        return self.hash(message).hex()
+
+
+def native_verification():
+    """正确性、各实现速度与多线程文件哈希"""
+    import tempfile
+    import threading
+    import time
+
+    import sm3
+
+    print("SM3原生实现")
+    print("=" * 40)
+    print(f"原生库: {'✓' if HAS_NATIVE else '✗（回退到纯Python）'}，AVX2: {'✓' if HAS_AVX2 else '✗'}")
+    modes = [None] + [False] * HAS_NATIVE + [True] * HAS_AVX2
+    vectors = [
+        (b'abc', '66c7f0f462eeedd9d1f2d46bdc10e4e24167c4875cf2f7a2297da02b8f4ba8e0'),
+        (b'abcd' * 16, 'debe9ff92275b8a138604889c18e5a4d6fdb70e5387e5765293dcba39c0c5732'),
+        (b'', '1ab21d8355cfa17f8e61194831e81a8f22bec8c728fefb747ed035eb5082aa2b'),
+    ]
+    for msg, expected in vectors:
+        ok = all(SM3_Native(m).hash_hex(msg) == expected for m in modes)
+        print(f"标准向量 {msg[:8]!r}: {'✓' if ok else '✗'}")
+
+    data = os.urandom(64 * 100 + 37)
+    reference = sm3.new(data, engine='unrolled').digest()
+    ok = sm3.new(data, engine='native').digest() == reference
+    ok = ok and SM3_Native().hash(bytearray(data)) == reference and SM3_Native().hash(memoryview(data)) == reference
+    print(f"与纯Python实现一致（bytes/bytearray/memoryview/增量）: {'✓' if ok else '✗'}")
+
+    size = 16 * 1024 * 1024
+    data = os.urandom(size)
+    for name, m in (("C标量", False), ("AVX2消息扩展", True)):
+        if not HAS_NATIVE or (m and not HAS_AVX2):
+            continue
+        h = SM3_Native(m)
+        best = 0.0
+        for _ in range(3):
+            start = time.perf_counter()
+            h.hash(data)
+            best = max(best, size / (1024 * 1024) / (time.perf_counter() - start))
+        print(f"{name}: {best:.1f} MB/s")
+
+    # 多线程哈希多个文件：每次update()的压缩都在释放GIL的C调用中完成
+    with tempfile.TemporaryDirectory() as d:
+        paths = []
+        for i in range(4):
+            paths.append(os.path.join(d, f'{i}.bin'))
+            with open(paths[-1], 'wb') as f:
+                f.write(data[i * size // 4:(i + 1) * size // 4])
+        start = time.perf_counter()
+        serial = [sm3.hash_file(p) for p in paths]
+        serial_time = time.perf_counter() - start
+        results = [None] * len(paths)
+
+        def worker(i):
+            results[i] = sm3.hash_file(paths[i])
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(paths))]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        threaded_time = time.perf_counter() - start
+        print(f"4个文件多线程哈希一致: {'✓' if results == serial else '✗'}")
+        print(f"串行 {serial_time * 1000:.1f}ms，{len(paths)}线程 {threaded_time * 1000:.1f}ms"
+              f"（本机 {os.cpu_count()} 核）")
+
+
+if __name__ == "__main__":
+    native_verification()
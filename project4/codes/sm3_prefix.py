@@ -0,0 +1,99 @@
+from collections import OrderedDict
+
+import sm3
+from sm3 import BLOCK_SIZE
+
+# 默认缓存的前缀状态个数
+PREFIX_CACHE_SIZE = 256
+
+
+class PrefixCache:
+    """共享前缀的SM3中间状态缓存
+
+    许多消息以相同的内容开头（例如固定的协议头）。按分组边界截取前缀，
+    第一次遇到时压缩并用export_state()保存状态，之后同一前缀的消息用from_state()
+    从缓存的状态继续，只压缩剩余的分组。缓存按最近使用淘汰，最多保存maxsize个前缀。
+    """
+
+    def __init__(self, maxsize=PREFIX_CACHE_SIZE, engine=None):
+        if maxsize <= 0:
+            raise ValueError("maxsize 必须为正数")
+        self.maxsize = maxsize
+        self.engine = engine
+        self.hits = 0
+        self.misses = 0
+        self._states = OrderedDict()
+
+    def _state(self, prefix):
+        """返回前缀（整数个分组）压缩后的 (state, length)，未命中时计算并缓存"""
+        entry = self._states.get(prefix)
+        if entry is not None:
+            self.hits += 1
+            self._states.move_to_end(prefix)
+            return entry
+        self.misses += 1
+        entry = sm3.new(prefix, self.engine).export_state()
+        self._states[prefix] = entry
+        if len(self._states) > self.maxsize:
+            self._states.popitem(last=False)
+        return entry
+
+    def new(self, data, prefix_length):
+        """返回已输入data的SM3对象，data的前prefix_length字节（向下取整到分组边界）走缓存"""
+        data = memoryview(data).cast('B')
+        aligned = min(prefix_length, len(data)) // BLOCK_SIZE * BLOCK_SIZE
+        if aligned <= 0:
+            return sm3.new(data, self.engine)
+        state, length = self._state(bytes(data[:aligned]))
+        return sm3.from_state(state, length, data[aligned:], self.engine)
+
+    def digest(self, data, prefix_length):
+        return self.new(data, prefix_length).digest()
+
+    def digest_many(self, messages, prefix_length):
+        """批量计算，返回与messages顺序一致的摘要列表"""
+        return [self.new(m, prefix_length).digest() for m in messages]
+
+    def clear(self):
+        self._states.clear()
+        self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self._states)
+
+
+def prefix_verification():
+    """正确性、LRU淘汰与共享前缀时的速度"""
+    import os
+    import time
+
+    print("SM3共享前缀状态缓存")
+    print("=" * 40)
+    cache = PrefixCache(maxsize=2)
+    header = os.urandom(300)
+    messages = [header + os.urandom(n) for n in (0, 1, 50, 200)] + [header[:10], b'']
+    ok = all(cache.digest(m, len(header)) == sm3.new(m).digest() for m in messages)
+    print(f"与直接计算一致: {'✓' if ok else '✗'}")
+    print(f"命中 {cache.hits} 次、未命中 {cache.misses} 次: {'✓' if (cache.hits, cache.misses) == (3, 1) else '✗'}")
+    for _ in range(3):
+        cache.digest(os.urandom(128), 128)
+    print(f"LRU容量限制: {'✓' if len(cache) == 2 else '✗'}")
+
+    # 4KB固定头 + 100字节可变内容
+    header = os.urandom(4096)
+    messages = [header + os.urandom(100) for _ in range(2000)]
+    for engine, count in (('unrolled', 200), ('native', len(messages))):
+        batch = messages[:count]
+        start = time.perf_counter()
+        expected = [sm3.new(m, engine).digest() for m in batch]
+        plain = time.perf_counter() - start
+        cache = PrefixCache(engine=engine)
+        start = time.perf_counter()
+        ok = cache.digest_many(batch, len(header)) == expected
+        cached = time.perf_counter() - start
+        print(f"{engine}: 直接计算 {count / plain:.0f} 条/s，前缀缓存 {count / cached:.0f} 条/s "
+              f"({plain / cached:.1f}x) {'✓' if ok else '✗'}")
+
+
+if __name__ == "__main__":
+    prefix_verification()
@@ -0,0 +1,103 @@
+from sm3 import _T_ROT, BLOCK_SIZE
+
+
+def _rot(x, n):
+    """不带掩码的循环左移表达式：调用方负责在合适的位置统一截断到32位"""
+    return f"({x} << {n}) ^ ({x} >> {32 - n})"
+
+
+def generate_source():
+    """生成完全展开的压缩函数源码
+
+    - 52步消息扩展写成直线代码，W0..W67 都是局部变量
+    - 64轮迭代展开，T_j <<< j 折叠为字面常量，前16轮/后48轮的FF、GG直接写成对应的表达式
+    - 每轮只给新产生的 A、C、E、G 赋值，B、D、F、H 通过改名得到，不做元组轮换
+    - 掩码合并：只有之后还要右移（循环移位）的值必须先截断为32位；C、G 和 SS1<<<7
+      只参与按位运算和最终带掩码的加法，高位多出的部分不影响低32位，可以不截断
+    """
+    lines = [
+        "def compress_blocks(v, data, offset=0, end=None):",
+        "    if end is None:",
+        "        end = len(data)",
+        "    unpack_from = _unpack_from",
+        "    V0, V1, V2, V3, V4, V5, V6, V7 = v",
+        f"    for off in range(offset, end, {BLOCK_SIZE}):",
+        "        (" + ", ".join(f"W{i}" for i in range(16)) + ") = unpack_from('>16I', data, off)",
+    ]
+    for j in range(16, 68):
+        lines.append(f"        x = (W{j - 16} ^ W{j - 9} ^ {_rot(f'W{j - 3}', 15)}) & 0xFFFFFFFF")
+        lines.append(f"        W{j} = (x ^ {_rot('x', 15)} ^ {_rot('x', 23)} ^ {_rot(f'W{j - 13}', 7)} ^ W{j - 6})"
+                     f" & 0xFFFFFFFF")
+
+    # names[i] 为当前第i个状态字（A..H）所在的变量名
+    names = [f"V{i}" for i in range(8)]
+    for j in range(64):
+        a, b, c, d, e, f, g, h = names
+        if j < 16:
+            ff, gg = f"({a} ^ {b} ^ {c})", f"({e} ^ {f} ^ {g})"
+        else:
+            ff, gg = f"(({a} & {b}) | ({a} & {c}) | ({b} & {c}))", f"(({e} & {f}) | (~{e} & {g}))"
+        lines += [
+            f"        a12 = {_rot(a, 12)}",
+            f"        ss1 = (a12 + {e} + 0x{_T_ROT[j]:08X}) & 0xFFFFFFFF",
+            f"        ss1 = {_rot('ss1', 7)}",
+            f"        tt2 = ({gg} + {h} + ss1 + W{j}) & 0xFFFFFFFF",
+            f"        A{j} = ({ff} + {d} + (ss1 ^ a12) + (W{j} ^ W{j + 4})) & 0xFFFFFFFF",
+            f"        C{j} = {_rot(b, 9)}",
+            f"        G{j} = {_rot(f, 19)}",
+            f"        E{j} = (tt2 ^ {_rot('tt2', 9)} ^ {_rot('tt2', 17)}) & 0xFFFFFFFF",
+        ]
+        names = [f"A{j}", a, f"C{j}", c, f"E{j}", e, f"G{j}", g]
+
+    for i, name in enumerate(names):
+        lines.append(f"        V{i} ^= {name}")
+    # C、D、G、H 可能带有高位，输出前统一截断
+    lines.append("        V2 &= 0xFFFFFFFF")
+    lines.append("        V3 &= 0xFFFFFFFF")
+    lines.append("        V6 &= 0xFFFFFFFF")
+    lines.append("        V7 &= 0xFFFFFFFF")
+    lines.append("    return V0, V1, V2, V3, V4, V5, V6, V7")
+    return "\n".join(lines) + "\n"
+
+
+def _compile():
+    """编译生成的源码（模块导入时执行一次，结果保存在模块全局变量中）"""
+    import struct
+
+    source = generate_source()
+    namespace = {'_unpack_from': struct.unpack_from}
+    exec(compile(source, '<sm3_unrolled>', 'exec'), namespace)
+    return source, namespace['compress_blocks']
+
+
+SOURCE, compress_blocks = _compile()
+compress_blocks.__doc__ = "对整数个64字节分组执行完全展开的压缩函数，接口与sm3.compress_blocks相同"
+
+
+def unrolled_verification():
+    """与循环版压缩函数对比正确性和速度"""
+    import os
+    import time
+
+    import sm3
+
+    print("SM3展开压缩函数")
+    print("=" * 40)
+    print(f"生成源码: {len(SOURCE.splitlines())} 行")
+    data = os.urandom(64 * 200)
+    ok = compress_blocks(sm3.IV, data) == sm3.compress_blocks(sm3.IV, data)
+    print(f"与循环版一致: {'✓' if ok else '✗'}")
+    print(f"标准向量 abc: {'✓' if sm3.new(b'abc', engine='unrolled').hexdigest().startswith('66c7f0f4') else '✗'}")
+
+    data = os.urandom(128 * 1024)
+    for name, fn in (("循环版", sm3.compress_blocks), ("展开版", compress_blocks)):
+        best = 0.0
+        for _ in range(3):
+            start = time.perf_counter()
+            fn(sm3.IV, data)
+            best = max(best, len(data) / (1024 * 1024) / (time.perf_counter() - start))
+        print(f"{name}: {best:.2f} MB/s")
+
+
+if __name__ == "__main__":
+    unrolled_verification()